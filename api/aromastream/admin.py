@@ -1,14 +1,14 @@
 from django.contrib import admin
-from .models import Video, TimeStamp, ChangeRequest, Subscription
+from .models import Video, TimeStamp, ChangeRequest, Subscription, VideoUpload, MediaJob, APILogEntry, Device
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
 
 @admin.register(Video)
 class VideoAdmin(admin.ModelAdmin):
-    list_display = ('id', 'title', 'created_at', 'updated_at', 'views')
+    list_display = ('id', 'title', 'created_at', 'updated_at', 'views', 'processing_status')
     search_fields = ('title', 'description')
-    list_filter = ('created_at', 'updated_at')
+    list_filter = ('created_at', 'updated_at', 'processing_status')
 
 @admin.register(TimeStamp)
 class TimeStampAdmin(admin.ModelAdmin):
@@ -41,4 +41,31 @@ class SubscriptionAdmin(admin.ModelAdmin):
     def get_user_username(self, obj):
         return obj.user.username
     get_user_username.admin_order_field = 'user'  # Allows column to be sortable
-    get_user_username.short_description = 'User'
\ No newline at end of file
+    get_user_username.short_description = 'User'
+
+
+@admin.register(VideoUpload)
+class VideoUploadAdmin(admin.ModelAdmin):
+    list_display = ('id', 'title', 'user', 'size', 'video', 'created_at')
+    search_fields = ('title',)
+    list_filter = ('created_at',)
+
+
+@admin.register(MediaJob)
+class MediaJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'video', 'status', 'stage', 'progress', 'attempts', 'updated_at')
+    list_filter = ('status',)
+
+
+@admin.register(APILogEntry)
+class APILogEntryAdmin(admin.ModelAdmin):
+    list_display = ('id', 'method', 'path', 'status_code', 'duration_ms', 'user_id', 'created_at')
+    search_fields = ('path', 'url_name')
+    list_filter = ('method', 'status_code', 'url_name')
+
+
+@admin.register(Device)
+class DeviceAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'user', 'room', 'url', 'active', 'healthy', 'last_seen', 'last_latency')
+    search_fields = ('name', 'room', 'user__username')
+    list_filter = ('active', 'healthy', 'room')
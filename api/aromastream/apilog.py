@@ -0,0 +1,223 @@
+import atexit
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from logging.handlers import WatchedFileHandler
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils import timezone
+from django.utils.functional import LazyObject, empty
+from rest_framework.throttling import BaseThrottle
+
+from .authentication import ClaimsUser
+from .periodic import PeriodicTask
+
+
+class RingBuffer:
+    """
+    Bounded buffer that overwrites its oldest entries when full and counts
+    how many were lost.
+    """
+
+    def __init__(self, size):
+        self._entries = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def append(self, entry):
+        with self._lock:
+            if len(self._entries) == self._entries.maxlen:
+                self.dropped += 1
+            self._entries.append(entry)
+
+    def drain(self, limit):
+        with self._lock:
+            count = min(limit, len(self._entries))
+            return [self._entries.popleft() for _ in range(count)]
+
+
+class JSONLinesSink:
+    """
+    Appends to a file shared by every worker. Each line is a single append,
+    so workers never interleave; rotation is left to logrotate, since a
+    worker renaming the file would lose the lines of the others. The file is
+    reopened once it has been moved away.
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(str(path)), exist_ok=True)
+        self.handler = WatchedFileHandler(path, encoding='utf-8')
+
+    def write(self, entries):
+        for entry in entries:
+            entry = dict(entry, created_at=entry['created_at'].isoformat())
+            self.handler.emit(logging.makeLogRecord({'msg': json.dumps(entry), 'args': None}))
+        self.handler.flush()
+
+
+class DatabaseSink:
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    def write(self, entries):
+        from .models import APILogEntry
+        APILogEntry.objects.using(self.alias).bulk_create([APILogEntry(**entry) for entry in entries])
+
+
+class APILogPipeline:
+
+    def __init__(self, sink, buffer_size, batch_size, flush_interval, skip, sample_rates):
+        self.sink = sink
+        self.buffer = RingBuffer(buffer_size)
+        self.batch_size = batch_size
+        self.skip = set(skip)
+        self.sample_rates = sample_rates
+        self.task = PeriodicTask('api-log-flush', flush_interval, self.flush)
+        self._flush_lock = threading.Lock()
+        self.captured = 0
+        self.sampled_out = 0
+        self.written = 0
+        self.failed = 0
+
+    def should_log(self, url_name):
+        if url_name in self.skip:
+            return False
+        rate = self.sample_rates.get(url_name, 1.0)
+        if rate < 1.0 and random.random() >= rate:
+            self.sampled_out += 1
+            return False
+        return True
+
+    def capture(self, entry):
+        self.captured += 1
+        self.buffer.append(entry)
+        self.task.start()
+
+    def flush(self):
+        with self._flush_lock:
+            flushed = 0
+            while True:
+                entries = self.buffer.drain(self.batch_size)
+                if not entries:
+                    return flushed
+                try:
+                    self.sink.write(entries)
+                except Exception:
+                    self.failed += len(entries)
+                    raise
+                self.written += len(entries)
+                flushed += len(entries)
+
+    def stats(self):
+        return {
+            'captured': self.captured,
+            'sampled_out': self.sampled_out,
+            'buffered': len(self.buffer),
+            'dropped': self.buffer.dropped,
+            'written': self.written,
+            'failed': self.failed,
+        }
+
+
+def build_sink():
+    if settings.API_LOG_SINK == 'database':
+        return DatabaseSink(settings.API_LOG_DATABASE)
+    return JSONLinesSink(settings.API_LOG_PATH)
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def get_pipeline():
+    global _pipeline
+    if _pipeline is None:
+        with _pipeline_lock:
+            if _pipeline is None:
+                _pipeline = APILogPipeline(
+                    sink=build_sink(),
+                    buffer_size=settings.API_LOG_BUFFER_SIZE,
+                    batch_size=settings.API_LOG_BATCH_SIZE,
+                    flush_interval=settings.API_LOG_FLUSH_INTERVAL,
+                    skip=settings.API_LOG_SKIP,
+                    sample_rates=settings.API_LOG_SAMPLE_RATES,
+                )
+                atexit.register(_pipeline.flush)
+    return _pipeline
+
+
+def request_user_id(request):
+    # Never force the session-backed lazy user: DRF views replace it with
+    # the authenticated user, anything else is logged anonymously.
+    user = request.__dict__.get('user')
+    if isinstance(user, ClaimsUser):
+        return user.pk
+    if user is None or (isinstance(user, LazyObject) and user._wrapped is empty):
+        return None
+    return user.pk if user.is_authenticated else None
+
+
+def client_ip(request):
+    # X-Forwarded-For is only trusted as far as NUM_PROXIES allows, the same
+    # way the throttles identify clients.
+    return BaseThrottle().get_ident(request)
+
+
+class APILogMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.should_log(request):
+            return self.get_response(request)
+
+        started = time.monotonic()
+        response = self.get_response(request)
+        self.capture(request, response, time.monotonic() - started)
+        return response
+
+    async def __acall__(self, request):
+        if not self.should_log(request):
+            return await self.get_response(request)
+
+        started = time.monotonic()
+        response = await self.get_response(request)
+        self.capture(request, response, time.monotonic() - started)
+        return response
+
+    @staticmethod
+    def should_log(request):
+        return settings.API_LOG_ENABLED and request.path.startswith(settings.API_LOG_PATH_PREFIX)
+
+    @staticmethod
+    def capture(request, response, duration):
+        match = request.resolver_match
+        url_name = match.url_name if match else ''
+        pipeline = get_pipeline()
+        if pipeline.should_log(url_name):
+            pipeline.capture({
+                'url_name': url_name or '',
+                'method': request.method,
+                'path': request.path[:255],
+                'status_code': response.status_code,
+                'duration_ms': round(duration * 1000, 2),
+                'user_id': request_user_id(request),
+                'ip': client_ip(request),
+                'created_at': timezone.now(),
+            })
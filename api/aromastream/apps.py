@@ -1,5 +1,4 @@
 from django.apps import AppConfig
-from django.core.signals import request_finished
 
 class AromastreamConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
@@ -8,7 +7,9 @@ class AromastreamConfig(AppConfig):
     def ready(self):
 
         from . import signals
+        from .cleanup import start_change_request_reaper
+        from .trending import start_trending_updater
 
-        request_finished.connect(signals.user_created)
-
+        start_change_request_reaper()
+        start_trending_updater()
         
\ No newline at end of file
@@ -0,0 +1,156 @@
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from rest_framework import exceptions, status
+from rest_framework.relations import PrimaryKeyRelatedField
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from . import devices
+from .caching import acached_response
+from .models import TimeStamp, Video
+from .serializators import TriggerLookupSerializer, VideoSerializer
+from .throttling import admit_cue, settle_cue
+from .viewcounter import get_view_counter
+from .views import TriggerListView, VideoDetailView, VideoListView
+
+
+class AsyncAPIView(APIView):
+    """
+    APIView with coroutine handlers, served by the ASGI profile.
+
+    DRF dispatches synchronously, so authentication and permission checks
+    are awaited here. Authenticators and permissions may provide
+    ``aauthenticate`` and ``ahas_permission``; the others run in a thread,
+    as do handlers that are not coroutines (such as ``options``).
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await self.ainitial(request, *args, **kwargs)
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+            if iscoroutinefunction(handler):
+                response = await handler(request, *args, **kwargs)
+            else:
+                response = await sync_to_async(handler)(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    async def ainitial(self, request, *args, **kwargs):
+        self.format_kwarg = self.get_format_suffix(**kwargs)
+        request.accepted_renderer, request.accepted_media_type = self.perform_content_negotiation(request)
+        request.version, request.versioning_scheme = self.determine_version(request, *args, **kwargs)
+        await self.aperform_authentication(request)
+        await self.acheck_permissions(request)
+        if self.get_throttles():
+            await sync_to_async(self.check_throttles)(request)
+
+    async def aperform_authentication(self, request):
+        for authenticator in request.authenticators:
+            try:
+                if hasattr(authenticator, 'aauthenticate'):
+                    user_auth_tuple = await authenticator.aauthenticate(request)
+                else:
+                    user_auth_tuple = await sync_to_async(authenticator.authenticate)(request)
+            except exceptions.APIException:
+                request._not_authenticated()
+                raise
+            if user_auth_tuple is not None:
+                request._authenticator = authenticator
+                request.user, request.auth = user_auth_tuple
+                return
+        request._not_authenticated()
+
+    async def acheck_permissions(self, request):
+        for permission in self.get_permissions():
+            if hasattr(permission, 'ahas_permission'):
+                allowed = await permission.ahas_permission(request, self)
+            else:
+                allowed = await sync_to_async(permission.has_permission)(request, self)
+            if not allowed:
+                self.permission_denied(
+                    request, message=getattr(permission, 'message', None), code=getattr(permission, 'code', None)
+                )
+
+
+class AsyncVideoListView(AsyncAPIView, VideoListView):
+    """
+    Cached pages are answered without leaving the event loop; misses are
+    rendered by the page-number/keyset paginator in a thread.
+    """
+
+    @wraps(VideoListView.get)
+    @acached_response('videos')
+    async def get(self, request):
+        return await sync_to_async(self.list_page)(request)
+
+    @wraps(VideoListView.post)
+    async def post(self, request):
+        return await sync_to_async(VideoListView.post)(self, request)
+
+
+class AsyncVideoDetailView(AsyncAPIView, VideoDetailView):
+
+    @wraps(VideoDetailView.get)
+    async def get(self, request, video_id):
+        try:
+            video_id = int(video_id)
+        except ValueError:
+            return Response({"detail": {'video': "Invalid ID."}}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            video = await Video.objects.aget(id=video_id)
+        except Video.DoesNotExist:
+            return Response({"detail": {'video': "not found"}}, status=status.HTTP_404_NOT_FOUND)
+
+        await sync_to_async(get_view_counter().record, thread_sensitive=False)(video.id)
+        video.views += 1
+        serializer = VideoSerializer(video)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class AsyncTriggerListView(AsyncAPIView, TriggerListView):
+    """
+    Calls HTTP devices concurrently on the event loop, so a slow diffuser
+    holds a coroutine instead of a worker.
+    """
+
+    @wraps(TriggerListView.post)
+    async def post(self, request):
+        serializer = TriggerLookupSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        timestamp_id = serializer.validated_data['timestamp']
+        aroma = await TimeStamp.objects.filter(pk=timestamp_id).values_list('aroma', flat=True).afirst()
+        if aroma is None:
+            error = PrimaryKeyRelatedField.default_error_messages['does_not_exist'].format(pk_value=timestamp_id)
+            return Response({'timestamp': [error]}, status=status.HTTP_400_BAD_REQUEST)
+
+        targets = await devices.aresolve_targets(request.user.pk, serializer.validated_data.get('room'))
+        if not targets:
+            return Response({"detail": {'room': "no active devices"}}, status=status.HTTP_404_NOT_FOUND)
+        targets, coalesced = await sync_to_async(admit_cue)(request.user.pk, targets, aroma)
+        if not targets:
+            return self.coalesced_response(request, coalesced)
+        templates = [target.url for target in targets]
+        if self.is_async(request):
+            delivery_ids = await sync_to_async(devices.enqueue_cue)(templates, aroma)
+            await sync_to_async(settle_cue)(request.user.pk, targets, aroma, [bool(delivery) for delivery in delivery_ids], delivery_ids)
+            return self.queued_response(delivery_ids)
+
+        results = await devices.asend_cue(templates, aroma)
+        await sync_to_async(settle_cue)(request.user.pk, targets, aroma, [result.ok for result in results])
+        await sync_to_async(devices.record_health)(targets, results)
+        return self.delivery_response(aroma, targets, results)
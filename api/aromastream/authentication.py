@@ -0,0 +1,229 @@
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.utils.functional import SimpleLazyObject, empty
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.serializers import TokenObtainSlidingSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import SlidingToken
+
+from .entitlements import LocalTTLCache
+
+
+STAFF_CLAIM = 'staff'
+SUPERUSER_CLAIM = 'superuser'
+
+
+class ClaimsSlidingToken(SlidingToken):
+    """
+    Sliding token that also carries the flags most views check, so requests
+    can be authorised without loading the user row. The flags are only
+    trusted while they still match the user, see ``current_claims``.
+    """
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        token[STAFF_CLAIM] = user.is_staff
+        token[SUPERUSER_CLAIM] = user.is_superuser
+        return token
+
+
+local_claims = LocalTTLCache(settings.JWT_CLAIMS_LOCAL_TTL)
+
+
+def claims_cache():
+    return caches[settings.JWT_CLAIMS_CACHE]
+
+
+def claims_key(user_id):
+    return f'claims:user:{user_id}'
+
+
+def user_claims(user):
+    """
+    What a claims token of ``user`` must carry to be trusted: its flags, or
+    False once the user is inactive or deleted.
+    """
+    if user is None or not user.is_active:
+        return False
+    return [user.is_staff, user.is_superuser]
+
+
+def current_claims(user_id):
+    """
+    ``user_claims`` of the user, from a per-process cache first, then the
+    shared cache, then the database.
+    """
+    key = claims_key(user_id)
+    claims = local_claims.get(key)
+    if claims is None:
+        claims = claims_cache().get(key)
+        if claims is None:
+            user = get_user_model().objects.filter(**{api_settings.USER_ID_FIELD: user_id}).only(
+                'is_active', 'is_staff', 'is_superuser').first()
+            claims = user_claims(user)
+            claims_cache().set(key, claims, settings.JWT_CLAIMS_CACHE_TIMEOUT)
+        local_claims.set(key, claims)
+    return claims
+
+
+def update_claims(user_id, claims):
+    key = claims_key(user_id)
+    local_claims.delete(key)
+    claims_cache().set(key, claims, settings.JWT_CLAIMS_CACHE_TIMEOUT)
+
+
+class ClaimsTokenObtainSlidingSerializer(TokenObtainSlidingSerializer):
+    token_class = ClaimsSlidingToken
+
+
+class ClaimsUser(SimpleLazyObject):
+    """
+    Authenticated user built from token claims.
+
+    ``pk``, ``id``, ``is_staff``, ``is_superuser`` and the authentication
+    flags are answered from the token; any other attribute loads the user
+    row once.
+    """
+
+    is_active = True
+    is_anonymous = False
+    is_authenticated = True
+
+    def __init__(self, validated_token):
+        user_id = validated_token[api_settings.USER_ID_CLAIM]
+        self.__dict__['_claims'] = {
+            'pk': user_id,
+            'is_staff': validated_token[STAFF_CLAIM],
+            'is_superuser': validated_token[SUPERUSER_CLAIM],
+        }
+
+        def load():
+            # The user may have been deleted since its claims were checked.
+            try:
+                return get_user_model().objects.get(**{api_settings.USER_ID_FIELD: user_id})
+            except get_user_model().DoesNotExist:
+                raise AuthenticationFailed('User not found', code='user_not_found')
+
+        super().__init__(load)
+
+    @property
+    def pk(self):
+        return self._claims['pk']
+
+    id = pk
+
+    @property
+    def is_staff(self):
+        return self._claims['is_staff']
+
+    @property
+    def is_superuser(self):
+        return self._claims['is_superuser']
+
+    @property
+    def is_loaded(self):
+        return self._wrapped is not empty
+
+
+class VerifiedTokenCache:
+    """
+    Small LRU of validated tokens keyed by the raw token, so a client
+    sending the same token repeatedly skips signature verification. Entries
+    never outlive the token itself.
+    """
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, raw_token):
+        with self._lock:
+            entry = self._entries.get(raw_token)
+            if entry is None:
+                return None
+            token, expires = entry
+            if expires <= time.time():
+                del self._entries[raw_token]
+                return None
+            self._entries.move_to_end(raw_token)
+            return token
+
+    def set(self, raw_token, token):
+        expires = min(time.time() + self.ttl, token.get('exp', 0))
+        with self._lock:
+            self._entries[raw_token] = (token, expires)
+            self._entries.move_to_end(raw_token)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+verified_tokens = VerifiedTokenCache(settings.JWT_VERIFIED_TOKEN_CACHE_SIZE, settings.JWT_VERIFIED_TOKEN_CACHE_TTL)
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that avoids the per-request user SELECT for tokens
+    issued with ClaimsSlidingToken. Tokens without the claims, or whose
+    claims no longer match an active user, fall back to the database
+    lookup, which rejects inactive and deleted users.
+    """
+
+    def get_validated_token(self, raw_token):
+        if not settings.JWT_VERIFIED_TOKEN_CACHE_TTL:
+            return super().get_validated_token(raw_token)
+        token = verified_tokens.get(raw_token)
+        if token is None:
+            token = super().get_validated_token(raw_token)
+            verified_tokens.set(raw_token, token)
+        return token
+
+    def get_user(self, validated_token):
+        if self.has_claims(validated_token):
+            if self.claims_match(validated_token, current_claims(validated_token[api_settings.USER_ID_CLAIM])):
+                return ClaimsUser(validated_token)
+        return super().get_user(validated_token)
+
+    async def aauthenticate(self, request):
+        """
+        ``authenticate`` for async views. Claims tokens whose state is cached
+        in process are checked without blocking; anything else runs the
+        lookups in a thread.
+        """
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        if self.has_claims(validated_token):
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+            # Only a miss of the per-process cache needs a thread.
+            claims = local_claims.get(claims_key(user_id))
+            if claims is None:
+                claims = await sync_to_async(current_claims)(user_id)
+            if self.claims_match(validated_token, claims):
+                return ClaimsUser(validated_token), validated_token
+        return await sync_to_async(super().get_user)(validated_token), validated_token
+
+    @staticmethod
+    def has_claims(validated_token):
+        return STAFF_CLAIM in validated_token and SUPERUSER_CLAIM in validated_token and api_settings.USER_ID_CLAIM in validated_token
+
+    @staticmethod
+    def claims_match(validated_token, claims):
+        return claims == [validated_token[STAFF_CLAIM], validated_token[SUPERUSER_CLAIM]]
@@ -0,0 +1,126 @@
+"""
+PostgreSQL backend that hands connections back to a per-process pool
+instead of closing them.
+
+Meant for the ASGI profile: every request runs its database work in a fresh
+thread context, so persistent connections (CONN_MAX_AGE) are never reused
+and each request would connect again. Configure with
+``OPTIONS['pool'] = {'size': 20, 'timeout': 10}`` and ``CONN_MAX_AGE = 0``.
+"""
+import threading
+from collections import deque
+
+from django.db.backends.postgresql import base
+from django.db.backends.postgresql.psycopg_any import IsolationLevel
+from psycopg2 import extensions
+
+Database = base.Database
+
+
+class ConnectionPool:
+    """
+    At most ``size`` connections of one database alias. Callers wait up to
+    ``timeout`` seconds for a free connection; idle ones are checked with
+    ``SELECT 1`` before reuse when health checks are enabled.
+    """
+
+    def __init__(self, size, timeout):
+        self.size = size
+        self.timeout = timeout
+        self._idle = deque()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+
+    def getconn(self, connect, check=False):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise Database.OperationalError(f'No free database connection within {self.timeout} seconds (pool size {self.size})')
+        try:
+            while True:
+                with self._lock:
+                    connection = self._idle.pop() if self._idle else None
+                if connection is None:
+                    return connect()
+                if not connection.closed and (not check or self.is_usable(connection)):
+                    return connection
+                self.discard(connection)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def putconn(self, connection):
+        try:
+            if connection.closed:
+                return
+            status = connection.info.transaction_status
+            if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                self.discard(connection)
+                return
+            if status != extensions.TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+            with self._lock:
+                self._idle.append(connection)
+        except Database.Error:
+            self.discard(connection)
+        finally:
+            self._slots.release()
+
+    @staticmethod
+    def is_usable(connection):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+        except Database.Error:
+            return False
+        return True
+
+    @staticmethod
+    def discard(connection):
+        try:
+            connection.close()
+        except Database.Error:
+            pass
+
+    def close(self):
+        with self._lock:
+            while self._idle:
+                self.discard(self._idle.pop())
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, options):
+    with _pools_lock:
+        pool = _pools.get(alias)
+        if pool is None:
+            pool = _pools[alias] = ConnectionPool(options.get('size', 10), options.get('timeout', 10))
+    return pool
+
+
+def close_pools():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_connection_params(self):
+        conn_params = super().get_connection_params()
+        conn_params.pop('pool', None)
+        return conn_params
+
+    def get_new_connection(self, conn_params):
+        pool = get_pool(self.alias, self.settings_dict['OPTIONS'].get('pool', {}))
+        connection = pool.getconn(
+            lambda: super(DatabaseWrapper, self).get_new_connection(conn_params),
+            check=self.settings_dict['CONN_HEALTH_CHECKS'],
+        )
+        self.isolation_level = IsolationLevel(self.settings_dict['OPTIONS'].get('isolation_level', IsolationLevel.READ_COMMITTED))
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            get_pool(self.alias, self.settings_dict['OPTIONS'].get('pool', {})).putconn(self.connection)
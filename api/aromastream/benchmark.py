@@ -0,0 +1,245 @@
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from django.db import connection, connections
+from django.test import Client
+
+
+BENCHMARK_PREFIX = 'bench'
+BENCHMARK_PASSWORD = 'benchmark-password'
+SEARCH_WORDS = ['lavender', 'ocean', 'forest', 'citrus', 'coffee', 'rain', 'pine', 'vanilla']
+FLOWS = ('login', 'list', 'search', 'detail', 'trigger')
+NETWORK_ERROR = 599
+
+
+class FakeDevice:
+    """
+    Local stand-in for the ESP32 diffuser: answers /A - /D after
+    ``latency`` seconds.
+    """
+
+    def __init__(self, port=0, latency=0.0):
+        latency_seconds = latency
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                time.sleep(latency_seconds)
+                found = self.path.strip('/') in ('A', 'B', 'C', 'D')
+                self.send_response(200 if found else 404)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(target=self.server.serve_forever, name='fake-device', daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f'http://{host}:{port}/{{}}'
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class QueryCounter:
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class InProcessTransport:
+    """
+    Drives the API through Django's test client in the benchmark process,
+    which also allows counting the queries of every request.
+    """
+
+    counts_queries = True
+
+    def __init__(self):
+        self.client = Client(HTTP_HOST='localhost')
+
+    def request(self, method, path, token=None, data=None):
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {token}'} if token else {}
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            if method == 'GET':
+                response = self.client.get(path, data, **headers)
+            else:
+                response = self.client.post(path, json.dumps(data), content_type='application/json', **headers)
+        return response.status_code, response.content, counter.count
+
+    def close(self):
+        connections.close_all()
+
+
+class HTTPTransport:
+
+    counts_queries = False
+
+    def __init__(self, base_url, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def request(self, method, path, token=None, data=None):
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        try:
+            if method == 'GET':
+                response = self.session.get(self.base_url + path, params=data, headers=headers, timeout=self.timeout)
+            else:
+                response = self.session.post(self.base_url + path, json=data, headers=headers, timeout=self.timeout)
+        except requests.RequestException:
+            # A saturated server that drops or stalls connections counts as an error.
+            return NETWORK_ERROR, b'', None
+        return response.status_code, response.content, None
+
+    def close(self):
+        self.session.close()
+
+
+class Fixtures:
+    """
+    Ids of seeded rows the flows pick from.
+    """
+
+    def __init__(self, usernames, video_ids, timestamp_ids):
+        if not usernames or not video_ids or not timestamp_ids:
+            raise ValueError('No benchmark data, run the seed_benchmark command first')
+        self.usernames = usernames
+        self.video_ids = video_ids
+        self.timestamp_ids = timestamp_ids
+
+
+def login(transport, username):
+    status_code, content, _ = transport.request('POST', '/api/login/', data={'username': username, 'password': BENCHMARK_PASSWORD})
+    if status_code != 200:
+        raise RuntimeError(f'Login of {username} failed with {status_code}')
+    return json.loads(content)['token']
+
+
+def flow_request(flow, fixtures, rng):
+    """
+    Returns (method, path, data, needs_token) of one request of ``flow``.
+    """
+    if flow == 'login':
+        return 'POST', '/api/login/', {'username': rng.choice(fixtures.usernames), 'password': BENCHMARK_PASSWORD}, False
+    if flow == 'list':
+        return 'GET', '/api/videos/', {'page_size': 20}, True
+    if flow == 'search':
+        return 'GET', '/api/videos/search/', {'query': rng.choice(SEARCH_WORDS)}, True
+    if flow == 'detail':
+        return 'GET', f'/api/videos/{rng.choice(fixtures.video_ids)}/', None, True
+    if flow == 'trigger':
+        return 'POST', '/api/arduino/trigger', {'timestamp': rng.choice(fixtures.timestamp_ids)}, True
+    raise ValueError(f'Unknown flow {flow}')
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = fraction * (len(ordered) - 1)
+    lower = int(index)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (index - lower)
+
+
+def summarize(latencies, errors, queries, elapsed):
+    rounded = lambda value: None if value is None else round(value * 1000, 2)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'mean_ms': rounded(sum(latencies) / len(latencies)) if latencies else None,
+        'p50_ms': rounded(percentile(latencies, 0.50)),
+        'p95_ms': rounded(percentile(latencies, 0.95)),
+        'p99_ms': rounded(percentile(latencies, 0.99)),
+        'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+    }
+
+
+def run_flow(flow, transport_factory, fixtures, requests_count, concurrency, seed=0):
+    """
+    Sends ``requests_count`` requests of ``flow`` from ``concurrency``
+    threads, each with its own transport and token.
+    """
+    per_worker = [requests_count // concurrency + (1 if index < requests_count % concurrency else 0) for index in range(concurrency)]
+    results = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(concurrency)
+
+    def worker(index):
+        rng = random.Random(seed + index)
+        transport = transport_factory()
+        latencies, queries, errors = [], [], 0
+        flow_started = finished = None
+        try:
+            try:
+                token = login(transport, fixtures.usernames[index % len(fixtures.usernames)])
+            except Exception:
+                barrier.abort()
+                raise
+            barrier.wait()
+            flow_started = time.perf_counter()
+            for _ in range(per_worker[index]):
+                method, path, data, needs_token = flow_request(flow, fixtures, rng)
+                started = time.perf_counter()
+                status_code, _, query_count = transport.request(method, path, token if needs_token else None, data)
+                latencies.append(time.perf_counter() - started)
+                if status_code >= 400:
+                    errors += 1
+                if query_count is not None:
+                    queries.append(query_count)
+            finished = time.perf_counter()
+        finally:
+            transport.close()
+            with lock:
+                results.append((latencies, queries, errors, flow_started, finished))
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(worker, index) for index in range(concurrency)]:
+            future.result()
+    elapsed = max(result[4] for result in results) - min(result[3] for result in results)
+
+    latencies = [value for result in results for value in result[0]]
+    queries = [value for result in results for value in result[1]]
+    return summarize(latencies, sum(result[2] for result in results), queries, elapsed)
+
+
+def compare(baseline, current, threshold):
+    """
+    Returns (flow, metric, before, after, change) rows and the rows whose
+    latency grew by more than ``threshold`` (a fraction).
+    """
+    rows, regressions = [], []
+    for flow, stats in current['flows'].items():
+        before_stats = baseline.get('flows', {}).get(flow)
+        if not before_stats:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps', 'queries_per_request'):
+            before, after = before_stats.get(metric), stats.get(metric)
+            if not before or after is None:
+                continue
+            row = (flow, metric, before, after, (after - before) / before)
+            rows.append(row)
+            if metric.endswith('_ms') and row[4] > threshold:
+                regressions.append(row)
+    return rows, regressions
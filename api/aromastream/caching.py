@@ -0,0 +1,148 @@
+import hashlib
+from contextlib import nullcontext
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from .routers import primary_reads
+
+
+def page_cache():
+    return caches[settings.CATALOGUE_CACHE]
+
+
+def version_cache():
+    return caches[settings.CATALOGUE_VERSION_CACHE]
+
+
+def version_key(namespace):
+    return f'catalogue:version:{namespace}'
+
+
+def namespace_version(namespace):
+    return version_cache().get_or_set(version_key(namespace), 1, None)
+
+
+async def anamespace_version(namespace):
+    return await version_cache().aget_or_set(version_key(namespace), 1, None)
+
+
+def invalidated_key(namespace):
+    return f'catalogue:invalidated:{namespace}'
+
+
+def invalidate(*namespaces):
+    cache = version_cache()
+    for namespace in namespaces:
+        try:
+            cache.incr(version_key(namespace))
+        except ValueError:
+            cache.set(version_key(namespace), 1, None)
+        if settings.DATABASE_READ_REPLICAS:
+            cache.set(invalidated_key(namespace), True, settings.DATABASE_REPLICA_MAX_LAG)
+
+
+def fill_reads(namespace):
+    """
+    Until a replica has caught up with an invalidation, pages are filled from
+    the primary; a page read from a lagging replica would be cached under the
+    new version and served until it expires.
+    """
+    if settings.DATABASE_READ_REPLICAS and version_cache().get(invalidated_key(namespace)):
+        return primary_reads()
+    return nullcontext()
+
+
+async def afill_reads(namespace):
+    if settings.DATABASE_READ_REPLICAS and await version_cache().aget(invalidated_key(namespace)):
+        return primary_reads()
+    return nullcontext()
+
+
+def page_digest(request):
+    query = sorted(request.GET.lists())
+    return hashlib.md5(f'{request.path}?{query}'.encode()).hexdigest()
+
+
+def page_key(namespace, request):
+    return f'catalogue:page:{namespace}:{namespace_version(namespace)}:{page_digest(request)}'
+
+
+async def apage_key(namespace, request):
+    return f'catalogue:page:{namespace}:{await anamespace_version(namespace)}:{page_digest(request)}'
+
+
+def etag_matches(request, etag):
+    if_none_match = request.headers.get('If-None-Match', '')
+    return etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*'
+
+
+def build_response(request, data, etag, max_age=None):
+    if etag_matches(request, etag):
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = Response(data)
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache' if max_age is None else f'private, max-age={max_age}'
+    return response
+
+
+def response_etag(response):
+    return '"{}"'.format(hashlib.md5(JSONRenderer().render(response.data)).hexdigest())
+
+
+def cached_response(namespace, max_age=None):
+    """
+    Caches successful responses of a view method per namespace and query.
+
+    ``namespace`` is a string or a callable receiving the view kwargs.
+    Invalidating a namespace bumps its version, so stale pages are never
+    looked up again and simply expire. Clients revalidate every response
+    with its ETag unless ``max_age`` lets them reuse it for that long.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            name = namespace(**kwargs) if callable(namespace) else namespace
+            key = page_key(name, request)
+            cached = page_cache().get(key)
+            if cached is not None:
+                return build_response(request, *cached, max_age=max_age)
+
+            with fill_reads(name):
+                response = method(view, request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            etag = response_etag(response)
+            page_cache().set(key, (response.data, etag), settings.CATALOGUE_CACHE_TIMEOUT)
+            return build_response(request, response.data, etag, max_age=max_age)
+        return wrapper
+    return decorator
+
+
+def acached_response(namespace, max_age=None):
+    """
+    ``cached_response`` for coroutine view methods.
+    """
+    def decorator(method):
+        @wraps(method)
+        async def wrapper(view, request, *args, **kwargs):
+            name = namespace(**kwargs) if callable(namespace) else namespace
+            key = await apage_key(name, request)
+            cached = await page_cache().aget(key)
+            if cached is not None:
+                return build_response(request, *cached, max_age=max_age)
+
+            with await afill_reads(name):
+                response = await method(view, request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            etag = response_etag(response)
+            await page_cache().aset(key, (response.data, etag), settings.CATALOGUE_CACHE_TIMEOUT)
+            return build_response(request, response.data, etag, max_age=max_age)
+        return wrapper
+    return decorator
@@ -0,0 +1,31 @@
+import threading
+
+from django.conf import settings
+
+from .models import ChangeRequest
+from .periodic import PeriodicTask
+
+
+def reap_change_requests(batch_size=None):
+    return ChangeRequest.delete_expired(batch_size or settings.CHANGE_REQUEST_REAP_BATCH_SIZE)
+
+
+_reaper = None
+_reaper_lock = threading.Lock()
+
+
+def start_change_request_reaper():
+    """
+    Starts the in-process reaper of expired change requests when
+    CHANGE_REQUEST_REAP_INTERVAL is set. Every process that loads the app
+    gets its own, so this suits single-process deployments; uWSGI runs the
+    reap_change_requests command from its master instead.
+    """
+    global _reaper
+    if settings.CHANGE_REQUEST_REAP_INTERVAL is None:
+        return
+    if _reaper is None:
+        with _reaper_lock:
+            if _reaper is None:
+                _reaper = PeriodicTask('change-request-reaper', settings.CHANGE_REQUEST_REAP_INTERVAL, reap_change_requests)
+    _reaper.start()
@@ -0,0 +1,166 @@
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import push
+from .dispatcher import DeliveryResult, aroma_url, get_async_dispatcher, get_dispatcher
+from .models import Device
+
+
+class Target:
+    """
+    One destination of an aroma command: a registered device, or the
+    ARDUINO_URL fallback when the user has none.
+    """
+
+    def __init__(self, url, device=None):
+        self.url = url
+        self.device = device
+
+    @property
+    def device_id(self):
+        return self.device.pk if self.device else None
+
+
+def target_devices(user_id, room=None):
+    """
+    Active devices of a room (shared ones and the user's own) or, without a
+    room, every active device of the user.
+    """
+    devices = Device.objects.filter(active=True)
+    if room:
+        devices = devices.filter(Q(user__isnull=True) | Q(user_id=user_id), room=room)
+    else:
+        devices = devices.filter(user_id=user_id)
+    return devices.only('id', 'url', 'healthy', 'transport').order_by('id')
+
+
+def device_target(device):
+    return Target(f'{push.DELIVERY_PREFIX}{device.pk}' if device.transport == 'push' else device.url, device)
+
+
+def device_targets(devices, room):
+    """
+    Only users without any device fall back to ARDUINO_URL; HTTP devices
+    without a URL are skipped instead of being sent there.
+    """
+    if not devices and not room:
+        return [Target(settings.ARDUINO_URL)]
+    return [device_target(device) for device in devices if device.transport != 'http' or device.url]
+
+
+def resolve_targets(user_id, room=None):
+    return device_targets(list(target_devices(user_id, room)), room)
+
+
+async def aresolve_targets(user_id, room=None):
+    return device_targets([device async for device in target_devices(user_id, room)], room)
+
+
+def is_push(template):
+    return bool(template) and template.startswith(push.DELIVERY_PREFIX)
+
+
+def push_device_id(template):
+    return int(template[len(push.DELIVERY_PREFIX):])
+
+
+def lead_command(template, aroma):
+    """
+    Key under which the lead time estimate of an aroma on a target is kept.
+    """
+    if is_push(template):
+        return push.lead_command(push_device_id(template), aroma)
+    return aroma_url(aroma, template)
+
+
+def send_cue(templates, aroma):
+    """
+    Delivers an aroma to every target and waits for the HTTP devices. Push
+    devices count as delivered once the cue is in their outbox.
+    """
+    results = [None] * len(templates)
+    http = []
+    for index, template in enumerate(templates):
+        if is_push(template):
+            push.push_cue(push_device_id(template), aroma)
+            results[index] = DeliveryResult(template, status_code=200)
+        else:
+            http.append(index)
+    sent = get_dispatcher().send_many([aroma_url(aroma, templates[index]) for index in http])
+    for index, result in zip(http, sent):
+        results[index] = result
+    return results
+
+
+async def asend_cue(templates, aroma):
+    """
+    ``send_cue`` for async views: HTTP devices are called concurrently on the
+    event loop instead of from the fan-out threads.
+    """
+    results = [None] * len(templates)
+    http = []
+    for index, template in enumerate(templates):
+        if is_push(template):
+            await sync_to_async(push.push_cue)(push_device_id(template), aroma)
+            results[index] = DeliveryResult(template, status_code=200)
+        else:
+            http.append(index)
+    sent = await get_async_dispatcher().send_many([aroma_url(aroma, templates[index]) for index in http])
+    for index, result in zip(http, sent):
+        results[index] = result
+    return results
+
+
+def enqueue_cue(templates, aroma):
+    """
+    Queues an aroma for every target and returns their delivery ids (None
+    when a device queue is full).
+    """
+    dispatcher = get_dispatcher()
+    return [
+        push.delivery_id(push.push_cue(push_device_id(template), aroma)) if is_push(template)
+        else dispatcher.enqueue(aroma_url(aroma, template))
+        for template in templates
+    ]
+
+
+_last_written = {}
+_unwritten_failures = {}
+_last_written_lock = threading.Lock()
+
+
+def record_health(targets, results):
+    """
+    Persists reachability and latency of registered devices. Writes happen
+    when the health flips, otherwise at most every DEVICE_HEALTH_WRITE_INTERVAL
+    seconds per device. Failures in between are counted in memory and added
+    to ``failures`` with the next write; a success resets them.
+    """
+    now = time.monotonic()
+    for target, result in zip(targets, results):
+        device = target.device
+        if device is None or result.skipped or is_push(target.url):
+            continue
+        healthy = result.status_code is not None
+        with _last_written_lock:
+            if healthy:
+                _unwritten_failures.pop(device.pk, None)
+            else:
+                _unwritten_failures[device.pk] = _unwritten_failures.get(device.pk, 0) + 1
+            due = now - _last_written.get(device.pk, float('-inf')) >= settings.DEVICE_HEALTH_WRITE_INTERVAL
+            if healthy == device.healthy and not due:
+                continue
+            _last_written[device.pk] = now
+            failures = _unwritten_failures.pop(device.pk, 0)
+        if healthy:
+            Device.objects.filter(pk=device.pk).update(
+                healthy=True, failures=0, last_seen=timezone.now(), last_latency=round(result.elapsed * 1000, 1)
+            )
+        else:
+            Device.objects.filter(pk=device.pk).update(healthy=False, failures=F('failures') + failures)
+        device.healthy = healthy
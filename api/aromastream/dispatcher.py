@@ -0,0 +1,325 @@
+import asyncio
+import contextvars
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from uuid import uuid4
+
+import requests
+from asgiref.sync import sync_to_async
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from django.core.cache import caches
+
+from .leadtime import observe_round_trip
+from .metrics import record_device_call
+
+
+STATUS_QUEUED = 'queued'
+STATUS_DELIVERED = 'delivered'
+STATUS_FAILED = 'failed'
+STATUS_SKIPPED = 'skipped'
+
+CIRCUIT_OPEN = 'CircuitOpen'
+
+
+def status_cache():
+    return caches[settings.ARDUINO_STATUS_CACHE]
+
+
+class DeliveryResult:
+
+    def __init__(self, url, status_code=None, error=None, elapsed=0.0):
+        self.url = url
+        self.status_code = status_code
+        self.error = error
+        self.elapsed = elapsed
+
+    @property
+    def ok(self):
+        return self.status_code == 200
+
+    @property
+    def skipped(self):
+        return self.error == CIRCUIT_OPEN
+
+    @property
+    def status(self):
+        if self.ok:
+            return STATUS_DELIVERED
+        return STATUS_SKIPPED if self.skipped else STATUS_FAILED
+
+    def as_dict(self):
+        return {
+            'status': self.status,
+            'status_code': self.status_code,
+            'error': self.error,
+            'elapsed_ms': round(self.elapsed * 1000, 1),
+        }
+
+
+class CircuitBreaker:
+    """
+    Opens after ``threshold`` consecutive unreachable calls and rejects
+    calls for ``cooldown`` seconds; afterwards a single trial call decides
+    whether it closes again.
+    """
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self._trial or time.monotonic() - self.opened_at < self.cooldown:
+                return False
+            self._trial = True
+            return True
+
+    def record(self, reachable):
+        with self._lock:
+            self._trial = False
+            if reachable:
+                self.failures = 0
+                self.opened_at = None
+                return
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+class TriggerDispatcher:
+    """
+    Delivers aroma commands to devices over pooled keep-alive sessions.
+
+    Every device (scheme + host + port) gets its own session, circuit
+    breaker and bounded queue drained by a dedicated worker thread, so a
+    slow or offline diffuser only delays its own commands.
+    """
+
+    def __init__(self, connect_timeout, read_timeout, queue_size, pool_size, status_ttl,
+                 breaker_threshold=3, breaker_cooldown=30, fanout_workers=8):
+        self.timeout = (connect_timeout, read_timeout)
+        self.queue_size = queue_size
+        self.pool_size = pool_size
+        self.status_ttl = status_ttl
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self._sessions = {}
+        self._queues = {}
+        self._breakers = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=fanout_workers, thread_name_prefix='trigger-fanout')
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            connect_timeout=settings.ARDUINO_CONNECT_TIMEOUT,
+            read_timeout=settings.ARDUINO_READ_TIMEOUT,
+            queue_size=settings.ARDUINO_QUEUE_SIZE,
+            pool_size=settings.ARDUINO_POOL_SIZE,
+            status_ttl=settings.ARDUINO_STATUS_TTL,
+            breaker_threshold=settings.DEVICE_BREAKER_THRESHOLD,
+            breaker_cooldown=settings.DEVICE_BREAKER_COOLDOWN,
+            fanout_workers=settings.DEVICE_FANOUT_WORKERS,
+        )
+
+    @staticmethod
+    def device_key(url):
+        parts = urlsplit(url)
+        return f'{parts.scheme}://{parts.netloc}'
+
+    def get_session(self, url):
+        key = self.device_key(url)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+                session.mount(key, adapter)
+                self._sessions[key] = session
+        return session
+
+    def get_breaker(self, url):
+        key = self.device_key(url)
+        with self._lock:
+            breaker = self._breakers.get(key)
+            if breaker is None:
+                breaker = self._breakers[key] = CircuitBreaker(self.breaker_threshold, self.breaker_cooldown)
+        return breaker
+
+    def send(self, url):
+        breaker = self.get_breaker(url)
+        if not breaker.allow():
+            return DeliveryResult(url, error=CIRCUIT_OPEN)
+        started = time.monotonic()
+        try:
+            response = self.get_session(url).get(url, timeout=self.timeout)
+        except requests.RequestException as exc:
+            result = DeliveryResult(url, error=exc.__class__.__name__, elapsed=time.monotonic() - started)
+        else:
+            result = DeliveryResult(url, status_code=response.status_code, elapsed=time.monotonic() - started)
+        breaker.record(result.status_code is not None)
+        record_device_call(self.device_key(url), result.elapsed)
+        if result.ok:
+            observe_round_trip(url, result.elapsed)
+        return result
+
+    def send_many(self, urls):
+        """
+        Sends to several devices concurrently; results keep the order of
+        ``urls``.
+        """
+        if len(urls) == 1:
+            return [self.send(urls[0])]
+        futures = [self._executor.submit(contextvars.copy_context().run, self.send, url) for url in urls]
+        return [future.result() for future in futures]
+
+    def enqueue(self, url):
+        delivery_id = uuid4().hex
+        device_queue = self._get_queue(url)
+        self._set_status(delivery_id, {'status': STATUS_QUEUED})
+        try:
+            device_queue.put_nowait((delivery_id, url))
+        except queue.Full:
+            status_cache().delete(self._status_key(delivery_id))
+            return None
+        return delivery_id
+
+    def status(self, delivery_id):
+        return status_cache().get(self._status_key(delivery_id))
+
+    def _get_queue(self, url):
+        key = self.device_key(url)
+        with self._lock:
+            device_queue = self._queues.get(key)
+            if device_queue is None:
+                device_queue = queue.Queue(maxsize=self.queue_size)
+                worker = threading.Thread(target=self._work, args=(device_queue,), name=f'trigger-{key}', daemon=True)
+                worker.start()
+                self._queues[key] = device_queue
+        return device_queue
+
+    def _work(self, device_queue):
+        while True:
+            delivery_id, url = device_queue.get()
+            try:
+                self._set_status(delivery_id, self.send(url).as_dict())
+            finally:
+                device_queue.task_done()
+
+    def _set_status(self, delivery_id, data):
+        status_cache().set(self._status_key(delivery_id), data, self.status_ttl)
+
+    @staticmethod
+    def _status_key(delivery_id):
+        return f'trigger:delivery:{delivery_id}'
+
+
+class AsyncTriggerDispatcher:
+    """
+    Coroutine counterpart of ``TriggerDispatcher.send`` for the async views
+    of the ASGI profile. Requests go through one httpx client per event
+    loop, and the circuit breakers are shared with the threaded dispatcher,
+    so both paths see the same device health.
+    """
+
+    def __init__(self, dispatcher, connect_timeout, read_timeout, pool_size):
+        self.dispatcher = dispatcher
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.pool_size = pool_size
+        self._clients = {}
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            get_dispatcher(),
+            connect_timeout=settings.ARDUINO_CONNECT_TIMEOUT,
+            read_timeout=settings.ARDUINO_READ_TIMEOUT,
+            pool_size=settings.ARDUINO_POOL_SIZE,
+        )
+
+    def get_client(self):
+        import httpx
+
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = self._clients[loop] = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+                limits=httpx.Limits(max_connections=None, max_keepalive_connections=self.pool_size * 16),
+            )
+        return client
+
+    async def send(self, url):
+        import httpx
+
+        breaker = self.dispatcher.get_breaker(url)
+        if not breaker.allow():
+            return DeliveryResult(url, error=CIRCUIT_OPEN)
+        started = time.monotonic()
+        try:
+            response = await self.get_client().get(url)
+        except httpx.HTTPError as exc:
+            result = DeliveryResult(url, error=exc.__class__.__name__, elapsed=time.monotonic() - started)
+        else:
+            result = DeliveryResult(url, status_code=response.status_code, elapsed=time.monotonic() - started)
+        breaker.record(result.status_code is not None)
+        record_device_call(self.dispatcher.device_key(url), result.elapsed)
+        if result.ok:
+            await sync_to_async(observe_round_trip, thread_sensitive=False)(url, result.elapsed)
+        return result
+
+    async def send_many(self, urls):
+        return list(await asyncio.gather(*(self.send(url) for url in urls)))
+
+    async def aclose(self):
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+
+def aroma_url(aroma, template=None):
+    url = (template or settings.ARDUINO_URL).format(aroma)
+    if '://' not in url:
+        url = 'http://' + url
+    return url
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = TriggerDispatcher.from_settings()
+    return _dispatcher
+
+
+_async_dispatcher = None
+_async_dispatcher_lock = threading.Lock()
+
+
+def get_async_dispatcher():
+    global _async_dispatcher
+    if _async_dispatcher is None:
+        with _async_dispatcher_lock:
+            if _async_dispatcher is None:
+                _async_dispatcher = AsyncTriggerDispatcher.from_settings()
+    return _async_dispatcher
@@ -0,0 +1,82 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .models import Subscription
+
+
+class LocalTTLCache:
+    """
+    Per-process dictionary with a short lifetime per entry, in front of the
+    shared cache.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry[1] <= time.monotonic():
+            return None
+        return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+local_entitlements = LocalTTLCache(settings.ENTITLEMENT_LOCAL_TTL)
+
+
+def entitlement_cache():
+    return caches[settings.ENTITLEMENT_CACHE]
+
+
+def entitlement_key(user_id):
+    return f'entitlement:subscription:{user_id}'
+
+
+def has_active_subscription(user_id):
+    """
+    Whether the user has an active subscription. Answers come from a
+    per-process cache first, then the shared cache, then the database.
+    """
+    key = entitlement_key(user_id)
+    active = local_entitlements.get(key)
+    if active is None:
+        active = entitlement_cache().get(key)
+        if active is None:
+            active = Subscription.objects.filter(user_id=user_id, active=True).exists()
+            entitlement_cache().set(key, active, settings.ENTITLEMENT_CACHE_TIMEOUT)
+        local_entitlements.set(key, active)
+    return active
+
+
+async def ahas_active_subscription(user_id):
+    key = entitlement_key(user_id)
+    active = local_entitlements.get(key)
+    if active is None:
+        active = await entitlement_cache().aget(key)
+        if active is None:
+            active = await Subscription.objects.filter(user_id=user_id, active=True).aexists()
+            await entitlement_cache().aset(key, active, settings.ENTITLEMENT_CACHE_TIMEOUT)
+        local_entitlements.set(key, active)
+    return active
+
+
+def invalidate_entitlement(user_id):
+    key = entitlement_key(user_id)
+    local_entitlements.delete(key)
+    entitlement_cache().delete(key)
@@ -0,0 +1,90 @@
+import hashlib
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class LeadTimeEstimator:
+    """
+    Exponentially weighted estimate of how long after sending a command its
+    aroma is actually released, kept per command (device + aroma) in a
+    shared cache so every worker schedules with the same numbers.
+
+    For HTTP devices a sample is the round-trip of a successful call minus
+    the time the firmware spends actuating before it answers (see
+    ``observe_round_trip``), which errs late by the one-way return latency.
+    Push devices report their actuation time themselves.
+
+    Latency varies, so a cue is sent ``deviations`` mean deviations earlier
+    than the average, releasing the scent slightly early rather than late.
+    """
+
+    def __init__(self, alpha, default, maximum, cache_alias, deviations=0):
+        self.alpha = alpha
+        self.default = default
+        self.maximum = maximum
+        self.cache_alias = cache_alias
+        self.deviations = deviations
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    @staticmethod
+    def key(command):
+        return 'leadtime:' + hashlib.md5(command.encode()).hexdigest()
+
+    def stats(self, command):
+        return self.cache.get(self.key(command))
+
+    def observe(self, command, seconds):
+        seconds = min(max(seconds, 0.0), self.maximum)
+        with self._lock:
+            stats = self.stats(command)
+            if stats is None:
+                stats = {'mean': seconds, 'deviation': seconds / 2, 'samples': 1}
+            else:
+                error = seconds - stats['mean']
+                stats = {
+                    'mean': stats['mean'] + self.alpha * error,
+                    'deviation': stats['deviation'] + self.alpha * (abs(error) - stats['deviation']),
+                    'samples': stats['samples'] + 1,
+                }
+            self.cache.set(self.key(command), stats, None)
+        return stats
+
+    def lead(self, command):
+        stats = self.stats(command)
+        if stats is None:
+            return self.default
+        return min(stats['mean'] + self.deviations * stats['deviation'], self.maximum)
+
+
+_estimator = None
+_estimator_lock = threading.Lock()
+
+
+def get_estimator():
+    global _estimator
+    if _estimator is None:
+        with _estimator_lock:
+            if _estimator is None:
+                _estimator = LeadTimeEstimator(
+                    alpha=settings.LEAD_TIME_ALPHA,
+                    default=settings.LEAD_TIME_DEFAULT,
+                    maximum=settings.LEAD_TIME_MAX,
+                    cache_alias=settings.LEAD_TIME_CACHE,
+                    deviations=settings.LEAD_TIME_DEVIATIONS,
+                )
+    return _estimator
+
+
+def observe_round_trip(command, seconds):
+    """
+    Learns from a successful HTTP call. The firmware turns the fan on as the
+    request arrives but holds the answer until the servo has moved there and
+    back (LEAD_TIME_HTTP_ACTUATION), which is not part of the lead.
+    """
+    return get_estimator().observe(command, seconds - settings.LEAD_TIME_HTTP_ACTUATION)
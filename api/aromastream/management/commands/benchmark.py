@@ -0,0 +1,106 @@
+import json
+import platform
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from aromastream.benchmark import (
+    BENCHMARK_PREFIX, FLOWS, FakeDevice, Fixtures, HTTPTransport, InProcessTransport, compare, run_flow
+)
+from aromastream.models import TimeStamp, Video
+
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Measure latency, throughput and queries per request of the main API flows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--flows', default=','.join(FLOWS), help=f"Comma separated subset of {', '.join(FLOWS)}")
+        parser.add_argument('--requests', type=int, default=500, help='Requests per flow')
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--sweep', help='Comma separated concurrency levels, e.g. 1,8,32,128; results are keyed flow@concurrency')
+        parser.add_argument('--base-url', help='Benchmark a running server instead of the in-process test client')
+        parser.add_argument('--timeout', type=float, default=30, help='Request timeout against --base-url; timed out requests count as errors')
+        parser.add_argument('--device-latency', type=float, default=0.02, help='Response delay of the fake device in seconds')
+        parser.add_argument('--device-port', type=int, default=0, help='Port of the fake device, random by default')
+        parser.add_argument('--output', help='Result file, benchmarks/<timestamp>.json by default')
+        parser.add_argument('--compare', help='Previous result file to compare with')
+        parser.add_argument('--threshold', type=float, default=0.2, help='Allowed latency growth when comparing')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--throttle', action='store_true', help='Keep THROTTLE_POLICIES and trigger coalescing for in-process runs')
+
+    def handle(self, *args, **options):
+        flows = [flow.strip() for flow in options['flows'].split(',') if flow.strip()]
+        unknown = set(flows) - set(FLOWS)
+        if unknown:
+            raise CommandError(f"Unknown flows: {', '.join(sorted(unknown))}")
+
+        try:
+            fixtures = Fixtures(
+                usernames=list(User.objects.filter(username__startswith=f'{BENCHMARK_PREFIX}-').values_list('username', flat=True)[:1000]),
+                video_ids=list(Video.objects.filter(title__startswith=f'{BENCHMARK_PREFIX} ').values_list('pk', flat=True)[:10000]),
+                timestamp_ids=list(TimeStamp.objects.filter(video__title__startswith=f'{BENCHMARK_PREFIX} ').values_list('pk', flat=True)[:10000]),
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        try:
+            levels = [int(level) for level in options['sweep'].split(',')] if options['sweep'] else [options['concurrency']]
+        except ValueError:
+            raise CommandError('--sweep expects comma separated integers')
+
+        base_url = options['base_url']
+        if base_url:
+            transport_factory = lambda: HTTPTransport(base_url, options['timeout'])
+        else:
+            transport_factory = InProcessTransport
+
+        with FakeDevice(options['device_port'], options['device_latency']) as device:
+            if base_url:
+                self.stdout.write(f'Fake device listening on {device.url}, point ARDUINO_URL of the server at it')
+            overrides = {'ARDUINO_URL': device.url, 'ALLOWED_HOSTS': settings.ALLOWED_HOSTS + ['localhost']}
+            if not options['throttle']:
+                overrides.update(THROTTLE_POLICIES={}, TRIGGER_COALESCE_WINDOW=0)
+            with override_settings(**overrides):
+                results = {}
+                for flow in flows:
+                    for level in levels:
+                        key = f'{flow}@{level}' if options['sweep'] else flow
+                        results[key] = run_flow(flow, transport_factory, fixtures, options['requests'], level, options['seed'])
+                        self.stdout.write(self.format_result(key, results[key]))
+
+        report = {
+            'created_at': datetime.now().isoformat(),
+            'target': base_url or 'in-process',
+            'concurrency': levels if options['sweep'] else options['concurrency'],
+            'requests': options['requests'],
+            'device_latency': options['device_latency'],
+            'python': platform.python_version(),
+            'flows': results,
+        }
+        output = Path(options['output'] or settings.BASE_DIR / 'benchmarks' / f"{datetime.now():%Y%m%d-%H%M%S}.json")
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(report, indent=2))
+        self.stdout.write(self.style.SUCCESS(f'Results written to {output}'))
+
+        if options['compare']:
+            with open(options['compare']) as file:
+                baseline = json.load(file)
+            rows, regressions = compare(baseline, report, options['threshold'])
+            for flow, metric, before, after, change in rows:
+                self.stdout.write(f'{flow:>12} {metric:<20} {before:>10} -> {after:<10} {change:+.1%}')
+            if regressions:
+                raise CommandError(f'{len(regressions)} latency regressions above {options["threshold"]:.0%}')
+
+    @staticmethod
+    def format_result(flow, result):
+        return (
+            f"{flow:>12}: p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms, p99 {result['p99_ms']} ms, "
+            f"{result['throughput_rps']} req/s, {result['errors']} errors, {result['queries_per_request']} queries/request"
+        )
@@ -0,0 +1,98 @@
+import asyncio
+import json
+import time
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Relay pushed cues from the device gateway to a diffuser on the local network'
+
+    def add_arguments(self, parser):
+        parser.add_argument('gateway', help='WebSocket URL, e.g. wss://example.com/ws/devices/')
+        parser.add_argument('token', help='Token of the push device')
+        parser.add_argument('device_url', help='Local URL template of the diffuser, e.g. http://192.168.1.20:1203/{}')
+        parser.add_argument('--timeout', type=float, default=5)
+        parser.add_argument('--reconnect-delay', type=float, default=2)
+        parser.add_argument('--sync-interval', type=float, default=30, help='Seconds between clock offset measurements')
+
+    def handle(self, *args, **options):
+        try:
+            import websockets
+        except ImportError:
+            raise CommandError('The websockets package is required: pip install websockets')
+        try:
+            asyncio.run(self.relay(websockets, options))
+        except KeyboardInterrupt:
+            pass
+
+    async def relay(self, websockets, options):
+        session = requests.Session()
+        last_seq = 0
+        headers = {'Authorization': f"Device {options['token']}"}
+        while True:
+            scheduled = {}
+            try:
+                async with websockets.connect(options['gateway'], additional_headers=headers) as socket:
+                    self.stdout.write(f"Connected to {options['gateway']}")
+                    await socket.send(json.dumps({'type': 'hello', 'last_seq': last_seq}))
+                    clock = {'offset': 0.0}
+                    syncer = asyncio.create_task(self.sync_clock(socket, options['sync_interval']))
+                    try:
+                        async for frame in socket:
+                            message = json.loads(frame)
+                            kind = message.get('type')
+                            if kind == 'sync':
+                                received = time.time()
+                                clock['offset'] = message['server_time'] - (message['t0'] + received) / 2
+                                continue
+                            if kind not in ('cue', 'cancel') or message['seq'] <= last_seq:
+                                continue
+                            if kind == 'cancel':
+                                task = scheduled.pop(message['cancels'], None)
+                                if task is not None:
+                                    task.cancel()
+                            elif 'fire_at' in message:
+                                # Acknowledged on receipt, the cue is held until fire_at.
+                                delay = message['fire_at'] - clock['offset'] - time.time()
+                                scheduled[message['seq']] = asyncio.create_task(
+                                    self.fire(session, socket, message, delay, options)
+                                )
+                            elif not await self.fire(session, socket, message, 0, options):
+                                continue
+                            last_seq = message['seq']
+                            await socket.send(json.dumps({'type': 'ack', 'seq': last_seq}))
+                    finally:
+                        syncer.cancel()
+            except (OSError, websockets.WebSocketException) as exc:
+                self.stderr.write(f'Gateway connection lost: {exc}')
+            for task in scheduled.values():
+                task.cancel()
+            await asyncio.sleep(options['reconnect_delay'])
+
+    async def sync_clock(self, socket, interval):
+        while True:
+            await socket.send(json.dumps({'type': 'sync', 't0': time.time()}))
+            await asyncio.sleep(interval)
+
+    async def fire(self, session, socket, message, delay, options):
+        """
+        Calls the diffuser after ``delay`` seconds and reports how long it
+        took to actuate, which the server uses as the lead time of the aroma.
+        """
+        if delay > 0:
+            await asyncio.sleep(delay)
+        url = options['device_url'].format(message['aroma'])
+        started = time.monotonic()
+        try:
+            await asyncio.to_thread(session.get, url, timeout=options['timeout'])
+        except requests.RequestException as exc:
+            self.stderr.write(f"Cue {message['seq']} failed: {exc}")
+            return False
+        lead_ms = round((time.monotonic() - started) * 1000, 1)
+        try:
+            await socket.send(json.dumps({'type': 'fired', 'seq': message['seq'], 'lead_ms': lead_ms}))
+        except Exception:
+            pass
+        return True
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from aromastream.viewcounter import get_view_counter
+
+
+class Command(BaseCommand):
+    help = 'Write buffered video views to the database'
+
+    def handle(self, *args, **options):
+        flushed = get_view_counter().flush()
+        self.stdout.write(self.style.SUCCESS(f'Flushed {flushed} views'))
@@ -0,0 +1,42 @@
+import multiprocessing
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from aromastream.media import claim_job, process_job
+
+
+def work(once, poll_interval):
+    while True:
+        job = claim_job()
+        if job is None:
+            if once:
+                return
+            time.sleep(poll_interval)
+            continue
+        process_job(job)
+
+
+class Command(BaseCommand):
+    help = 'Run the media processing worker for uploaded videos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1, help='Number of worker processes')
+        parser.add_argument('--poll-interval', type=float, default=2.0)
+        parser.add_argument('--once', action='store_true', help='Exit when the queue is empty')
+
+    def handle(self, *args, **options):
+        if options['processes'] <= 1:
+            work(options['once'], options['poll_interval'])
+            return
+
+        connections.close_all()
+        workers = [
+            multiprocessing.Process(target=work, args=(options['once'], options['poll_interval']), daemon=True)
+            for _ in range(options['processes'])
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
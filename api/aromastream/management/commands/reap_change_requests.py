@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from aromastream.cleanup import reap_change_requests
+
+
+class Command(BaseCommand):
+    help = 'Delete expired password change requests'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.CHANGE_REQUEST_REAP_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        deleted = reap_change_requests(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} expired change requests'))
@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from aromastream.uploads import reap_uploads
+
+
+class Command(BaseCommand):
+    help = 'Delete abandoned resumable uploads and their partial files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ttl', type=int, default=settings.VIDEO_UPLOAD_TTL)
+
+    def handle(self, *args, **options):
+        deleted = reap_uploads(options['ttl'])
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} abandoned uploads'))
@@ -0,0 +1,70 @@
+import random
+from datetime import time
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from aromastream.benchmark import BENCHMARK_PASSWORD, BENCHMARK_PREFIX, SEARCH_WORDS
+from aromastream.caching import invalidate
+from aromastream.models import Subscription, TimeStamp, Video
+from aromastream.search import update_search_vector
+
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Seed users, videos and timestamps for the benchmark command'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--videos', type=int, default=5000)
+        parser.add_argument('--timestamps-per-video', type=int, default=20)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--clear', action='store_true', help='Delete previously seeded rows first')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        batch_size = options['batch_size']
+
+        with transaction.atomic():
+            if options['clear']:
+                Video.objects.filter(title__startswith=f'{BENCHMARK_PREFIX} ').delete()
+                User.objects.filter(username__startswith=f'{BENCHMARK_PREFIX}-').delete()
+
+            existing = User.objects.filter(username__startswith=f'{BENCHMARK_PREFIX}-').count()
+            password = make_password(BENCHMARK_PASSWORD)
+            users = User.objects.bulk_create([
+                User(username=f'{BENCHMARK_PREFIX}-{existing + index}', email=f'{BENCHMARK_PREFIX}-{existing + index}@example.com', password=password)
+                for index in range(options['users'])
+            ], batch_size=batch_size)
+            Subscription.objects.bulk_create([Subscription(user=user, active=True) for user in users], batch_size=batch_size)
+
+            videos = Video.objects.bulk_create([
+                Video(
+                    title=f'{BENCHMARK_PREFIX} ' + ' '.join(rng.sample(SEARCH_WORDS, 3)),
+                    description=' '.join(rng.choices(SEARCH_WORDS, k=20)),
+                    views=int(rng.paretovariate(1.2) * 10),
+                    processing_status='ready',
+                )
+                for _ in range(options['videos'])
+            ], batch_size=batch_size)
+            update_search_vector(Video.objects.filter(pk__in=[video.pk for video in videos]))
+
+            timestamps = []
+            for video in videos:
+                for _ in range(options['timestamps_per_video']):
+                    seconds = rng.randrange(3 * 60 * 60)
+                    timestamps.append(TimeStamp(video=video, aroma=rng.choice('ABCD'), moment=time(seconds // 3600, seconds // 60 % 60, seconds % 60)))
+                if len(timestamps) >= batch_size:
+                    TimeStamp.objects.bulk_create(timestamps, batch_size=batch_size)
+                    timestamps = []
+            TimeStamp.objects.bulk_create(timestamps, batch_size=batch_size)
+
+        invalidate('videos')
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {len(users)} users, {len(videos)} videos and {len(videos) * options['timestamps_per_video']} timestamps"
+        ))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from aromastream.models import Video
+from aromastream.search import update_search_vector
+
+
+class Command(BaseCommand):
+    help = 'Fill the stored full-text search vector of existing videos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--missing', action='store_true', help='Only update videos without a search vector')
+
+    def handle(self, *args, **options):
+        videos = Video.objects.order_by('pk')
+        if options['missing']:
+            videos = videos.filter(search_vector__isnull=True)
+
+        updated = 0
+        last_pk = 0
+        while True:
+            pks = list(videos.filter(pk__gt=last_pk).values_list('pk', flat=True)[:options['batch_size']])
+            if not pks:
+                break
+            updated += update_search_vector(Video.objects.filter(pk__in=pks))
+            last_pk = pks[-1]
+        self.stdout.write(self.style.SUCCESS(f'Updated {updated} videos'))
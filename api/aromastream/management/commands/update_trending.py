@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from aromastream.trending import update_trending
+
+
+class Command(BaseCommand):
+    help = 'Update time-decayed trending scores and the ranking of popular videos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Recompute the scores from the retained hourly buckets')
+
+    def handle(self, *args, **options):
+        ranked = update_trending(rebuild=options['rebuild'])
+        if ranked is None:
+            self.stdout.write('Another update is running')
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Ranked {ranked} videos'))
@@ -0,0 +1,151 @@
+import json
+import logging
+import os
+import subprocess
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .caching import invalidate
+from .models import MediaJob, Video, upload_file_path
+
+
+logger = logging.getLogger(__name__)
+
+STAGES = ('probe', 'faststart', 'poster', 'rendition')
+
+
+class MediaError(Exception):
+    pass
+
+
+def probe(path):
+    command = [settings.FFPROBE_BINARY, '-v', 'error', '-print_format', 'json', '-show_format', '-show_streams', path]
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise MediaError(result.stderr.strip() or 'ffprobe failed')
+    data = json.loads(result.stdout)
+    video_stream = next((stream for stream in data.get('streams', []) if stream.get('codec_type') == 'video'), {})
+    media_format = data.get('format', {})
+    return {
+        'duration': float(media_format['duration']) if media_format.get('duration') else None,
+        'width': video_stream.get('width'),
+        'height': video_stream.get('height'),
+        'bitrate': int(media_format['bit_rate']) if media_format.get('bit_rate') else None,
+    }
+
+
+def ffmpeg(arguments, duration=None, on_progress=None):
+    """
+    Runs ffmpeg, reporting the fraction of ``duration`` encoded so far.
+    """
+    command = [settings.FFMPEG_BINARY, '-y', '-v', 'error', '-progress', 'pipe:1', '-nostats'] + arguments
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    for line in process.stdout:
+        key, _, value = line.strip().partition('=')
+        if key == 'out_time_us' and duration and on_progress and value.isdigit():
+            on_progress(min(int(value) / 1_000_000 / duration, 1.0))
+    stderr = process.stderr.read()
+    if process.wait() != 0:
+        raise MediaError(stderr.strip() or 'ffmpeg failed')
+
+
+def retry_at(attempts):
+    """
+    When a job that failed ``attempts`` times may run again; the delay
+    doubles with every attempt.
+    """
+    return timezone.now() + timedelta(seconds=settings.MEDIA_JOB_RETRY_DELAY * 2 ** max(attempts - 1, 0))
+
+
+def requeue_stale_jobs():
+    """
+    Returns the jobs of crashed workers to the queue, or fails them when
+    they have used up MEDIA_JOB_MAX_ATTEMPTS, so a video that kills the
+    worker is not processed forever.
+    """
+    stale = timezone.now() - timedelta(seconds=settings.MEDIA_JOB_TIMEOUT)
+    for job in MediaJob.objects.filter(status='running', started_at__lt=stale).only('id', 'video_id', 'attempts'):
+        fields = {'error': 'worker timed out', 'updated_at': timezone.now()}
+        if job.attempts < settings.MEDIA_JOB_MAX_ATTEMPTS:
+            fields.update(status='pending', retry_at=retry_at(job.attempts))
+        else:
+            fields.update(status='failed')
+        if MediaJob.objects.filter(pk=job.pk, status='running', started_at__lt=stale).update(**fields) and fields['status'] == 'failed':
+            update_video(job.video_id, processing_status='failed')
+
+
+def claim_job():
+    requeue_stale_jobs()
+    with transaction.atomic():
+        job = (MediaJob.objects.select_for_update(skip_locked=True)
+               .filter(Q(retry_at__isnull=True) | Q(retry_at__lte=timezone.now()), status='pending')
+               .order_by('created_at').first())
+        if job is None:
+            return None
+        job.status = 'running'
+        job.attempts += 1
+        job.started_at = timezone.now()
+        job.save(update_fields=['status', 'attempts', 'started_at', 'updated_at'])
+    return job
+
+
+def update_video(video_id, **fields):
+    Video.objects.filter(pk=video_id).update(**fields)
+    invalidate('videos')
+
+
+def process_job(job):
+    video = job.video
+    update_video(video.pk, processing_status='processing')
+
+    def report(stage, fraction):
+        progress = round((STAGES.index(stage) + fraction) / len(STAGES) * 100, 1)
+        MediaJob.objects.filter(pk=job.pk).update(stage=stage, progress=progress, updated_at=timezone.now())
+
+    try:
+        source = video.file.path
+
+        report('probe', 0)
+        metadata = probe(source)
+        update_video(video.pk, **metadata)
+        duration = metadata['duration']
+
+        report('faststart', 0)
+        temporary = source + '.faststart.mp4'
+        ffmpeg(['-i', source, '-c', 'copy', '-movflags', '+faststart', temporary], duration,
+               lambda fraction: report('faststart', fraction))
+        os.replace(temporary, source)
+
+        report('poster', 0)
+        poster = upload_file_path(video, 'poster.jpg')
+        os.makedirs(os.path.dirname(default_storage.path(poster)), exist_ok=True)
+        offset = min(settings.MEDIA_POSTER_OFFSET, (duration or 0) / 2)
+        ffmpeg(['-ss', str(offset), '-i', source, '-frames:v', '1', default_storage.path(poster)])
+        update_video(video.pk, poster=poster)
+
+        report('rendition', 0)
+        height = settings.MEDIA_RENDITION_HEIGHT
+        if metadata['height'] and metadata['height'] > height:
+            rendition = upload_file_path(video, 'rendition.mp4')
+            ffmpeg(['-i', source, '-vf', f'scale=-2:{height}', '-c:v', 'libx264', '-preset', 'veryfast',
+                    '-crf', str(settings.MEDIA_RENDITION_CRF), '-c:a', 'aac', '-b:a', '96k',
+                    '-movflags', '+faststart', default_storage.path(rendition)], duration,
+                   lambda fraction: report('rendition', fraction))
+            update_video(video.pk, rendition=rendition)
+    except Exception as exc:
+        logger.exception('Processing of video %s failed', video.pk)
+        retry = job.attempts < settings.MEDIA_JOB_MAX_ATTEMPTS
+        MediaJob.objects.filter(pk=job.pk).update(status='pending' if retry else 'failed', error=str(exc),
+                                                  retry_at=retry_at(job.attempts) if retry else None, updated_at=timezone.now())
+        if not retry:
+            update_video(video.pk, processing_status='failed')
+        return False
+
+    MediaJob.objects.filter(pk=job.pk).update(status='done', stage='', progress=100, error='', updated_at=timezone.now())
+    update_video(video.pk, processing_status='ready')
+    return True
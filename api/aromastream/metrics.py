@@ -0,0 +1,315 @@
+import atexit
+import json
+import logging
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+from .periodic import PeriodicTask
+
+
+logger = logging.getLogger('aromastream.slow_requests')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+_current = ContextVar('aromastream_request_metrics', default=None)
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            yield f'{name}_bucket', dict(labels, le=str(bound)), cumulative
+        yield f'{name}_sum', labels, self.sum
+        yield f'{name}_count', labels, self.count
+
+
+class MemoryMetricsStore:
+    """
+    Per-process totals, so a scrape only sees the worker that answers it.
+    """
+
+    def __init__(self):
+        self._totals = {}
+        self._lock = threading.Lock()
+
+    def add(self, deltas):
+        with self._lock:
+            for key, value in deltas.items():
+                self._totals[key] = self._totals.get(key, 0) + value
+
+    def totals(self):
+        with self._lock:
+            return dict(self._totals)
+
+
+class SQLiteMetricsStore:
+    """
+    Totals kept in a local SQLite file, shared by every worker on the host.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS samples (name TEXT NOT NULL, labels TEXT NOT NULL, '
+                               'field TEXT NOT NULL, value REAL NOT NULL, PRIMARY KEY (name, labels, field))')
+            self._local.connection = connection
+        return connection
+
+    def add(self, deltas):
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.executemany(
+                'INSERT INTO samples (name, labels, field, value) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (name, labels, field) DO UPDATE SET value = value + excluded.value',
+                [(name, json.dumps(labels), field, value) for (name, labels, field), value in deltas.items()],
+            )
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def totals(self):
+        rows = self.connection.execute('SELECT name, labels, field, value FROM samples')
+        return {(name, tuple(map(tuple, json.loads(labels))), field): value for name, labels, field, value in rows}
+
+
+class MetricsRegistry:
+    """
+    Metrics rendered in the Prometheus text exposition format. Observations
+    are summed in process and added to the shared ``store`` every
+    ``flush_interval`` seconds and before every scrape, so the worker that
+    answers a scrape reports the totals of all of them.
+    """
+
+    HISTOGRAMS = {
+        'aromastream_request_duration_seconds': ('Request latency.', LATENCY_BUCKETS),
+        'aromastream_request_db_seconds': ('Time spent in database queries per request.', LATENCY_BUCKETS),
+        'aromastream_request_db_queries': ('Database queries per request.', QUERY_BUCKETS),
+        'aromastream_request_device_seconds': ('Time spent calling aroma devices per request.', LATENCY_BUCKETS),
+        'aromastream_request_app_seconds': ('Request latency not spent in the database or on devices.', LATENCY_BUCKETS),
+        'aromastream_device_call_seconds': ('Latency of single aroma device calls.', LATENCY_BUCKETS),
+    }
+    COUNTERS = {
+        'aromastream_requests_total': 'Handled requests.',
+        'aromastream_slow_requests_total': 'Requests slower than METRICS_SLOW_REQUEST_THRESHOLD.',
+    }
+
+    def __init__(self, store, flush_interval):
+        self.store = store
+        self.task = PeriodicTask('metrics-flush', flush_interval, self.flush)
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def _add(self, key, value):
+        self._pending[key] = self._pending.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        labels = tuple(sorted(labels.items()))
+        with self._lock:
+            self._add((name, labels, str(bisect_left(self.HISTOGRAMS[name][1], value))), 1)
+            self._add((name, labels, 'sum'), value)
+            self._add((name, labels, 'count'), 1)
+        self.task.start()
+
+    def increment(self, name, **labels):
+        with self._lock:
+            self._add((name, tuple(sorted(labels.items())), 'value'), 1)
+        self.task.start()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        try:
+            self.store.add(pending)
+        except Exception:
+            with self._lock:
+                for key, value in pending.items():
+                    self._add(key, value)
+            raise
+
+    def render(self):
+        self.flush()
+        histograms, counters = {}, {}
+        for (name, labels, field), value in self.store.totals().items():
+            if name in self.HISTOGRAMS:
+                histogram = histograms.get((name, labels))
+                if histogram is None:
+                    histogram = histograms[(name, labels)] = Histogram(self.HISTOGRAMS[name][1])
+                if field == 'sum':
+                    histogram.sum = float(value)
+                elif field == 'count':
+                    histogram.count = int(value)
+                else:
+                    histogram.counts[int(field)] = int(value)
+            elif name in self.COUNTERS:
+                counters[(name, labels)] = int(value)
+
+        lines = []
+        for name, (help_text, _) in self.HISTOGRAMS.items():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+            for (key, labels), histogram in sorted(histograms.items()):
+                if key == name:
+                    for sample, sample_labels, value in histogram.samples(name, dict(labels)):
+                        lines.append(format_sample(sample, sample_labels, value))
+        for name, help_text in self.COUNTERS.items():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+            for (key, labels), value in sorted(counters.items()):
+                if key == name:
+                    lines.append(format_sample(name, dict(labels), value))
+        return '\n'.join(lines) + '\n'
+
+
+def format_sample(name, labels, value):
+    rendered = ','.join(f'{key}="{escape(val)}"' for key, val in labels.items())
+    return f'{name}{{{rendered}}} {value:g}' if isinstance(value, float) else f'{name}{{{rendered}}} {value}'
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                if settings.METRICS_BACKEND == 'sqlite':
+                    store = SQLiteMetricsStore(settings.METRICS_PATH)
+                else:
+                    store = MemoryMetricsStore()
+                _registry = MetricsRegistry(store, settings.METRICS_FLUSH_INTERVAL)
+                atexit.register(_registry.flush)
+    return _registry
+
+
+class RequestMetrics:
+
+    def __init__(self, capture_sql):
+        self.queries = 0
+        self.db_time = 0.0
+        self.device_time = 0.0
+        self.capture_sql = capture_sql
+        self.sql = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.monotonic()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.monotonic() - started
+            self.queries += 1
+            self.db_time += elapsed
+            if self.capture_sql and len(self.sql) < settings.METRICS_SLOW_REQUEST_MAX_QUERIES:
+                self.sql.append((round(elapsed * 1000, 2), sql))
+
+
+def record_device_call(device, elapsed):
+    """
+    Called by the trigger dispatcher for every device request, inside or
+    outside of a request cycle.
+    """
+    get_registry().observe('aromastream_device_call_seconds', elapsed, device=device)
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.device_time += elapsed
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+
+        metrics, started, token, stack = self.begin()
+        try:
+            response = self.get_response(request)
+        finally:
+            stack.close()
+            _current.reset(token)
+        self.finish(request, response, metrics, time.monotonic() - started)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.METRICS_ENABLED:
+            return await self.get_response(request)
+
+        metrics, started, token, stack = self.begin()
+        try:
+            response = await self.get_response(request)
+        finally:
+            stack.close()
+            _current.reset(token)
+        self.finish(request, response, metrics, time.monotonic() - started)
+        return response
+
+    @staticmethod
+    def begin():
+        threshold = settings.METRICS_SLOW_REQUEST_THRESHOLD
+        metrics = RequestMetrics(capture_sql=threshold is not None)
+        token = _current.set(metrics)
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(metrics))
+        return metrics, time.monotonic(), token, stack
+
+    @staticmethod
+    def finish(request, response, metrics, duration):
+        threshold = settings.METRICS_SLOW_REQUEST_THRESHOLD
+        match = request.resolver_match
+        view = match.url_name if match and match.url_name else 'unmatched'
+        registry = get_registry()
+        registry.increment('aromastream_requests_total', view=view, method=request.method, status=response.status_code)
+        registry.observe('aromastream_request_duration_seconds', duration, view=view, method=request.method)
+        registry.observe('aromastream_request_db_seconds', metrics.db_time, view=view, method=request.method)
+        registry.observe('aromastream_request_db_queries', metrics.queries, view=view, method=request.method)
+        registry.observe('aromastream_request_device_seconds', metrics.device_time, view=view, method=request.method)
+        registry.observe('aromastream_request_app_seconds', max(duration - metrics.db_time - metrics.device_time, 0),
+                         view=view, method=request.method)
+
+        if threshold is not None and duration >= threshold:
+            registry.increment('aromastream_slow_requests_total', view=view, method=request.method)
+            logger.warning(
+                'Slow request %s %s (%s): %.1f ms, %d queries in %.1f ms, devices %.1f ms\n%s',
+                request.method, request.path, view, duration * 1000, metrics.queries, metrics.db_time * 1000,
+                metrics.device_time * 1000, '\n'.join(f'  [{ms} ms] {sql}' for ms, sql in metrics.sql)
+            )
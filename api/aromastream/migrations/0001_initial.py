@@ -0,0 +1,212 @@
+# Generated by Django 5.0.6 on 2026-10-18 09:21
+
+import aromastream.models
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+import django.core.validators
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='APILogEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url_name', models.CharField(blank=True, max_length=100)),
+                ('method', models.CharField(max_length=10)),
+                ('path', models.CharField(max_length=255)),
+                ('status_code', models.PositiveSmallIntegerField()),
+                ('duration_ms', models.FloatField()),
+                ('user_id', models.BigIntegerField(blank=True, null=True)),
+                ('ip', models.GenericIPAddressField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Device',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('room', models.CharField(blank=True, max_length=100)),
+                ('transport', models.CharField(choices=[('http', 'http'), ('push', 'push')], default='http', max_length=10)),
+                ('url', models.CharField(blank=True, help_text='URL template of an aroma command, e.g. http://192.168.1.20:1203/{}', max_length=255)),
+                ('last_seq', models.BigIntegerField(default=0)),
+                ('active', models.BooleanField(default=True)),
+                ('healthy', models.BooleanField(default=True)),
+                ('failures', models.IntegerField(default=0)),
+                ('last_seen', models.DateTimeField(blank=True, null=True)),
+                ('last_latency', models.FloatField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='devices', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DeviceMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.BigIntegerField()),
+                ('kind', models.CharField(choices=[('cue', 'cue'), ('cancel', 'cancel')], default='cue', max_length=10)),
+                ('aroma', models.CharField(blank=True, choices=[('A', 'A'), ('B', 'B'), ('C', 'C'), ('D', 'D')], max_length=1)),
+                ('fire_at', models.FloatField(blank=True, help_text='Server clock time (UNIX seconds) to actuate at; empty means immediately', null=True)),
+                ('cancels', models.BigIntegerField(blank=True, help_text='Sequence number of the cue a cancel message revokes', null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('acked_at', models.DateTimeField(blank=True, null=True)),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='aromastream.device')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Subscription',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('active', models.BooleanField(blank=True, default=False)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='subscription', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Video',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=400)),
+                ('description', models.TextField()),
+                ('file', models.FileField(upload_to=aromastream.models.upload_file_path, validators=[django.core.validators.FileExtensionValidator(allowed_extensions=['mp4'])])),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('views', models.IntegerField(blank=True, default=0)),
+                ('search_vector', django.contrib.postgres.search.SearchVectorField(editable=False, null=True)),
+                ('processing_status', models.CharField(blank=True, choices=[('pending', 'pending'), ('processing', 'processing'), ('ready', 'ready'), ('failed', 'failed')], default='pending', max_length=20)),
+                ('duration', models.FloatField(blank=True, null=True)),
+                ('width', models.IntegerField(blank=True, null=True)),
+                ('height', models.IntegerField(blank=True, null=True)),
+                ('bitrate', models.IntegerField(blank=True, null=True)),
+                ('poster', models.FileField(blank=True, null=True, upload_to=aromastream.models.upload_file_path)),
+                ('rendition', models.FileField(blank=True, null=True, upload_to=aromastream.models.upload_file_path)),
+                ('trending_score', models.FloatField(default=0, editable=False)),
+                ('trending_rank', models.IntegerField(blank=True, editable=False, null=True)),
+            ],
+            options={
+                'indexes': [django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='aromastream_search__ae69cb_gin'), models.Index(fields=['-views', '-id'], name='video_views_id_idx'), models.Index(fields=['-trending_score', '-id'], name='video_trending_score_idx'), models.Index(fields=['trending_rank', 'id'], name='video_trending_rank_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='TimeStamp',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('aroma', models.CharField(choices=[('A', 'A'), ('B', 'B'), ('C', 'C'), ('D', 'D')], max_length=1)),
+                ('moment', models.TimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('video', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='aromastream.video')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MediaJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('running', 'running'), ('done', 'done'), ('failed', 'failed')], default='pending', max_length=20)),
+                ('stage', models.CharField(blank=True, max_length=20)),
+                ('progress', models.FloatField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('attempts', models.IntegerField(default=0)),
+                ('retry_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('video', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='media_jobs', to='aromastream.video')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='VideoUpload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('title', models.CharField(max_length=400)),
+                ('description', models.TextField()),
+                ('file', models.CharField(max_length=255)),
+                ('size', models.BigIntegerField()),
+                ('chunk_size', models.IntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='video_uploads', to=settings.AUTH_USER_MODEL)),
+                ('video', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='upload', to='aromastream.video')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='VideoUploadChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.IntegerField()),
+                ('size', models.IntegerField()),
+                ('checksum', models.CharField(max_length=64)),
+                ('upload', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='aromastream.videoupload')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='VideoViewBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('views', models.IntegerField(default=0)),
+                ('applied', models.IntegerField(default=0)),
+                ('video', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='view_buckets', to='aromastream.video')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ChangeRequest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field', models.CharField(choices=[('password', 'password')], max_length=100)),
+                ('new_value', models.TextField()),
+                ('confirm_code', models.CharField(max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recovery_records', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'confirm_code', 'field'], name='change_request_confirm_idx'), models.Index(fields=['created_at'], name='change_request_created_idx')],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='device',
+            index=models.Index(fields=['user', 'active'], name='device_user_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='device',
+            index=models.Index(fields=['room', 'active'], name='device_room_active_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='devicemessage',
+            constraint=models.UniqueConstraint(fields=('device', 'seq'), name='unique_device_message_seq'),
+        ),
+        migrations.AddIndex(
+            model_name='timestamp',
+            index=models.Index(fields=['video', 'created_at', 'id'], name='timestamp_video_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='timestamp',
+            index=models.Index(fields=['video', 'moment'], name='timestamp_video_moment_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mediajob',
+            index=models.Index(fields=['status', 'created_at'], name='media_job_status_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='videouploadchunk',
+            constraint=models.UniqueConstraint(fields=('upload', 'index'), name='unique_video_upload_chunk'),
+        ),
+        migrations.AddIndex(
+            model_name='videoviewbucket',
+            index=models.Index(fields=['hour'], name='video_view_bucket_hour_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='videoviewbucket',
+            constraint=models.UniqueConstraint(fields=('video', 'hour'), name='video_view_bucket_unique'),
+        ),
+    ]
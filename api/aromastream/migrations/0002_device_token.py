@@ -0,0 +1,32 @@
+import aromastream.models
+from django.db import migrations, models
+
+
+def populate_tokens(apps, schema_editor):
+    # A callable default is evaluated once when a column is added, so every
+    # existing device would get the same token and the unique index fails.
+    Device = apps.get_model('aromastream', 'Device')
+    for device in Device.objects.filter(token__isnull=True).only('id'):
+        device.token = aromastream.models.generate_device_token()
+        device.save(update_fields=['token'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aromastream', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='device',
+            name='token',
+            field=models.CharField(help_text='Secret a push device connects with', max_length=64, null=True),
+        ),
+        migrations.RunPython(populate_tokens, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='device',
+            name='token',
+            field=models.CharField(default=aromastream.models.generate_device_token, help_text='Secret a push device connects with', max_length=64, unique=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.0.6 on 2026-10-18 09:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aromastream', '0002_device_token'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('updated_at', models.FloatField(blank=True, help_text='UNIX time of the last update', null=True)),
+            ],
+        ),
+    ]
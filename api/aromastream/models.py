@@ -1,10 +1,15 @@
+from django.conf import settings
 from django.db import models
 from uuid import uuid4
+import secrets
 from datetime import datetime
 from django.contrib.auth import get_user_model
 from datetime import timedelta
 from django.utils import timezone
+from django.core.exceptions import ValidationError
 from django.core.validators import FileExtensionValidator
+from django.contrib.postgres.search import SearchVectorField
+from django.contrib.postgres.indexes import GinIndex
 
 def upload_file_path(instance, file_name):
     ext = file_name.split('.')[-1]
@@ -23,16 +28,123 @@ class Video(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     views = models.IntegerField(default=0, blank=True)
+    search_vector = SearchVectorField(null=True, editable=False)
+    processing_choices = [('pending', 'pending'), ('processing', 'processing'), ('ready', 'ready'), ('failed', 'failed')]
+    processing_status = models.CharField(max_length=20, choices=processing_choices, default='pending', blank=True)
+    duration = models.FloatField(null=True, blank=True)
+    width = models.IntegerField(null=True, blank=True)
+    height = models.IntegerField(null=True, blank=True)
+    bitrate = models.IntegerField(null=True, blank=True)
+    poster = models.FileField(upload_to=upload_file_path, null=True, blank=True)
+    rendition = models.FileField(upload_to=upload_file_path, null=True, blank=True)
+    trending_score = models.FloatField(default=0, editable=False)
+    trending_rank = models.IntegerField(null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector']),
+            models.Index(fields=['-views', '-id'], name='video_views_id_idx'),
+            models.Index(fields=['-trending_score', '-id'], name='video_trending_score_idx'),
+            models.Index(fields=['trending_rank', 'id'], name='video_trending_rank_idx'),
+        ]
     
     def __str__(self):
         return self.title
-    
+
+
+class VideoViewBucket(models.Model):
+    """
+    Views of a video during one hour. ``applied`` is the part of ``views``
+    already added to ``Video.trending_score``.
+    """
+    video = models.ForeignKey(Video, on_delete=models.CASCADE, related_name='view_buckets')
+    hour = models.DateTimeField()
+    views = models.IntegerField(default=0)
+    applied = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['video', 'hour'], name='video_view_bucket_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['hour'], name='video_view_bucket_hour_idx'),
+        ]
+
+
+class TrendingState(models.Model):
+    """
+    Single row holding when the trending scores were last decayed, updated
+    in the same transaction as the scores.
+    """
+    updated_at = models.FloatField(null=True, blank=True, help_text='UNIX time of the last update')
+
+
+class VideoUpload(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
+    user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, related_name='video_uploads')
+    title = models.CharField(max_length=400)
+    description = models.TextField()
+    file = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    chunk_size = models.IntegerField()
+    video = models.OneToOneField(Video, on_delete=models.SET_NULL, null=True, blank=True, related_name='upload')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @property
+    def chunk_count(self):
+        return max(1, -(-self.size // self.chunk_size))
+
+    def chunk_length(self, index):
+        if index == self.chunk_count - 1:
+            return self.size - index * self.chunk_size
+        return self.chunk_size
+
+    def __str__(self):
+        return f"{self.title} - {self.id}"
+
+
+class VideoUploadChunk(models.Model):
+    upload = models.ForeignKey(VideoUpload, on_delete=models.CASCADE, related_name='chunks')
+    index = models.IntegerField()
+    size = models.IntegerField()
+    checksum = models.CharField(max_length=64)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['upload', 'index'], name='unique_video_upload_chunk')]
+
+
+class MediaJob(models.Model):
+    status_choices = [('pending', 'pending'), ('running', 'running'), ('done', 'done'), ('failed', 'failed')]
+    video = models.ForeignKey(Video, on_delete=models.CASCADE, related_name='media_jobs')
+    status = models.CharField(max_length=20, choices=status_choices, default='pending')
+    stage = models.CharField(max_length=20, blank=True)
+    progress = models.FloatField(default=0)
+    error = models.TextField(blank=True)
+    attempts = models.IntegerField(default=0)
+    retry_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'created_at'], name='media_job_status_idx')]
+
+    def __str__(self):
+        return f"{self.video_id} - {self.status}"
+
+
 class TimeStamp(models.Model):
     aroma_choices = [('A', 'A'), ('B', 'B'), ('C', 'C'), ('D', 'D')]
     video = models.ForeignKey(Video, on_delete=models.CASCADE)
     aroma = models.CharField(max_length=1, choices=aroma_choices)
     moment = models.TimeField()
     created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['video', 'created_at', 'id'], name='timestamp_video_created_idx'),
+            models.Index(fields=['video', 'moment'], name='timestamp_video_moment_idx'),
+        ]
     
     def __str__(self):
         return f"id - {self.id}"
@@ -45,9 +157,30 @@ class ChangeRequest(models.Model):
     confirm_code = models.CharField(max_length=255)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'confirm_code', 'field'], name='change_request_confirm_idx'),
+            models.Index(fields=['created_at'], name='change_request_created_idx'),
+        ]
+
     @classmethod
-    def cleanup_expired_user_change_requests(cls, user, field):
-        cls.objects.filter(user=user, field=field, created_at__lt=timezone.now() - timedelta(hours=1)).delete()
+    def expiry_cutoff(cls):
+        return timezone.now() - timedelta(seconds=settings.CHANGE_REQUEST_TTL)
+
+    @classmethod
+    def delete_expired(cls, batch_size):
+        """
+        Deletes expired requests of all users, oldest first and ``batch_size``
+        rows per statement so no lock is held for long. Returns the number of
+        deleted rows.
+        """
+        cutoff = cls.expiry_cutoff()
+        deleted = 0
+        while True:
+            ids = list(cls.objects.filter(created_at__lt=cutoff).order_by('created_at').values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                return deleted
+            deleted += cls.objects.filter(pk__in=ids).delete()[0]
 
     def __str__(self):
         return f"{self.user.username} - {self.field} - {self.created_at}"
@@ -55,5 +188,70 @@ class ChangeRequest(models.Model):
 class Subscription(models.Model):
     user = models.OneToOneField(get_user_model(), on_delete=models.CASCADE, related_name='subscription')
     active = models.BooleanField(default=False, blank=True)
-    
-    
\ No newline at end of file
+
+
+def generate_device_token():
+    return secrets.token_hex(24)
+
+
+class Device(models.Model):
+    transport_choices = [('http', 'http'), ('push', 'push')]
+    name = models.CharField(max_length=100)
+    user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, null=True, blank=True, related_name='devices')
+    room = models.CharField(max_length=100, blank=True)
+    transport = models.CharField(max_length=10, choices=transport_choices, default='http')
+    url = models.CharField(max_length=255, blank=True, help_text='URL template of an aroma command, e.g. http://192.168.1.20:1203/{}')
+    token = models.CharField(max_length=64, unique=True, default=generate_device_token, help_text='Secret a push device connects with')
+    last_seq = models.BigIntegerField(default=0)
+    active = models.BooleanField(default=True)
+    healthy = models.BooleanField(default=True)
+    failures = models.IntegerField(default=0)
+    last_seen = models.DateTimeField(null=True, blank=True)
+    last_latency = models.FloatField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'active'], name='device_user_active_idx'),
+            models.Index(fields=['room', 'active'], name='device_room_active_idx'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+    def clean(self):
+        if self.transport == 'http' and not self.url:
+            raise ValidationError({'url': 'HTTP devices need a URL template'})
+
+
+class DeviceMessage(models.Model):
+    kind_choices = [('cue', 'cue'), ('cancel', 'cancel')]
+    device = models.ForeignKey(Device, on_delete=models.CASCADE, related_name='messages')
+    seq = models.BigIntegerField()
+    kind = models.CharField(max_length=10, choices=kind_choices, default='cue')
+    aroma = models.CharField(max_length=1, choices=TimeStamp.aroma_choices, blank=True)
+    fire_at = models.FloatField(null=True, blank=True, help_text='Server clock time (UNIX seconds) to actuate at; empty means immediately')
+    cancels = models.BigIntegerField(null=True, blank=True, help_text='Sequence number of the cue a cancel message revokes')
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    acked_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['device', 'seq'], name='unique_device_message_seq')]
+
+    def __str__(self):
+        return f"{self.device_id} #{self.seq} - {self.aroma}"
+
+
+class APILogEntry(models.Model):
+    url_name = models.CharField(max_length=100, blank=True)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=255)
+    status_code = models.PositiveSmallIntegerField()
+    duration_ms = models.FloatField()
+    user_id = models.BigIntegerField(null=True, blank=True)
+    ip = models.GenericIPAddressField(null=True, blank=True)
+    created_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.method} {self.path} - {self.status_code}"
@@ -0,0 +1,130 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import Q
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import OpenApiParameter
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+KEYSET_PARAMETERS = [
+    OpenApiParameter(name='cursor', description='Switch to cursor pagination; pass an empty value for the first page', type=OpenApiTypes.STR, location=OpenApiParameter.QUERY),
+    OpenApiParameter(name='count', description='Cursor pagination count mode', enum=['none', 'estimate', 'exact'], type=OpenApiTypes.STR, location=OpenApiParameter.QUERY),
+]
+
+
+def estimate_count(queryset):
+    connection = connections[queryset.db]
+    with connection.cursor() as cursor:
+        if not queryset.query.where:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+            if row is None or row[0] < 0:
+                return queryset.count()
+            return int(row[0])
+        sql, params = queryset.order_by().query.sql_with_params()
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+
+class KeysetPaginationMixin:
+    """
+    Opt-in cursor pagination for views that mix in ``PageNumberPagination``.
+
+    Requests carrying a ``cursor`` query parameter are paginated by seeking
+    past the last row of the previous page on ``keyset_ordering`` instead of
+    counting and offsetting. Any other ordering falls back to page numbers.
+    """
+    keyset_ordering = None
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = (
+            self.cursor_query_param in request.query_params
+            and tuple(queryset.query.order_by) == tuple(self.keyset_ordering or ())
+        )
+        if not self.keyset:
+            return super().paginate_queryset(queryset, request, view=view)
+
+        self.request = request
+        page_size = self.get_page_size(request)
+        cursor = request.query_params[self.cursor_query_param]
+        page_queryset = queryset
+        if cursor:
+            page_queryset = queryset.filter(self.seek_filter(queryset.model, self.decode_cursor(cursor)))
+
+        rows = list(page_queryset[:page_size + 1])
+        self.has_next = len(rows) > page_size
+        rows = rows[:page_size]
+        self.next_cursor = self.encode_cursor(rows[-1]) if self.has_next else None
+        self.keyset_count = self.get_keyset_count(queryset, request)
+        return rows
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        return Response({
+            'count': self.keyset_count,
+            'next': self.get_next_cursor_link(),
+            'previous': None,
+            'results': data,
+        })
+
+    def get_next_cursor_link(self):
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, self.next_cursor)
+
+    def get_keyset_count(self, queryset, request):
+        mode = request.query_params.get(self.count_query_param, 'none')
+        if mode == 'exact':
+            return queryset.count()
+        if mode == 'estimate':
+            return estimate_count(queryset)
+        return None
+
+    def keyset_fields(self):
+        return [(field.lstrip('-'), field.startswith('-')) for field in self.keyset_ordering]
+
+    def encode_cursor(self, instance):
+        values = [getattr(instance, name) for name, _ in self.keyset_fields()]
+        # Full precision isoformat: DjangoJSONEncoder would drop microseconds.
+        values = [value.isoformat() if hasattr(value, 'isoformat') else value for value in values]
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        # Pages never end on a NULL key, and range lookups reject None.
+        if not isinstance(values, list) or len(values) != len(self.keyset_ordering) or None in values:
+            raise NotFound(self.invalid_cursor_message)
+        return values
+
+    def seek_filter(self, model, values):
+        # The leading non-strict bound lets the planner seek the composite
+        # index instead of filtering it from the top.
+        fields = self.keyset_fields()
+        condition = Q()
+        equal = {}
+        for (name, descending), value in zip(fields, values):
+            try:
+                value = model._meta.get_field(name).to_python(value)
+            except ValidationError:
+                raise NotFound(self.invalid_cursor_message)
+            lookup = f'{name}__lt' if descending else f'{name}__gt'
+            condition |= Q(**equal, **{lookup: value})
+            equal[name] = value
+        name, descending = fields[0]
+        bound = f'{name}__lte' if descending else f'{name}__gte'
+        return Q(**{bound: equal[name]}) & condition
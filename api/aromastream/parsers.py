@@ -0,0 +1,55 @@
+import codecs
+import csv
+import itertools
+import json
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+def row_limit():
+    # One row past TIMESTAMP_BULK_MAX is enough for the serializer to
+    # reject the import without reading the rest of a huge file.
+    return settings.TIMESTAMP_BULK_MAX + 1
+
+
+def read_csv_cues(stream, encoding='utf-8'):
+    lines = codecs.iterdecode(stream, encoding)
+    try:
+        return [dict(row) for row in itertools.islice(csv.DictReader(lines), row_limit())]
+    except (csv.Error, UnicodeDecodeError) as exc:
+        raise ParseError(f'CSV parse error - {exc}')
+
+
+def read_jsonl_cues(stream, encoding='utf-8'):
+    rows = []
+    number = 0
+    limit = row_limit()
+    try:
+        for number, line in enumerate(codecs.iterdecode(stream, encoding), start=1):
+            if line.strip():
+                rows.append(json.loads(line))
+                if len(rows) == limit:
+                    break
+    except UnicodeDecodeError as exc:
+        raise ParseError(f'JSON lines parse error on line {number + 1} - {exc}')
+    except ValueError as exc:
+        raise ParseError(f'JSON lines parse error on line {number} - {exc}')
+    return rows
+
+
+class CSVCueParser(BaseParser):
+    media_type = 'text/csv'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        return read_csv_cues(stream, encoding)
+
+
+class JSONLinesCueParser(BaseParser):
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        return read_jsonl_cues(stream, encoding)
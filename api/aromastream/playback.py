@@ -0,0 +1,250 @@
+import logging
+import threading
+import time
+from collections import namedtuple
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+
+from . import push
+from .devices import enqueue_cue, is_push, lead_command, push_device_id, resolve_targets
+from .leadtime import get_estimator
+from .models import TimeStamp
+
+
+logger = logging.getLogger(__name__)
+
+STATE_PLAYING = 'playing'
+STATE_PAUSED = 'paused'
+STATE_STOPPED = 'stopped'
+STATE_FINISHED = 'finished'
+
+
+def moment_to_seconds(moment):
+    return moment.hour * 3600 + moment.minute * 60 + moment.second + moment.microsecond / 1_000_000
+
+
+def load_cues(video_id):
+    timestamps = TimeStamp.objects.filter(video_id=video_id).order_by('moment', 'id').values_list('moment', 'aroma')
+    return [(moment_to_seconds(moment), aroma) for moment, aroma in timestamps]
+
+
+def session_key(session_id):
+    return f'playback:session:{session_id}'
+
+
+def get_session(session_id):
+    return cache.get(session_key(session_id))
+
+
+def save_session(session):
+    cache.set(session_key(session['id']), session, settings.PLAYBACK_SESSION_TTL)
+
+
+def position(session, now=None):
+    if session['state'] != STATE_PLAYING:
+        return session['offset']
+    if now is None:
+        now = time.time()
+    return session['offset'] + (now - session['anchor'])
+
+
+def start_session(user, video, offset, room=None):
+    session = {
+        'id': uuid4().hex,
+        'user': user.pk,
+        'video': video.pk,
+        'devices': [target.url for target in resolve_targets(user.pk, room)],
+        'state': STATE_PLAYING,
+        'offset': offset,
+        'anchor': time.time(),
+        'version': 0,
+    }
+    cues = load_cues(video.pk)
+    session['cues'] = len(cues)
+    save_session(session)
+    get_scheduler().add(session['id'], cues)
+    return session
+
+
+def control_session(session, action, offset=None):
+    """
+    Stopped sessions cannot be controlled any more (the view answers 409).
+    Finished ones have left the scheduler, so any action but stop puts them
+    back; seeking a finished session plays it again from ``offset``.
+    """
+    now = time.time()
+    finished = session['state'] == STATE_FINISHED
+    if finished and action == 'seek':
+        session['state'] = STATE_PLAYING
+    if action == 'pause':
+        session['offset'] = position(session, now)
+        session['state'] = STATE_PAUSED
+    elif action == 'resume':
+        session['state'] = STATE_PLAYING
+    elif action == 'seek':
+        session['offset'] = offset
+    elif action == 'stop':
+        session['offset'] = position(session, now)
+        session['state'] = STATE_STOPPED
+    session['anchor'] = now
+    session['version'] += 1
+    save_session(session)
+    if finished and action != 'stop':
+        get_scheduler().add(session['id'], load_cues(session['video']))
+    else:
+        get_scheduler().wake()
+    return session
+
+
+_Event = namedtuple('_Event', 'due fire_position aroma template predeliver')
+
+
+class _ScheduledSession:
+
+    def __init__(self, session_id, cues):
+        self.id = session_id
+        self.cues = cues
+        self.events = []
+        self.version = None
+        self.cursor = 0
+        self.predelivered = []
+
+    def plan(self, current, templates, horizon):
+        """
+        Orders the sends of every cue at or after ``current``. A cue fires
+        its estimated lead time before its moment; push devices get it a
+        further ``horizon`` seconds ahead and hold it until then.
+        """
+        estimator = get_estimator()
+        leads = {}
+        events = []
+        for moment, aroma in self.cues:
+            if moment < current:
+                continue
+            for template in templates:
+                command = lead_command(template, aroma)
+                if command not in leads:
+                    leads[command] = estimator.lead(command)
+                fire_position = moment - leads[command]
+                predeliver = bool(horizon) and is_push(template)
+                due = fire_position - horizon if predeliver else fire_position
+                events.append(_Event(due, fire_position, aroma, template, predeliver))
+        events.sort(key=lambda event: event.due)
+        self.events = events
+        self.cursor = 0
+
+
+class PlaybackScheduler:
+    """
+    Fires the cue track of every playback session started in this process.
+
+    Session state lives in the cache, so pause/seek/stop requests may be
+    served by any worker; the scheduler re-reads it at least every
+    ``poll_interval`` seconds. Cues are sent early by the lead time measured
+    for their device and aroma, so the scent is released at the cue moment.
+    """
+
+    def __init__(self, poll_interval, late_tolerance, predelivery_horizon=0):
+        self.poll_interval = poll_interval
+        self.late_tolerance = late_tolerance
+        self.predelivery_horizon = predelivery_horizon
+        self._sessions = {}
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def add(self, session_id, cues):
+        with self._condition:
+            self._sessions[session_id] = _ScheduledSession(session_id, cues)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='playback-scheduler', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def wake(self):
+        with self._condition:
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                scheduled = list(self._sessions.values())
+            timeout = self.poll_interval
+            close_old_connections()
+            for item in scheduled:
+                try:
+                    delay = self._tick(item)
+                except Exception:
+                    # Retried on the next poll; one failing session or a
+                    # cache/database hiccup must not stop the others.
+                    logger.exception('Playback session %s failed', item.id)
+                    continue
+                if delay is None:
+                    with self._condition:
+                        self._sessions.pop(item.id, None)
+                else:
+                    timeout = min(timeout, delay)
+            with self._condition:
+                self._condition.wait(max(timeout, 0))
+
+    def _cancel(self, item, now):
+        for fire_at, message in item.predelivered:
+            if fire_at > now:
+                push.cancel_cue(message)
+        item.predelivered = []
+
+    def _tick(self, item):
+        session = get_session(item.id)
+        now = time.time()
+        if session is None or session['state'] in (STATE_STOPPED, STATE_FINISHED):
+            self._cancel(item, now)
+            return None
+
+        current = position(session, now)
+        if session['version'] != item.version:
+            self._cancel(item, now)
+            item.version = session['version']
+            item.plan(current, session.get('devices', [None]), self.predelivery_horizon)
+
+        if session['state'] != STATE_PLAYING:
+            return self.poll_interval
+
+        while item.cursor < len(item.events) and item.events[item.cursor].due <= current:
+            event = item.events[item.cursor]
+            item.cursor += 1
+            if current - event.fire_position > self.late_tolerance:
+                continue
+            if event.predeliver:
+                fire_at = now + event.fire_position - current
+                message = push.push_cue(push_device_id(event.template), event.aroma, fire_at=fire_at)
+                item.predelivered.append((fire_at, message))
+            else:
+                enqueue_cue([event.template], event.aroma)
+        item.predelivered = [(fire_at, message) for fire_at, message in item.predelivered if fire_at > now]
+
+        delays = [fire_at - now for fire_at, _ in item.predelivered]
+        if item.cursor < len(item.events):
+            delays.append(item.events[item.cursor].due - current)
+        if not delays:
+            session['state'] = STATE_FINISHED
+            session['offset'] = current
+            save_session(session)
+            return None
+        return min(delays)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = PlaybackScheduler(
+                    settings.PLAYBACK_POLL_INTERVAL, settings.PLAYBACK_LATE_TOLERANCE, settings.PLAYBACK_PREDELIVERY_HORIZON
+                )
+    return _scheduler
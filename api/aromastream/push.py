@@ -0,0 +1,299 @@
+import asyncio
+import json
+import logging
+import time
+from datetime import timedelta
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .leadtime import get_estimator
+from .models import Device, DeviceMessage
+
+
+logger = logging.getLogger(__name__)
+
+PUSH_CHANNEL = 'aroma_devices'
+DELIVERY_PREFIX = 'push:'
+
+
+def push_cue(device_id, aroma, fire_at=None):
+    """
+    Stores a cue in the device outbox under the next sequence number and
+    notifies the gateways once the transaction commits. ``fire_at`` (server
+    clock, UNIX seconds) asks the device to hold the cue until then.
+    """
+    return _append(device_id, kind='cue', aroma=aroma, fire_at=fire_at)
+
+
+def cancel_cue(message):
+    """
+    Revokes a pre-delivered cue: drops it from the outbox while it has not
+    been sent, otherwise queues a cancel message for the device.
+    """
+    deleted, _ = DeviceMessage.objects.filter(pk=message.pk, sent_at__isnull=True).delete()
+    if not deleted:
+        _append(message.device_id, kind='cancel', cancels=message.seq)
+
+
+def _append(device_id, **fields):
+    with transaction.atomic():
+        Device.objects.filter(pk=device_id).update(last_seq=F('last_seq') + 1)
+        seq = Device.objects.filter(pk=device_id).values_list('last_seq', flat=True).get()
+        message = DeviceMessage.objects.create(device_id=device_id, seq=seq, **fields)
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_notify(%s, %s)', [PUSH_CHANNEL, str(device_id)])
+    return message
+
+
+def lead_command(device_id, aroma):
+    """
+    Key of the lead time estimate of an aroma on a push device.
+    """
+    return f'{DELIVERY_PREFIX}{device_id}:{aroma}'
+
+
+def delivery_id(message):
+    return f'{DELIVERY_PREFIX}{message.pk}'
+
+
+def message_status(delivery, user_id):
+    """
+    Status of a cue sent to one of the user's devices or to a shared one.
+    Cues past DEVICE_PUSH_MESSAGE_TTL are never sent, so they are expired.
+    """
+    try:
+        message = DeviceMessage.objects.get(
+            Q(device__user_id=user_id) | Q(device__user__isnull=True), pk=int(delivery[len(DELIVERY_PREFIX):])
+        )
+    except (ValueError, DeviceMessage.DoesNotExist):
+        return None
+    if message.acked_at:
+        elapsed = (message.acked_at - message.created_at).total_seconds()
+        return {'status': 'delivered', 'status_code': None, 'error': None, 'elapsed_ms': round(elapsed * 1000, 1)}
+    if message.created_at < timezone.now() - timedelta(seconds=settings.DEVICE_PUSH_MESSAGE_TTL):
+        return {'status': 'expired'}
+    return {'status': 'queued'}
+
+
+def pending_messages(device_id, after_seq):
+    """
+    Unacknowledged cues newer than ``after_seq``. Cues older than
+    DEVICE_PUSH_MESSAGE_TTL are useless for playback and never sent.
+    """
+    fresh = timezone.now() - timedelta(seconds=settings.DEVICE_PUSH_MESSAGE_TTL)
+    messages = DeviceMessage.objects.filter(
+        device_id=device_id, seq__gt=after_seq, acked_at__isnull=True, created_at__gte=fresh
+    ).order_by('seq')[:settings.DEVICE_PUSH_BATCH_SIZE]
+    messages = list(messages.values('id', 'seq', 'kind', 'aroma', 'fire_at', 'cancels'))
+    if messages:
+        DeviceMessage.objects.filter(pk__in=[message['id'] for message in messages]).update(sent_at=timezone.now())
+    return messages
+
+
+def acknowledge(device_id, seq):
+    now = timezone.now()
+    acked = DeviceMessage.objects.filter(device_id=device_id, seq__lte=seq, acked_at__isnull=True).update(acked_at=now)
+    Device.objects.filter(pk=device_id).update(healthy=True, failures=0, last_seen=now)
+    return acked
+
+
+def record_fired(device_id, seq, lead):
+    """
+    Feeds the actuation time a device measured for one of its cues into the
+    lead time estimate of that aroma.
+    """
+    aroma = DeviceMessage.objects.filter(device_id=device_id, seq=seq, kind='cue').values_list('aroma', flat=True).first()
+    if aroma:
+        get_estimator().observe(lead_command(device_id, aroma), lead)
+
+
+def cue_frame(message):
+    if message['kind'] == 'cancel':
+        return {'type': 'cancel', 'seq': message['seq'], 'cancels': message['cancels']}
+    frame = {'type': 'cue', 'seq': message['seq'], 'aroma': message['aroma'], 'server_time': time.time()}
+    if message['fire_at'] is not None:
+        frame['fire_at'] = message['fire_at']
+    return frame
+
+
+def authenticate_device(token):
+    if not token:
+        return None
+    return Device.objects.filter(token=token, active=True, transport='push').only('id').first()
+
+
+def acked_seq(device_id):
+    last = DeviceMessage.objects.filter(device_id=device_id, acked_at__isnull=False).order_by('-seq').values_list('seq', flat=True).first()
+    return last or 0
+
+
+class NotificationListener:
+    """
+    LISTENs on PUSH_CHANNEL over a dedicated psycopg2 connection and wakes
+    the sockets of the notified device.
+    """
+
+    def __init__(self, gateway):
+        self.gateway = gateway
+        self.connection = None
+
+    def connect(self):
+        database = connections['default']
+        self.connection = database.get_new_connection(database.get_connection_params())
+        self.connection.autocommit = True
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'LISTEN {PUSH_CHANNEL}')
+
+    def attach(self, loop):
+        loop.add_reader(self.connection.fileno(), self._read)
+
+    def _read(self):
+        self.connection.poll()
+        while self.connection.notifies:
+            notify = self.connection.notifies.pop(0)
+            try:
+                self.gateway.wake(int(notify.payload))
+            except ValueError:
+                continue
+
+    def stop(self, loop):
+        if self.connection is not None:
+            loop.remove_reader(self.connection.fileno())
+            self.connection.close()
+            self.connection = None
+
+
+class DeviceGateway:
+    """
+    ASGI WebSocket endpoint that devices (or a LAN bridge) keep open.
+
+    Protocol, JSON text frames:
+        device -> server  {"type": "hello", "last_seq": 41}   optional, resume point
+        server -> device  {"type": "cue", "seq": 42, "aroma": "A", "server_time": 1718000000.123}
+        device -> server  {"type": "ack", "seq": 42}
+    Unacknowledged cues are sent again after a reconnect, so devices must
+    ignore sequence numbers they have already executed.
+
+    Pre-delivered cues also carry ``fire_at`` in server time; devices hold
+    them until then and drop them when a cancel for their seq arrives:
+        server -> device  {"type": "cancel", "seq": 43, "cancels": 42}
+    To translate server time, devices measure their clock offset with
+        device -> server  {"type": "sync", "t0": <device time>}
+        server -> device  {"type": "sync", "t0": <echoed>, "server_time": 1718000000.123}
+    and report how long actuation took, which tunes the lead time:
+        device -> server  {"type": "fired", "seq": 42, "lead_ms": 1870}
+    """
+
+    def __init__(self):
+        self._events = {}
+        self._listener = None
+        self._closing = set()
+
+    def wake(self, device_id):
+        for event in self._events.get(device_id, ()):
+            event.set()
+
+    async def startup(self):
+        if settings.DEVICE_PUSH_LISTEN and connections['default'].vendor == 'postgresql' and self._listener is None:
+            listener = NotificationListener(self)
+            try:
+                await sync_to_async(listener.connect, thread_sensitive=False)()
+                listener.attach(asyncio.get_running_loop())
+            except Exception:
+                logger.exception('Device push listener failed to start, falling back to polling')
+            else:
+                self._listener = listener
+
+    async def shutdown(self):
+        if self._listener is not None:
+            self._listener.stop(asyncio.get_running_loop())
+            self._listener = None
+
+    async def __call__(self, scope, receive, send):
+        message = await receive()
+        if message['type'] != 'websocket.connect':
+            return
+
+        device = await sync_to_async(authenticate_device)(self.get_token(scope))
+        if device is None:
+            await send({'type': 'websocket.close', 'code': 4401})
+            return
+        await send({'type': 'websocket.accept'})
+
+        event = asyncio.Event()
+        self._events.setdefault(device.pk, set()).add(event)
+        state = {'last_seq': await sync_to_async(acked_seq)(device.pk)}
+        sender = asyncio.create_task(self.send_pending(device.pk, event, state, send))
+        sender.add_done_callback(lambda task: self.sender_done(task, device.pk, send))
+        try:
+            await self.receive_frames(device.pk, state, receive, send)
+        finally:
+            sender.cancel()
+            self._events[device.pk].discard(event)
+            if not self._events[device.pk]:
+                del self._events[device.pk]
+
+    def sender_done(self, task, device_id, send):
+        # Without its sender the socket would stay open but silent; closing
+        # it makes the device reconnect and get a new one.
+        if task.cancelled() or task.exception() is None:
+            return
+        logger.error('Push sender of device %s failed', device_id, exc_info=task.exception())
+        closing = asyncio.ensure_future(send({'type': 'websocket.close', 'code': 1011}))
+        self._closing.add(closing)
+        closing.add_done_callback(self._closing.discard)
+
+    @staticmethod
+    def get_token(scope):
+        headers = dict(scope.get('headers', []))
+        authorization = headers.get(b'authorization', b'').decode()
+        if authorization.startswith('Device '):
+            return authorization[len('Device '):].strip()
+        return parse_qs(scope.get('query_string', b'').decode()).get('token', [None])[0]
+
+    async def receive_frames(self, device_id, state, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'websocket.disconnect':
+                return
+            try:
+                data = json.loads(message.get('text') or message.get('bytes') or b'')
+                kind, seq = data.get('type'), int(data.get('seq', data.get('last_seq', 0)))
+            except (ValueError, TypeError, AttributeError):
+                continue
+            if kind == 'ack':
+                await sync_to_async(acknowledge)(device_id, seq)
+            elif kind == 'hello':
+                await sync_to_async(acknowledge)(device_id, seq)
+                state['last_seq'] = max(state['last_seq'], seq)
+                self.wake(device_id)
+            elif kind == 'sync':
+                await send({'type': 'websocket.send', 'text': json.dumps({
+                    'type': 'sync', 't0': data.get('t0'), 'server_time': time.time(),
+                })})
+            elif kind == 'fired':
+                try:
+                    lead = float(data['lead_ms']) / 1000
+                except (KeyError, ValueError, TypeError):
+                    continue
+                await sync_to_async(record_fired)(device_id, seq, lead)
+
+    async def send_pending(self, device_id, event, state, send):
+        while True:
+            event.clear()
+            messages = await sync_to_async(pending_messages)(device_id, state['last_seq'])
+            for message in messages:
+                await send({'type': 'websocket.send', 'text': json.dumps(cue_frame(message))})
+                state['last_seq'] = message['seq']
+            if len(messages) == settings.DEVICE_PUSH_BATCH_SIZE:
+                continue
+            try:
+                await asyncio.wait_for(event.wait(), settings.DEVICE_PUSH_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
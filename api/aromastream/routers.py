@@ -0,0 +1,83 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+
+_replica_reads = ContextVar('aromastream_replica_reads', default=False)
+_primary_reads = ContextVar('aromastream_primary_reads', default=False)
+
+
+@contextmanager
+def replica_reads():
+    """
+    Lets reads inside the block go to a read replica. Usable as a decorator
+    of views whose results may lag behind the primary, such as lists and
+    search.
+    """
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+@contextmanager
+def primary_reads():
+    """
+    Keeps reads inside the block on the primary, even within
+    ``replica_reads``.
+    """
+    token = _primary_reads.set(True)
+    try:
+        yield
+    finally:
+        _primary_reads.reset(token)
+
+
+class APILogRouter:
+    """
+    Keeps APILogEntry rows in the API_LOG_DATABASE alias.
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.model_name == 'apilogentry':
+            return settings.API_LOG_DATABASE
+        return None
+
+    db_for_write = db_for_read
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if model_name == 'apilogentry':
+            return db == settings.API_LOG_DATABASE
+        if db == settings.API_LOG_DATABASE != 'default':
+            return False
+        return None
+
+
+class ReplicaRouter:
+    """
+    Sends reads made inside ``replica_reads`` to a random alias of
+    DATABASE_READ_REPLICAS. Every other read and all writes use the primary,
+    so requests always see their own writes.
+    """
+
+    def db_for_read(self, model, **hints):
+        if _replica_reads.get() and not _primary_reads.get() and settings.DATABASE_READ_REPLICAS:
+            return random.choice(settings.DATABASE_READ_REPLICAS)
+        return None
+
+    def db_for_write(self, model, **hints):
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {'default', *settings.DATABASE_READ_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.DATABASE_READ_REPLICAS:
+            return False
+        return None
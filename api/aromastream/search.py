@@ -0,0 +1,28 @@
+from functools import reduce
+from operator import add
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchVector, SearchQuery, SearchRank
+from django.db.models import F
+
+from .models import Video
+
+
+def search_vector():
+    vectors = [
+        SearchVector(field, weight=weight, config=settings.SEARCH_CONFIG)
+        for field, weight in settings.SEARCH_VECTOR_WEIGHTS.items()
+    ]
+    return reduce(add, vectors)
+
+
+def update_search_vector(queryset):
+    return queryset.update(search_vector=search_vector())
+
+
+def search_videos(query, rank=False):
+    search_query = SearchQuery(query, config=settings.SEARCH_CONFIG)
+    videos = Video.objects.filter(search_vector=search_query)
+    if rank:
+        return videos.annotate(rank=SearchRank(F('search_vector'), search_query)).order_by('-rank', '-views', '-id')
+    return videos.order_by('-views', '-id')
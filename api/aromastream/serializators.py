@@ -1,6 +1,7 @@
 from rest_framework import serializers
+from rest_framework.reverse import reverse
 from django.contrib.auth import get_user_model
-from .models import Video, TimeStamp
+from .models import Video, TimeStamp, VideoUpload, MediaJob, Device
 from django.core.validators import FileExtensionValidator
 from django.conf import settings
 
@@ -65,21 +66,178 @@ class TimeStampSerializer(serializers.ModelSerializer):
     
     
 class VideoSerializer(serializers.ModelSerializer):
-
+    # Video files are not public media; clients stream them through the API.
+    stream = serializers.SerializerMethodField()
+    rendition_stream = serializers.SerializerMethodField()
     
     class Meta:
         model = Video
-        extra_kwargs = {'file': {'validators': [FileExtensionValidator(allowed_extensions=['mp4'])]}, 'views': {'read_only': True}, 'id': {'read_only': True}}
-        exclude = ['created_at', 'updated_at']
+        extra_kwargs = {'file': {'validators': [FileExtensionValidator(allowed_extensions=['mp4'])], 'write_only': True}, 'views': {'read_only': True}, 'id': {'read_only': True}}
+        read_only_fields = ('processing_status', 'duration', 'width', 'height', 'bitrate', 'poster')
+        exclude = ['created_at', 'updated_at', 'search_vector', 'trending_score', 'trending_rank', 'rendition']
+
+    def get_stream(self, obj):
+        if not obj.file:
+            return None
+        return reverse('video_stream', args=[obj.id], request=self.context.get('request'))
+
+    def get_rendition_stream(self, obj):
+        if not obj.rendition:
+            return None
+        return reverse('video_stream', args=[obj.id], request=self.context.get('request')) + '?rendition=1'
+
     def create(self, validated_data):
         video = Video.objects.create(**validated_data)
         
         return video
     
+class CueListSerializer(serializers.ListSerializer):
+
+    def validate(self, attrs):
+        if len(attrs) > settings.TIMESTAMP_BULK_MAX:
+            raise serializers.ValidationError(f'at most {settings.TIMESTAMP_BULK_MAX} cues per request')
+        seen = set()
+        duplicates = set()
+        for cue in attrs:
+            if cue['moment'] in seen:
+                duplicates.add(cue['moment'].isoformat())
+            seen.add(cue['moment'])
+        if duplicates:
+            raise serializers.ValidationError({'duplicate_moments': sorted(duplicates)})
+        return attrs
+
+
+class CueSerializer(serializers.Serializer):
+    aroma = serializers.ChoiceField(choices=TimeStamp.aroma_choices)
+    moment = serializers.TimeField()
+
+    class Meta:
+        list_serializer_class = CueListSerializer
+
+
+class TimelineSerializer(serializers.Serializer):
+    video = serializers.IntegerField()
+    offsets_ms = serializers.ListField(child=serializers.IntegerField(), help_text="cue moments in milliseconds, ascending")
+    aromas = serializers.ListField(child=serializers.CharField(), help_text="aroma of the cue at the same index")
+
+
+class VideoPlaySerializer(serializers.Serializer):
+    video = VideoSerializer()
+    timeline = TimelineSerializer()
+    entitled = serializers.BooleanField(help_text="whether the user may stream the video and trigger its cues")
+    stream_url = serializers.CharField(allow_null=True, help_text="signed stream URL, null without entitlement or file")
+
+
+class TimeStampBulkResultSerializer(serializers.Serializer):
+    created = serializers.IntegerField()
+    deleted = serializers.IntegerField()
+
+
+class VideoUploadCreateSerializer(serializers.Serializer):
+    title = serializers.CharField(max_length=400)
+    description = serializers.CharField()
+    filename = serializers.CharField(max_length=200)
+    size = serializers.IntegerField(min_value=1, max_value=settings.VIDEO_UPLOAD_MAX_SIZE)
+    chunk_size = serializers.IntegerField(min_value=1, max_value=settings.VIDEO_UPLOAD_MAX_CHUNK_SIZE,
+                                          default=settings.VIDEO_UPLOAD_CHUNK_SIZE)
+
+    def validate_filename(self, value):
+        if not value.lower().endswith('.mp4'):
+            raise serializers.ValidationError('only mp4 files are allowed')
+        return value
+
+
+class VideoUploadSerializer(serializers.ModelSerializer):
+    chunk_count = serializers.IntegerField(read_only=True)
+    received = serializers.SerializerMethodField()
+
+    class Meta:
+        model = VideoUpload
+        fields = ['id', 'title', 'size', 'chunk_size', 'chunk_count', 'received', 'video']
+
+    def get_received(self, obj):
+        return list(obj.chunks.order_by('index').values_list('index', flat=True))
+
+
+class MediaJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = MediaJob
+        fields = ['status', 'stage', 'progress', 'error', 'attempts', 'created_at', 'started_at', 'updated_at']
+
+
+class APILogStatsSerializer(serializers.Serializer):
+    captured = serializers.IntegerField()
+    sampled_out = serializers.IntegerField()
+    buffered = serializers.IntegerField()
+    dropped = serializers.IntegerField()
+    written = serializers.IntegerField()
+    failed = serializers.IntegerField()
+
+
 class TriggerSerializer(serializers.Serializer):
     timestamp = serializers.PrimaryKeyRelatedField(queryset=TimeStamp.objects.all())
+    room = serializers.CharField(max_length=100, required=False)
+
+
+class TriggerLookupSerializer(TriggerSerializer):
+    """
+    TriggerSerializer without the timestamp lookup, which async views do
+    with the async ORM.
+    """
+    timestamp = serializers.IntegerField()
+
+
+class TriggerQueuedSerializer(serializers.Serializer):
+    delivery = serializers.CharField()
+    deliveries = serializers.ListField(child=serializers.CharField(allow_null=True))
+
+
+class TriggerStatusSerializer(serializers.Serializer):
+    status = serializers.ChoiceField(choices=['queued', 'delivered', 'failed', 'skipped', 'expired'])
+    status_code = serializers.IntegerField(allow_null=True, required=False)
+    error = serializers.CharField(allow_null=True, required=False)
+    elapsed_ms = serializers.FloatField(required=False)
     
     
+class TriggerDeviceResultSerializer(TriggerStatusSerializer):
+    device = serializers.IntegerField(allow_null=True)
+
+
+class TriggerResultSerializer(serializers.Serializer):
+    devices = TriggerDeviceResultSerializer(many=True)
+    error = serializers.CharField(required=False)
+
+
+class DeviceSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Device
+        fields = ['id', 'name', 'room', 'url', 'active', 'healthy', 'failures', 'last_seen', 'last_latency']
+
+
+class PlaybackStartSerializer(serializers.Serializer):
+    video = serializers.PrimaryKeyRelatedField(queryset=Video.objects.all())
+    offset = serializers.FloatField(min_value=0, default=0)
+    room = serializers.CharField(max_length=100, required=False)
+
+
+class PlaybackControlSerializer(serializers.Serializer):
+    action = serializers.ChoiceField(choices=['pause', 'resume', 'seek', 'stop'])
+    offset = serializers.FloatField(min_value=0, required=False)
+
+    def validate(self, attrs):
+        if attrs['action'] == 'seek' and 'offset' not in attrs:
+            raise serializers.ValidationError({'offset': 'field is required for seek'})
+        return attrs
+
+
+class PlaybackSessionSerializer(serializers.Serializer):
+    id = serializers.CharField()
+    video = serializers.IntegerField()
+    state = serializers.ChoiceField(choices=['playing', 'paused', 'stopped', 'finished'])
+    position = serializers.FloatField()
+    cues = serializers.IntegerField()
+
+
 class Response400Serializer(serializers.Serializer):
     detail = serializers.DictField(child=serializers.CharField(help_text="invalid parameter"), 
                                    help_text="invalid parameters")
@@ -1,12 +1,76 @@
-from django.db.models.signals import post_save
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
-from .models import Subscription
+from django.conf import settings
+from .models import Subscription, Video, TimeStamp, MediaJob
+from .search import update_search_vector
+from .caching import invalidate
+from .entitlements import invalidate_entitlement
+from .authentication import update_claims, user_claims
 
 User = get_user_model()
 
+_bulk_timestamps = ContextVar('aromastream_bulk_timestamps', default=False)
+
+
+@contextmanager
+def bulk_timestamp_changes():
+    """
+    Skips the per-row cache invalidation of timestamps saved or deleted
+    inside the block; the caller invalidates the cue list once instead.
+    """
+    token = _bulk_timestamps.set(True)
+    try:
+        yield
+    finally:
+        _bulk_timestamps.reset(token)
+
+
 @receiver(post_save, sender=User)
 def user_created(**kwargs):
     if kwargs['created']:
         Subscription.objects.create(user=kwargs['instance'])
-        
\ No newline at end of file
+
+
+@receiver(post_save, sender=User)
+def user_saved(instance, update_fields=None, **kwargs):
+    if update_fields is not None and not set(update_fields) & {'is_active', 'is_staff', 'is_superuser'}:
+        return
+    update_claims(instance.pk, user_claims(instance))
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(instance, **kwargs):
+    update_claims(instance.pk, False)
+
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def subscription_changed(instance, **kwargs):
+    invalidate_entitlement(instance.user_id)
+
+
+@receiver(post_save, sender=Video)
+def video_saved(instance, created=False, update_fields=None, **kwargs):
+    invalidate('videos')
+    if created and instance.file:
+        MediaJob.objects.create(video=instance)
+    if update_fields is not None and not set(update_fields) & set(settings.SEARCH_VECTOR_WEIGHTS):
+        return
+    update_search_vector(Video.objects.filter(pk=instance.pk))
+
+
+@receiver(post_delete, sender=Video)
+def video_deleted(instance, **kwargs):
+    invalidate('videos')
+
+
+@receiver(post_save, sender=TimeStamp)
+@receiver(post_delete, sender=TimeStamp)
+def timestamp_changed(instance, **kwargs):
+    if _bulk_timestamps.get():
+        return
+    invalidate(f'timestamps:{instance.video_id}')
@@ -0,0 +1,119 @@
+import os
+import re
+
+from django.conf import settings
+from django.core import signing
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+STREAM_SIGNATURE_SALT = 'aromastream.streaming.signature'
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header, size):
+    """
+    Returns the inclusive (start, end) of a single byte range, or None when
+    the whole file should be served (no header, several ranges or a
+    malformed header).
+    """
+    if not header:
+        return None
+    match = RANGE_RE.match(header.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        length = int(last)
+        if length == 0:
+            raise RangeNotSatisfiable
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise RangeNotSatisfiable
+    return start, end
+
+
+class RangeFileWrapper:
+
+    def __init__(self, file, start, length, block_size):
+        self.file = file
+        self.remaining = length
+        self.block_size = block_size
+        self.file.seek(start)
+
+    def __iter__(self):
+        while self.remaining > 0:
+            block = self.file.read(min(self.block_size, self.remaining))
+            if not block:
+                break
+            self.remaining -= len(block)
+            yield block
+
+    def close(self):
+        self.file.close()
+
+
+def accel_response(name, content_type):
+    response = HttpResponse(content_type=content_type)
+    response['X-Accel-Redirect'] = settings.VIDEO_STREAM_ACCEL_PREFIX.rstrip('/') + '/' + name
+    return response
+
+
+def stream_file(request, field_file, content_type='video/mp4'):
+    """
+    Serves a stored file, honouring single byte ranges.
+
+    Whole-file responses go through FileResponse so the WSGI server can use
+    its sendfile() file wrapper. With VIDEO_STREAM_ACCEL_PREFIX set, nginx
+    serves the bytes (and ranges) itself after Django has authorised the
+    request.
+    """
+    if settings.VIDEO_STREAM_ACCEL_PREFIX:
+        return accel_response(field_file.name, content_type)
+
+    path = field_file.path
+    size = os.path.getsize(path)
+    try:
+        byte_range = parse_range(request.headers.get('Range'), size)
+    except RangeNotSatisfiable:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    if byte_range is None:
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+    else:
+        start, end = byte_range
+        length = end - start + 1
+        wrapper = RangeFileWrapper(open(path, 'rb'), start, length, settings.VIDEO_STREAM_BLOCK_SIZE)
+        response = StreamingHttpResponse(wrapper, status=206, content_type=content_type)
+        response['Content-Length'] = str(length)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def sign_stream(video_id, user_id):
+    """
+    Signature that lets a player without the bearer token (e.g. a <video>
+    element) stream one video for VIDEO_STREAM_URL_TTL seconds.
+    """
+    return signing.dumps([video_id, user_id], salt=STREAM_SIGNATURE_SALT, compress=True)
+
+
+def stream_signature_user(signature, video_id):
+    """
+    Id of the user a valid signature of ``video_id`` was issued to, or None.
+    """
+    try:
+        signed_video_id, user_id = signing.loads(signature, salt=STREAM_SIGNATURE_SALT, max_age=settings.VIDEO_STREAM_URL_TTL)
+    except (signing.BadSignature, ValueError, TypeError):
+        return None
+    return user_id if signed_video_id == video_id else None
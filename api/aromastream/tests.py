@@ -1,15 +1,108 @@
-from rest_framework.test import APIClient, APITestCase
+from rest_framework.test import APIClient, APITestCase, APITransactionTestCase
 from django.urls import reverse
+from django.test import override_settings
 from django.contrib.auth import get_user_model
 from rest_framework_simplejwt.tokens import SlidingToken
-from .models import Video, TimeStamp
+from .models import Video, TimeStamp, MediaJob, Device, DeviceMessage, VideoViewBucket, VideoUpload, TrendingState
+from . import uploads
+from .trending import record_views, update_trending
+from .push import DeviceGateway, cancel_cue, lead_command, push_cue
+from .leadtime import LeadTimeEstimator, get_estimator, observe_round_trip
+from .playback import _ScheduledSession, get_scheduler
+from .async_views import AsyncTriggerListView, AsyncVideoDetailView, AsyncVideoListView
+from .routers import replica_reads
+from .caching import cached_response, invalidate, invalidated_key, version_cache
+from rest_framework.response import Response
+from .backends.pooled_postgresql.base import DatabaseWrapper as PooledDatabaseWrapper, close_pools
+from django.db import OperationalError, connections
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.http import HttpResponse
+from asgiref.testing import ApplicationCommunicator
+from django.core.exceptions import ValidationError
 from django.core.files.uploadedfile import SimpleUploadedFile
-from unittest.mock import patch
+import base64
+import hashlib
+import json
+import time
+import unittest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
 from .models import ChangeRequest
+from .dispatcher import CircuitBreaker, DeliveryResult, get_dispatcher
+from .devices import Target, record_health, resolve_targets
+from .throttling import MemoryBucketStore
+import requests
+from .viewcounter import MemoryViewBuffer, ViewCounter, get_view_counter
+from .media import claim_job, process_job, MediaError
+from .apilog import APILogMiddleware, APILogPipeline, JSONLinesSink, RingBuffer
+from .metrics import MemoryMetricsStore, MetricsMiddleware, MetricsRegistry, SQLiteMetricsStore
+from .benchmark import compare, percentile, run_flow
+from django.core.management import call_command
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+from .entitlements import has_active_subscription
+from .streaming import sign_stream
+from .authentication import ClaimsJWTAuthentication, ClaimsSlidingToken, ClaimsUser, verified_tokens
+from io import StringIO
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from django.utils import timezone
+from django.db.models import F
+from django.conf import settings
 User = get_user_model()
 
+def setUpModule():
+    # Uploads, posters, API logs and cache entries go to throwaway locations
+    # instead of the media, logs and cache directories of the tree.
+    directory = tempfile.mkdtemp()
+    unittest.addModuleCleanup(shutil.rmtree, directory, ignore_errors=True)
+    locmem = 'django.core.cache.backends.locmem.LocMemCache'
+    overrides = override_settings(MEDIA_ROOT=os.path.join(directory, 'media'), CACHES={
+        alias: dict(config, BACKEND=locmem, LOCATION=f'tests-{alias}') for alias, config in settings.CACHES.items()
+    })
+    overrides.enable()
+    unittest.addModuleCleanup(overrides.disable)
+    pipeline = APILogPipeline(
+        sink=JSONLinesSink(os.path.join(directory, 'api.jsonl')), buffer_size=settings.API_LOG_BUFFER_SIZE,
+        batch_size=settings.API_LOG_BATCH_SIZE, flush_interval=settings.API_LOG_FLUSH_INTERVAL,
+        skip=settings.API_LOG_SKIP, sample_rates=settings.API_LOG_SAMPLE_RATES,
+    )
+    patcher = patch('aromastream.apilog._pipeline', pipeline)
+    patcher.start()
+    unittest.addModuleCleanup(patcher.stop)
+    unittest.addModuleCleanup(pipeline.sink.handler.close)
+    unittest.addModuleCleanup(pipeline.task.stop)
+    # Metrics of every test request stay in this process instead of METRICS_PATH.
+    registry = MetricsRegistry(MemoryMetricsStore(), settings.METRICS_FLUSH_INTERVAL)
+    patcher = patch('aromastream.metrics._registry', registry)
+    patcher.start()
+    unittest.addModuleCleanup(patcher.stop)
+    unittest.addModuleCleanup(registry.task.stop)
+    # Buckets and coalescing claims never touch THROTTLE_PATH either.
+    patcher = patch('aromastream.throttling._store', MemoryBucketStore())
+    patcher.start()
+    unittest.addModuleCleanup(patcher.stop)
+
+def isolate_view_counter(test):
+    # Views recorded by the test go to an in-memory buffer, not VIEW_COUNTER_PATH.
+    counter = ViewCounter(MemoryViewBuffer(), settings.VIEW_COUNTER_FLUSH_INTERVAL)
+    patcher = patch('aromastream.viewcounter._view_counter', counter)
+    patcher.start()
+    test.addCleanup(patcher.stop)
+    test.addCleanup(counter.task.stop)
+
+def isolate_throttle_store(test):
+    # Every test starts with full buckets and no coalescing claims.
+    patcher = patch('aromastream.throttling._store', MemoryBucketStore())
+    patcher.start()
+    test.addCleanup(patcher.stop)
+
 class UserTests(APITestCase):
     def setUp(self):
+        isolate_throttle_store(self)
         self.client = APIClient()
         self.user_data = {
             'username': 'testuser12',
@@ -72,8 +165,26 @@ class UserTests(APITestCase):
         }, format='json')
         self.assertEqual(response.status_code, 200)
         self.assertIn('token', response.data)
-        
 
+    def test_expired_confirmation_is_rejected(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.token)
+        self.client.post(reverse('password_reset'), {'password': 'newpassword123'}, format='json')
+        ChangeRequest.objects.update(created_at=timezone.now() - timedelta(hours=2))
+        confirmation_code = ChangeRequest.objects.get(user=self.user, field='password').confirm_code
+
+        response = self.client.post(reverse('password_reset_confirm'), {'confirm_code': confirmation_code}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(ChangeRequest.objects.exists())
+
+    def test_reap_change_requests(self):
+        for index in range(5):
+            ChangeRequest.objects.create(user=self.user, field='password', new_value='x', confirm_code=str(index))
+        ChangeRequest.objects.filter(confirm_code__in=['0', '1', '2']).update(created_at=timezone.now() - timedelta(hours=2))
+
+        out = StringIO()
+        call_command('reap_change_requests', batch_size=2, stdout=out)
+        self.assertIn('Deleted 3 expired change requests', out.getvalue())
+        self.assertEqual(sorted(ChangeRequest.objects.values_list('confirm_code', flat=True)), ['3', '4'])
 
 
 class TimeStampTests(APITestCase):
@@ -105,9 +216,107 @@ class TimeStampTests(APITestCase):
         self.assertEqual(response.data['results'][0]['aroma'], 'A')
         self.assertEqual(response.data['results'][0]['moment'], '12:34:56')
 
+    def test_get_timestamps_with_cursor(self):
+        for moment in ('00:00:01', '00:00:02', '00:00:03'):
+            TimeStamp.objects.create(video=self.video, aroma='B', moment=moment)
+        url = reverse('timestamp_list', args=[self.video.id])
+        response = self.client.get(url, {'cursor': '', 'page_size': 2, 'count': 'estimate'})
+        moments = [timestamp['moment'] for timestamp in response.data['results']]
+        self.assertIsInstance(response.data['count'], int)
+
+        response = self.client.get(response.data['next'])
+        moments += [timestamp['moment'] for timestamp in response.data['results']]
+        self.assertEqual(moments, ['00:00:01', '00:00:02', '00:00:03'])
+
+    def test_get_timeline(self):
+        for aroma, moment in (('C', '00:01:00.250'), ('A', '00:00:02'), ('B', '00:00:01')):
+            TimeStamp.objects.create(video=self.video, aroma=aroma, moment=moment)
+        url = reverse('timestamp_timeline', args=[self.video.id])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'video': self.video.id, 'offsets_ms': [1000, 2000, 60250], 'aromas': ['B', 'A', 'C']})
+        self.assertEqual(response['Cache-Control'], 'private, max-age=60')
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        TimeStamp.objects.create(video=self.video, aroma='D', moment='00:00:00')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['aromas'], ['D', 'B', 'A', 'C'])
+
+        response = self.client.get(reverse('timestamp_timeline', args=[self.video.id + 1000]))
+        self.assertEqual(response.status_code, 404)
+
+
+class TimeStampBulkTests(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser6', password='testpassword', is_staff=True)
+        self.token = str(SlidingToken.for_user(self.user))
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.token)
+        self.video = Video.objects.create(title='test video', description='test description', views=0)
+        self.url = reverse('timestamp_bulk', args=[self.video.id])
+
+    def test_import_json(self):
+        cues = [{'aroma': 'A', 'moment': '00:00:05'}, {'aroma': 'D', 'moment': '00:01:00'}]
+        response = self.client.post(self.url, cues, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(TimeStamp.objects.filter(video=self.video).count(), 2)
+
+    def test_import_csv_and_export_jsonl(self):
+        body = 'aroma,moment\nB,00:00:02\nC,00:00:01\n'
+        response = self.client.post(self.url, body, content_type='text/csv')
+        self.assertEqual(response.status_code, 201)
+
+        response = self.client.get(self.url, {'file_format': 'jsonl'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['aroma'] for line in lines], ['C', 'B'])
+
+    def test_import_rejects_duplicates(self):
+        TimeStamp.objects.create(video=self.video, aroma='A', moment='00:00:05')
+        response = self.client.post(self.url, [{'aroma': 'B', 'moment': '00:00:05'}], format='json')
+        self.assertEqual(response.status_code, 409)
+
+        response = self.client.post(self.url, [{'aroma': 'B', 'moment': '00:00:07'}, {'aroma': 'C', 'moment': '00:00:07'}], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(TimeStamp.objects.filter(video=self.video).count(), 1)
+
+    def test_import_replace(self):
+        TimeStamp.objects.create(video=self.video, aroma='A', moment='00:00:05')
+        response = self.client.post(self.url + '?replace=true', [{'aroma': 'B', 'moment': '00:00:05'}], format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['deleted'], 1)
+        self.assertEqual(TimeStamp.objects.get(video=self.video).aroma, 'B')
+
+    def test_import_replace_invalidates_once(self):
+        TimeStamp.objects.create(video=self.video, aroma='A', moment='00:00:05')
+        TimeStamp.objects.create(video=self.video, aroma='B', moment='00:00:06')
+        with patch('aromastream.signals.invalidate') as signal_invalidate, patch('aromastream.views.invalidate') as view_invalidate:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(self.url + '?replace=true', [{'aroma': 'C', 'moment': '00:00:05'}], format='json')
+        self.assertEqual(response.data['deleted'], 2)
+        signal_invalidate.assert_not_called()
+        view_invalidate.assert_called_once_with(f'timestamps:{self.video.id}')
+
+    @override_settings(TIMESTAMP_BULK_MAX=2)
+    def test_import_stops_reading_past_limit(self):
+        body = b'{"aroma": "A", "moment": "00:00:01"}\n{"aroma": "B", "moment": "00:00:02"}\n{"aroma": "C", "moment": "00:00:03"}\nnot json\n'
+        response = self.client.post(self.url, {'file': SimpleUploadedFile('cues.jsonl', body)}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('at most 2 cues', str(response.data))
+
+    def test_import_undecodable_jsonl(self):
+        upload = SimpleUploadedFile('cues.jsonl', b'\xff\xfe{"aroma": "A"}\n')
+        response = self.client.post(self.url, {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('line 1', response.data['detail'])
+
 
 class VideoTests(APITestCase):
     def setUp(self):
+        isolate_view_counter(self)
         self.client = APIClient()
         self.user = User.objects.create_user(username='testuser3', password='testpassword')
         self.user.is_staff = True
@@ -135,12 +344,329 @@ class VideoTests(APITestCase):
         self.assertEqual(len(response.data['results']), 1)
         self.assertEqual(response.data['results'][0]['title'], 'test video')
 
+    def test_get_videos_not_modified(self):
+        response = self.client.get(reverse('videos'))
+        etag = response['ETag']
+        response = self.client.get(reverse('videos'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        Video.objects.create(title='new video', description='test description', views=0)
+        response = self.client.get(reverse('videos'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 2)
+
+    def test_get_videos_with_cursor(self):
+        Video.objects.create(title='second video', description='test description', views=5)
+        Video.objects.create(title='third video', description='test description', views=5)
+        response = self.client.get(reverse('videos'), {'cursor': '', 'page_size': 2, 'count': 'exact'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual([video['title'] for video in response.data['results']], ['third video', 'second video'])
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual([video['title'] for video in response.data['results']], ['test video'])
+        self.assertIsNone(response.data['next'])
+
+    def test_get_videos_with_invalid_cursor(self):
+        response = self.client.get(reverse('videos'), {'cursor': 'broken'})
+        self.assertEqual(response.status_code, 404)
+        cursor = base64.urlsafe_b64encode(json.dumps([None, None]).encode()).decode()
+        response = self.client.get(reverse('videos'), {'cursor': cursor})
+        self.assertEqual(response.status_code, 404)
+
     def test_get_video_detail(self):
         response = self.client.get(reverse('video_detail', args=[self.video.id]))
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data['title'], self.video.title)
         self.assertEqual(response.data['description'], self.video.description)
 
+    def test_video_views_are_buffered(self):
+        get_view_counter().flush()
+        self.client.get(reverse('video_detail', args=[self.video.id]))
+        self.client.get(reverse('video_detail', args=[self.video.id]))
+        self.video.refresh_from_db()
+        self.assertEqual(self.video.views, 0)
+
+        self.assertEqual(get_view_counter().flush(), 2)
+        self.video.refresh_from_db()
+        self.assertEqual(self.video.views, 2)
+
+    def test_popular_videos_before_ranking(self):
+        Video.objects.create(title='old hit', description='test description', views=1000)
+        response = self.client.get(reverse('popular_videos'), {'cursor': '', 'page_size': 1})
+        self.assertEqual([video['title'] for video in response.data['results']], ['old hit'])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([video['title'] for video in response.data['results']], [self.video.title])
+
+    def test_popular_videos_are_trending(self):
+        old_hit = Video.objects.create(title='old hit', description='test description', views=1000)
+        fresh = Video.objects.create(title='fresh', description='test description', views=10)
+        update_trending(rebuild=True)
+        response = self.client.get(reverse('popular_videos'))
+        self.assertEqual([video['title'] for video in response.data['results']][:2], ['old hit', 'fresh'])
+
+        record_views({fresh.id: 5}, timezone.now() - timedelta(hours=1))
+        record_views({fresh.id: 3})
+        record_views({old_hit.id: 4}, timezone.now() - timedelta(days=3))
+        self.assertEqual(update_trending(rebuild=True), Video.objects.count())
+        fresh.refresh_from_db()
+        old_hit.refresh_from_db()
+        self.assertAlmostEqual(fresh.trending_score, 8, delta=0.2)
+        self.assertLess(old_hit.trending_score, 1)
+        self.assertEqual((fresh.trending_rank, old_hit.trending_rank), (1, 2))
+
+        updated_at = TrendingState.objects.get().updated_at
+        record_views({old_hit.id: 10})
+        update_trending()
+        old_hit.refresh_from_db()
+        self.assertEqual(old_hit.trending_rank, 1)
+        self.assertGreater(TrendingState.objects.get().updated_at, updated_at)
+        self.assertEqual(VideoViewBucket.objects.filter(views__gt=F('applied')).count(), 0)
+
+        response = self.client.get(reverse('popular_videos'), {'cursor': '', 'page_size': 1})
+        self.assertEqual([video['title'] for video in response.data['results']], ['old hit'])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([video['title'] for video in response.data['results']], ['fresh'])
+
+    def test_flush_fills_view_buckets(self):
+        get_view_counter().flush()
+        self.client.get(reverse('video_detail', args=[self.video.id]))
+        get_view_counter().flush()
+        self.assertEqual(VideoViewBucket.objects.get(video=self.video).views, 1)
+
+class VideoUploadTests(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser7', password='testpassword', is_staff=True)
+        self.token = str(SlidingToken.for_user(self.user))
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.token)
+
+    def put_chunk(self, upload_id, index, content, **headers):
+        url = reverse('video_upload_chunk', args=[upload_id, index])
+        return self.client.put(url, content, content_type='application/octet-stream', **headers)
+
+    def test_chunked_upload(self):
+        response = self.client.post(reverse('video_upload_create'), {
+            'title': 'chunked video', 'description': 'test description', 'filename': 'movie.mp4', 'size': 10, 'chunk_size': 4
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['chunk_count'], 3)
+        upload_id = response.data['id']
+
+        self.assertEqual(self.put_chunk(upload_id, 2, b'89').status_code, 204)
+        self.assertEqual(self.put_chunk(upload_id, 0, b'0123', HTTP_X_CHUNK_SHA256=hashlib.sha256(b'0123').hexdigest()).status_code, 204)
+        response = self.client.post(reverse('video_upload_complete', args=[upload_id]))
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.get(reverse('video_upload', args=[upload_id]))
+        self.assertEqual(response.data['received'], [0, 2])
+
+        self.assertEqual(self.put_chunk(upload_id, 1, b'4567').status_code, 204)
+        response = self.client.post(reverse('video_upload_complete', args=[upload_id]))
+        self.assertEqual(response.status_code, 201)
+        video = Video.objects.get(id=response.data['id'])
+        with video.file.open('rb') as file:
+            self.assertEqual(file.read(), b'0123456789')
+
+    def test_chunk_rejects_bad_checksum_and_length(self):
+        response = self.client.post(reverse('video_upload_create'), {
+            'title': 'chunked video', 'description': 'test description', 'filename': 'movie.mp4', 'size': 8, 'chunk_size': 4
+        }, format='json')
+        upload_id = response.data['id']
+        self.assertEqual(self.put_chunk(upload_id, 0, b'012').status_code, 400)
+        self.assertEqual(self.put_chunk(upload_id, 0, b'0123', HTTP_X_CHUNK_SHA256='0' * 64).status_code, 400)
+        response = self.client.get(reverse('video_upload', args=[upload_id]))
+        self.assertEqual(response.data['received'], [])
+
+    def test_complete_rejects_corrupt_chunks(self):
+        response = self.client.post(reverse('video_upload_create'), {
+            'title': 'chunked video', 'description': 'test description', 'filename': 'movie.mp4', 'size': 8, 'chunk_size': 4
+        }, format='json')
+        upload_id = response.data['id']
+        self.put_chunk(upload_id, 0, b'0123')
+        self.put_chunk(upload_id, 1, b'4567')
+        with open(uploads.part_path(VideoUpload.objects.get(id=upload_id)), 'r+b') as part:
+            part.seek(5)
+            part.write(b'x')
+
+        response = self.client.post(reverse('video_upload_complete', args=[upload_id]))
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Video.objects.exists())
+        response = self.client.get(reverse('video_upload', args=[upload_id]))
+        self.assertEqual(response.data['received'], [0])
+
+    def test_reap_abandoned_uploads(self):
+        response = self.client.post(reverse('video_upload_create'), {
+            'title': 'chunked video', 'description': 'test description', 'filename': 'movie.mp4', 'size': 8, 'chunk_size': 4
+        }, format='json')
+        upload = VideoUpload.objects.get(id=response.data['id'])
+        self.assertEqual(uploads.reap_uploads(), 0)
+
+        VideoUpload.objects.filter(pk=upload.pk).update(created_at=timezone.now() - timedelta(days=8))
+        self.assertEqual(uploads.reap_uploads(), 1)
+        self.assertFalse(VideoUpload.objects.exists())
+        self.assertFalse(os.path.exists(uploads.part_path(upload)))
+
+
+class VideoStreamTests(APITestCase):
+    def setUp(self):
+        isolate_view_counter(self)
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser8', password='testpassword')
+        self.user.subscription.active = True
+        self.user.subscription.save()
+        self.token = str(SlidingToken.for_user(self.user))
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.token)
+        self.video = Video.objects.create(title='test video', description='test description',
+                                          file=SimpleUploadedFile('test.mp4', b'0123456789', content_type='video/mp4'))
+        self.url = reverse('video_stream', args=[self.video.id])
+
+    def test_stream_whole_file(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+
+    def test_stream_range(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(b''.join(response.streaming_content), b'2345')
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=7-')
+        self.assertEqual(b''.join(response.streaming_content), b'789')
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=20-')
+        self.assertEqual(response.status_code, 416)
+
+    def test_detail_links_stream_instead_of_file(self):
+        response = self.client.get(reverse('video_detail', args=[self.video.id]))
+        self.assertNotIn('file', response.data)
+        self.assertEqual(response.data['stream'], self.url)
+        self.assertIsNone(response.data['rendition_stream'])
+
+        self.assertEqual(self.client.get(self.url, {'rendition': 1}).status_code, 404)
+        Video.objects.filter(id=self.video.id).update(rendition=self.video.file.name)
+        response = self.client.get(self.url, {'rendition': 1})
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+
+    @override_settings(VIDEO_STREAM_ACCEL_PREFIX='/protected-media/')
+    def test_stream_accel_redirect(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + self.video.file.name)
+
+    def test_stream_requires_subscription(self):
+        self.user.subscription.active = False
+        self.user.subscription.save()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 403)
+
+    def test_play(self):
+        TimeStamp.objects.create(video=self.video, aroma='B', moment='00:00:05')
+        TimeStamp.objects.create(video=self.video, aroma='A', moment='00:00:01.500')
+        has_active_subscription(self.user.pk)
+        # user, video and the prefetched cue track
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('video_play', args=[self.video.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['video']['id'], self.video.id)
+        self.assertEqual(response.data['timeline']['offsets_ms'], [1500, 5000])
+        self.assertEqual(response.data['timeline']['aromas'], ['A', 'B'])
+        self.assertTrue(response.data['entitled'])
+
+        player = APIClient()
+        response = player.get(response.data['stream_url'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+
+        response = player.get(self.url, {'signature': 'forged'})
+        self.assertEqual(response.status_code, 401)
+
+    def test_signature_requires_subscription(self):
+        player = APIClient()
+        signature = sign_stream(self.video.id, self.user.pk)
+        self.assertEqual(player.get(self.url, {'signature': signature}).status_code, 200)
+
+        self.user.subscription.active = False
+        self.user.subscription.save()
+        self.assertEqual(player.get(self.url, {'signature': signature}).status_code, 401)
+
+        self.user.is_staff = True
+        self.user.save()
+        self.assertEqual(player.get(self.url, {'signature': signature}).status_code, 200)
+
+    def test_play_without_subscription(self):
+        self.user.subscription.active = False
+        self.user.subscription.save()
+        response = self.client.get(reverse('video_play', args=[self.video.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.data['entitled'])
+        self.assertIsNone(response.data['stream_url'])
+        self.assertNotIn('file', response.data['video'])
+        self.assertIsNone(response.data['video']['stream'])
+
+        response = self.client.get(reverse('video_play', args=[self.video.id + 1000]))
+        self.assertEqual(response.status_code, 404)
+
+
+class MediaProcessingTests(APITestCase):
+    def setUp(self):
+        self.video = Video.objects.create(title='test video', description='test description',
+                                          file=SimpleUploadedFile('test.mp4', b'0123456789', content_type='video/mp4'))
+
+    @staticmethod
+    def fake_ffmpeg(arguments, duration=None, on_progress=None):
+        with open(arguments[-1], 'wb') as output:
+            output.write(b'processed')
+        if on_progress:
+            on_progress(1.0)
+
+    @patch('aromastream.media.ffmpeg')
+    @patch('aromastream.media.probe')
+    def test_process_job(self, mock_probe, mock_ffmpeg):
+        mock_probe.return_value = {'duration': 12.5, 'width': 1920, 'height': 1080, 'bitrate': 4000000}
+        mock_ffmpeg.side_effect = self.fake_ffmpeg
+
+        job = claim_job()
+        self.assertEqual(job.video, self.video)
+        self.assertTrue(process_job(job))
+        self.assertIsNone(claim_job())
+
+        self.video.refresh_from_db()
+        self.assertEqual(self.video.processing_status, 'ready')
+        self.assertEqual(self.video.duration, 12.5)
+        self.assertTrue(self.video.poster.name.endswith('.jpg'))
+        self.assertTrue(self.video.rendition.name.endswith('.mp4'))
+        self.assertEqual(MediaJob.objects.get(video=self.video).progress, 100)
+
+    @patch('aromastream.media.probe')
+    def test_process_job_failure_is_retried(self, mock_probe):
+        mock_probe.side_effect = MediaError('broken file')
+        job = claim_job()
+        self.assertFalse(process_job(job))
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'pending')
+        self.assertEqual(job.error, 'broken file')
+
+        self.assertIsNone(claim_job())
+        MediaJob.objects.filter(pk=job.pk).update(retry_at=timezone.now())
+        self.assertEqual(claim_job(), job)
+
+    def test_stale_job_fails_after_max_attempts(self):
+        job = claim_job()
+        MediaJob.objects.filter(pk=job.pk).update(started_at=timezone.now() - timedelta(hours=3))
+        self.assertIsNone(claim_job())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error), ('pending', 'worker timed out'))
+
+        MediaJob.objects.filter(pk=job.pk).update(status='running', attempts=3, started_at=timezone.now() - timedelta(hours=3))
+        self.assertIsNone(claim_job())
+        job.refresh_from_db()
+        self.video.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(self.video.processing_status, 'failed')
+
+
 class SearchVideoTests(APITestCase):
     def setUp(self):
         self.client = APIClient()
@@ -155,8 +681,858 @@ class SearchVideoTests(APITestCase):
         self.assertEqual(len(response.data['results']), 1)
         self.assertEqual(response.data['results'][0]['title'], 'searchable video')
 
+    def test_search_videos_ranked(self):
+        Video.objects.create(title='other video', description='searchable', views=10)
+        response = self.client.get(reverse('search_video'), {'query': 'searchable', 'rank': 'true'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertEqual(response.data['results'][0]['title'], 'searchable video')
+
+    def test_search_vector_follows_title_update(self):
+        self.video.title = 'renamed'
+        self.video.save()
+        response = self.client.get(reverse('search_video'), {'query': 'renamed'})
+        self.assertEqual(len(response.data['results']), 1)
+
     def test_search_videos_no_results(self):
         response = self.client.get(reverse('search_video'), {'query': 'nonexistent'})
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(response.data['results']), 0)
 
+
+
+class TriggerTests(APITestCase):
+    def setUp(self):
+        isolate_throttle_store(self)
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser4', password='testpassword')
+        self.user.subscription.active = True
+        self.user.subscription.save()
+        self.token = str(SlidingToken.for_user(self.user))
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.token)
+        video = Video.objects.create(title='test video', description='test description', views=0)
+        self.timestamp = TimeStamp.objects.create(video=video, aroma='B', moment='00:00:10')
+
+    @patch('aromastream.dispatcher.TriggerDispatcher.send')
+    def test_trigger(self, mock_send):
+        mock_send.return_value = DeliveryResult('http://localhost:1203/B', status_code=200)
+        response = self.client.post(reverse('trigger'), {'timestamp': self.timestamp.id}, format='json')
+        self.assertEqual(response.status_code, 204)
+        mock_send.assert_called_once_with('http://localhost:1203/B')
+
+    @patch('aromastream.dispatcher.TriggerDispatcher.send')
+    def test_trigger_device_timeout(self, mock_send):
+        mock_send.return_value = DeliveryResult('http://localhost:1203/B', error='ReadTimeout')
+        response = self.client.post(reverse('trigger'), {'timestamp': self.timestamp.id}, format='json')
+        self.assertEqual(response.status_code, 504)
+
+    @patch('aromastream.dispatcher.TriggerDispatcher.send')
+    def test_trigger_async(self, mock_send):
+        mock_send.return_value = DeliveryResult('http://localhost:1203/B', status_code=200)
+        response = self.client.post(reverse('trigger') + '?async=1', {'timestamp': self.timestamp.id}, format='json')
+        self.assertEqual(response.status_code, 202)
+        get_dispatcher()._get_queue('http://localhost:1203/B').join()
+
+        response = self.client.get(reverse('trigger_status', args=[response.data['delivery']]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'delivered')
+
+
+class ThrottleTests(APITestCase):
+    def setUp(self):
+        isolate_throttle_store(self)
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='throttled', password='testpassword')
+        self.user.subscription.active = True
+        self.user.subscription.save()
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(SlidingToken.for_user(self.user)))
+        video = Video.objects.create(title='test video', description='test description', views=0)
+        self.timestamp = TimeStamp.objects.create(video=video, aroma='B', moment='00:00:10')
+        self.other_timestamp = TimeStamp.objects.create(video=video, aroma='C', moment='00:00:20')
+
+    def test_password_confirm_is_throttled(self):
+        for _ in range(5):
+            response = self.client.post(reverse('password_reset_confirm'), {'confirm_code': '000000'}, format='json')
+            self.assertEqual(response.status_code, 400)
+        response = self.client.post(reverse('password_reset_confirm'), {'confirm_code': '000000'}, format='json')
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+
+    def test_login_is_throttled_per_username(self):
+        client = APIClient()
+        for _ in range(5):
+            response = client.post(reverse('login'), {'username': 'throttled', 'password': 'wrong'}, format='json')
+            self.assertEqual(response.status_code, 401)
+        response = client.post(reverse('login'), {'username': 'throttled', 'password': 'testpassword'}, format='json')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+    @patch('aromastream.dispatcher.TriggerDispatcher.send')
+    def test_identical_cues_are_coalesced(self, mock_send):
+        mock_send.return_value = DeliveryResult('http://localhost:1203/B', status_code=200)
+        for _ in range(3):
+            response = self.client.post(reverse('trigger'), {'timestamp': self.timestamp.id}, format='json')
+            self.assertEqual(response.status_code, 204)
+        response = self.client.post(reverse('trigger'), {'timestamp': self.other_timestamp.id}, format='json')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual([call.args[0] for call in mock_send.call_args_list], ['http://localhost:1203/B', 'http://localhost:1203/C'])
+
+    @patch('aromastream.dispatcher.TriggerDispatcher.send')
+    def test_failed_cue_is_not_coalesced(self, mock_send):
+        mock_send.return_value = DeliveryResult('http://localhost:1203/B', error='ReadTimeout')
+        response = self.client.post(reverse('trigger'), {'timestamp': self.timestamp.id}, format='json')
+        self.assertEqual(response.status_code, 504)
+        mock_send.return_value = DeliveryResult('http://localhost:1203/B', status_code=200)
+        response = self.client.post(reverse('trigger'), {'timestamp': self.timestamp.id}, format='json')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(mock_send.call_count, 2)
+
+    @patch('aromastream.dispatcher.TriggerDispatcher.enqueue', return_value='delivery-1')
+    def test_coalesced_async_cue_returns_delivery(self, mock_enqueue):
+        for _ in range(2):
+            response = self.client.post(reverse('trigger') + '?async=1', {'timestamp': self.timestamp.id}, format='json')
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(response.data['delivery'], 'delivery-1')
+        mock_enqueue.assert_called_once_with('http://localhost:1203/B')
+
+    @patch('aromastream.dispatcher.TriggerDispatcher.send')
+    def test_device_bucket(self, mock_send):
+        mock_send.return_value = DeliveryResult('http://localhost:1203/B', status_code=200)
+        policies = {'trigger': {'device': ('1/min', 1)}}
+        with override_settings(THROTTLE_POLICIES=policies):
+            response = self.client.post(reverse('trigger'), {'timestamp': self.timestamp.id}, format='json')
+            self.assertEqual(response.status_code, 204)
+            response = self.client.post(reverse('trigger'), {'timestamp': self.timestamp.id}, format='json')
+            self.assertEqual(response.status_code, 204)
+            response = self.client.post(reverse('trigger'), {'timestamp': self.other_timestamp.id}, format='json')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '60')
+        self.assertEqual(mock_send.call_count, 1)
+
+    def test_acquire_is_all_or_nothing(self):
+        store = MemoryBucketStore()
+        self.assertEqual(store.acquire([(None, [('a', 1.0, 1)])]), (0.0, [True], [None]))
+        wait, _, _ = store.acquire([(None, [('a', 1.0, 1), ('b', 1.0, 1)])])
+        self.assertGreater(wait, 0)
+        self.assertEqual(store.acquire([(None, [('b', 1.0, 1)])]), (0.0, [True], [None]))
+
+
+class PlaybackTests(APITestCase):
+    def setUp(self):
+        isolate_throttle_store(self)
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser5', password='testpassword')
+        self.user.subscription.active = True
+        self.user.subscription.save()
+        self.token = str(SlidingToken.for_user(self.user))
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + self.token)
+        self.video = Video.objects.create(title='test video', description='test description', views=0)
+        TimeStamp.objects.create(video=self.video, aroma='A', moment='00:00:00')
+        TimeStamp.objects.create(video=self.video, aroma='C', moment='00:00:01')
+
+    @patch('aromastream.dispatcher.TriggerDispatcher.enqueue')
+    def test_playback_fires_cues_from_offset(self, mock_enqueue):
+        response = self.client.post(reverse('playback_create'), {'video': self.video.id, 'offset': 0.9}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['cues'], 2)
+
+        session_url = reverse('playback_session', args=[response.data['id']])
+        for _ in range(30):
+            if self.client.get(session_url).data['state'] == 'finished':
+                break
+            time.sleep(0.1)
+        mock_enqueue.assert_called_once_with('http://localhost:1203/C')
+
+        response = self.client.post(session_url, {'action': 'seek', 'offset': 0.9}, format='json')
+        self.assertEqual(response.data['state'], 'playing')
+        for _ in range(30):
+            if mock_enqueue.call_count == 2:
+                break
+            time.sleep(0.1)
+        self.assertEqual(mock_enqueue.call_count, 2)
+
+    @patch('aromastream.dispatcher.TriggerDispatcher.enqueue')
+    def test_playback_survives_failing_cue(self, mock_enqueue):
+        TimeStamp.objects.create(video=self.video, aroma='B', moment='00:00:01.500')
+        mock_enqueue.side_effect = [RuntimeError('device queue unavailable'), 'delivery']
+        with self.assertLogs('aromastream.playback', 'ERROR'):
+            response = self.client.post(reverse('playback_create'), {'video': self.video.id, 'offset': 0.5}, format='json')
+            session_url = reverse('playback_session', args=[response.data['id']])
+            for _ in range(30):
+                if self.client.get(session_url).data['state'] == 'finished':
+                    break
+                time.sleep(0.1)
+        self.assertEqual([call.args[0] for call in mock_enqueue.call_args_list], ['http://localhost:1203/C', 'http://localhost:1203/B'])
+        self.assertTrue(get_scheduler()._thread.is_alive())
+
+    def test_playback_requires_subscription(self):
+        self.user.subscription.active = False
+        self.user.subscription.save()
+        response = self.client.post(reverse('playback_create'), {'video': self.video.id, 'offset': 0}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+    @patch('aromastream.dispatcher.TriggerDispatcher.enqueue')
+    def test_playback_start_is_throttled(self, mock_enqueue):
+        with override_settings(THROTTLE_POLICIES={'playback': {'user': ('1/min', 1)}}):
+            response = self.client.post(reverse('playback_create'), {'video': self.video.id, 'offset': 30}, format='json')
+            self.assertEqual(response.status_code, 201)
+            response = self.client.post(reverse('playback_create'), {'video': self.video.id, 'offset': 30}, format='json')
+        self.assertEqual(response.status_code, 429)
+
+    @patch('aromastream.dispatcher.TriggerDispatcher.enqueue')
+    def test_playback_pause_and_seek(self, mock_enqueue):
+        TimeStamp.objects.create(video=self.video, aroma='B', moment='00:01:00')
+        response = self.client.post(reverse('playback_create'), {'video': self.video.id, 'offset': 0.5}, format='json')
+        session_url = reverse('playback_session', args=[response.data['id']])
+
+        response = self.client.post(session_url, {'action': 'pause'}, format='json')
+        self.assertEqual(response.data['state'], 'paused')
+        response = self.client.post(session_url, {'action': 'seek', 'offset': 30}, format='json')
+        self.assertEqual(response.data['position'], 30)
+
+        response = self.client.delete(session_url)
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.client.get(session_url).data['state'], 'stopped')
+
+        response = self.client.post(session_url, {'action': 'resume'}, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.client.get(session_url).data['state'], 'stopped')
+
+
+class APILogTests(APITestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'api.jsonl')
+        self.pipeline = APILogPipeline(
+            sink=JSONLinesSink(self.path), buffer_size=3, batch_size=2,
+            flush_interval=60, skip=['trigger_status'], sample_rates={'trigger': 0.0}
+        )
+        self.user = User.objects.create_superuser(username='admin', password='adminpassword')
+        self.token = SlidingToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(self.token))
+
+    def tearDown(self):
+        self.pipeline.task.stop()
+        self.pipeline.sink.handler.close()
+        self.directory.cleanup()
+
+    def test_ring_buffer_drops_oldest(self):
+        buffer = RingBuffer(2)
+        for entry in range(3):
+            buffer.append(entry)
+        self.assertEqual(buffer.dropped, 1)
+        self.assertEqual(buffer.drain(10), [1, 2])
+
+    def test_skip_and_sampling(self):
+        self.assertFalse(self.pipeline.should_log('trigger_status'))
+        self.assertFalse(self.pipeline.should_log('trigger'))
+        self.assertTrue(self.pipeline.should_log('videos'))
+        self.assertEqual(self.pipeline.stats()['sampled_out'], 1)
+
+    def test_flush_writes_json_lines(self):
+        with patch('aromastream.apilog.get_pipeline', return_value=self.pipeline):
+            self.client.get(reverse('videos'))
+            self.client.get(reverse('api_log_stats'))
+        self.assertEqual(self.pipeline.stats()['buffered'], 2)
+        self.assertEqual(self.pipeline.flush(), 2)
+        with open(self.path) as file:
+            entries = [json.loads(line) for line in file]
+        self.assertEqual([entry['url_name'] for entry in entries], ['videos', 'api_log_stats'])
+        self.assertEqual(entries[0]['user_id'], self.user.id)
+        self.assertEqual(self.pipeline.stats()['written'], 2)
+
+    def test_forwarded_for_is_not_trusted_without_proxies(self):
+        with patch('aromastream.apilog.get_pipeline', return_value=self.pipeline):
+            self.client.get(reverse('videos'), REMOTE_ADDR='10.0.0.7', HTTP_X_FORWARDED_FOR='203.0.113.9')
+        self.pipeline.flush()
+        with open(self.path) as file:
+            self.assertEqual(json.loads(file.readline())['ip'], '10.0.0.7')
+
+    def test_json_lines_sink_reopens_rotated_file(self):
+        entry = {'url_name': 'videos', 'created_at': timezone.now()}
+        self.pipeline.sink.write([entry])
+        os.rename(self.path, self.path + '.1')
+        self.pipeline.sink.write([entry])
+        for path in (self.path + '.1', self.path):
+            with open(path) as file:
+                self.assertEqual(len(file.readlines()), 1)
+
+    def test_stats_requires_admin(self):
+        user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(SlidingToken.for_user(user)))
+        response = self.client.get(reverse('api_log_stats'))
+        self.assertEqual(response.status_code, 403)
+
+
+class MetricsTests(APITestCase):
+    def setUp(self):
+        isolate_throttle_store(self)
+        self.registry = MetricsRegistry(MemoryMetricsStore(), 60)
+        patcher = patch('aromastream.metrics._registry', self.registry)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.registry.task.stop)
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.user.subscription.active = True
+        self.user.subscription.save()
+        self.token = SlidingToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(self.token))
+
+    def test_request_metrics(self):
+        self.client.get(reverse('user'))
+        output = self.registry.render()
+        self.assertIn('aromastream_requests_total{method="GET",status="200",view="user"', output)
+        self.assertIn('aromastream_request_duration_seconds_count{method="GET",view="user"', output)
+        self.assertRegex(output, r'aromastream_request_db_queries_sum\{method="GET",view="user"\} [1-9]')
+
+    def test_workers_share_sqlite_store(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'metrics.sqlite3')
+        workers = [MetricsRegistry(SQLiteMetricsStore(path), 60) for _ in range(2)]
+        for worker in workers:
+            self.addCleanup(worker.task.stop)
+            worker.increment('aromastream_requests_total', view='user', method='GET', status=200)
+            worker.observe('aromastream_request_db_queries', 2, view='user', method='GET')
+        workers[0].flush()
+        output = workers[1].render()
+        self.assertIn('aromastream_requests_total{method="GET",status="200",view="user"} 2', output)
+        self.assertIn('aromastream_request_db_queries_bucket{method="GET",view="user",le="2"} 2', output)
+        self.assertIn('aromastream_request_db_queries_sum{method="GET",view="user"} 4', output)
+
+    @patch('aromastream.dispatcher.requests.Session.get')
+    def test_device_call_time(self, mock_get):
+        mock_get.return_value.status_code = 200
+        video = Video.objects.create(title='test video', description='test description', views=0)
+        timestamp = TimeStamp.objects.create(video=video, aroma='B', moment='00:00:10')
+        response = self.client.post(reverse('trigger'), {'timestamp': timestamp.id}, format='json')
+        self.assertEqual(response.status_code, 204)
+        output = self.registry.render()
+        self.assertIn('aromastream_device_call_seconds_count{device="http://localhost:1203"', output)
+        self.assertIn('aromastream_request_device_seconds_count{method="POST",view="trigger"', output)
+
+    @override_settings(METRICS_SLOW_REQUEST_THRESHOLD=0)
+    def test_slow_request_log(self):
+        with self.assertLogs('aromastream.slow_requests') as logs:
+            self.client.get(reverse('user'))
+        self.assertIn('SELECT', logs.output[0])
+
+    def test_metrics_endpoint(self):
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class BenchmarkTests(APITransactionTestCase):
+    def setUp(self):
+        isolate_view_counter(self)
+        isolate_throttle_store(self)
+
+    def test_percentile(self):
+        self.assertEqual(percentile([4, 1, 3, 2], 0.5), 2.5)
+        self.assertEqual(percentile([1, 2, 3], 0.99), 2.98)
+        self.assertIsNone(percentile([], 0.5))
+
+    def test_compare(self):
+        baseline = {'flows': {'list': {'p95_ms': 10.0, 'throughput_rps': 100.0}}}
+        current = {'flows': {'list': {'p95_ms': 15.0, 'throughput_rps': 90.0}}}
+        rows, regressions = compare(baseline, current, 0.2)
+        self.assertEqual(len(rows), 2)
+        self.assertEqual([row[1] for row in regressions], ['p95_ms'])
+
+    def test_throughput_spans_the_whole_run(self):
+        class SlowTransport:
+            def request(self, method, path, token=None, data=None):
+                if path != '/api/login/':
+                    time.sleep(0.05)
+                return 200, b'{"token": "token"}', None
+
+            def close(self):
+                pass
+
+        fixtures = SimpleNamespace(usernames=['bench-0'], video_ids=[1], timestamp_ids=[1])
+        result = run_flow('list', SlowTransport, fixtures, requests_count=4, concurrency=1)
+        # 4 requests of 50 ms each: a window of only the last request would report 80/s.
+        self.assertLess(result['throughput_rps'], 25)
+
+    def test_seed_and_run(self):
+        call_command('seed_benchmark', users=2, videos=3, timestamps_per_video=2, stdout=StringIO())
+        self.assertEqual(TimeStamp.objects.count(), 6)
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'result.json')
+            call_command('benchmark', requests=4, concurrency=2, device_latency=0, output=output, stdout=StringIO())
+            with open(output) as file:
+                report = json.load(file)
+        self.assertEqual(set(report['flows']), {'login', 'list', 'search', 'detail', 'trigger'})
+        for result in report['flows'].values():
+            self.assertEqual(result['requests'], 4)
+            self.assertEqual(result['errors'], 0)
+            self.assertGreater(result['queries_per_request'], 0)
+
+
+class ClaimsAuthenticationTests(APITestCase):
+    def setUp(self):
+        isolate_throttle_store(self)
+        self.user = User.objects.create_user(username='testuser', password='testpassword', is_staff=True)
+        self.factory = APIRequestFactory()
+        verified_tokens.clear()
+
+    def authenticate(self, token):
+        request = self.factory.get('/', HTTP_AUTHORIZATION='Bearer ' + str(token))
+        return ClaimsJWTAuthentication().authenticate(request)[0]
+
+    def test_login_token_has_claims(self):
+        response = self.client.post(reverse('login'), {'username': 'testuser', 'password': 'testpassword'}, format='json')
+        token = ClaimsSlidingToken(response.data['token'])
+        self.assertTrue(token['staff'])
+        self.assertFalse(token['superuser'])
+        self.assertNotIn('subscription', token)
+
+    def test_claims_user_is_lazy(self):
+        token = ClaimsSlidingToken.for_user(self.user)
+        with self.assertNumQueries(0):
+            user = self.authenticate(token)
+            self.assertIsInstance(user, ClaimsUser)
+            self.assertEqual(user.pk, self.user.pk)
+            self.assertTrue(user.is_authenticated and user.is_staff)
+            self.assertFalse(user.is_loaded)
+        with self.assertNumQueries(1):
+            self.assertEqual(user.username, 'testuser')
+            self.assertEqual(user.email, self.user.email)
+
+    def test_token_without_claims_loads_user(self):
+        with self.assertNumQueries(1):
+            user = self.authenticate(SlidingToken.for_user(self.user))
+        self.assertNotIsInstance(user, ClaimsUser)
+
+    def test_verified_token_cache(self):
+        token = ClaimsSlidingToken.for_user(self.user)
+        with patch('aromastream.authentication.JWTAuthentication.get_validated_token', wraps=JWTAuthentication().get_validated_token) as validate:
+            self.authenticate(token)
+            self.authenticate(token)
+        self.assertEqual(validate.call_count, 1)
+
+    def test_changed_user_is_checked_against_database(self):
+        token = ClaimsSlidingToken.for_user(self.user)
+        self.user.is_staff = False
+        self.user.save()
+        user = self.authenticate(token)
+        self.assertNotIsInstance(user, ClaimsUser)
+        self.assertFalse(user.is_staff)
+
+        self.user.is_active = False
+        self.user.save(update_fields=['is_active'])
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate(token)
+
+    def test_deleted_user_is_rejected(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(ClaimsSlidingToken.for_user(self.user)))
+        self.user.delete()
+        response = self.client.get(reverse('user'))
+        self.assertEqual(response.status_code, 401)
+
+    def test_claims_token_on_endpoint(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(ClaimsSlidingToken.for_user(self.user)))
+        response = self.client.get(reverse('user'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['username'], 'testuser')
+
+
+class EntitlementTests(APITestCase):
+    def setUp(self):
+        isolate_view_counter(self)
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(ClaimsSlidingToken.for_user(self.user)))
+        self.video = Video.objects.create(title='test video', description='test description', views=0)
+
+    def test_lookup_is_cached(self):
+        self.assertFalse(has_active_subscription(self.user.pk))
+        with self.assertNumQueries(0):
+            self.assertFalse(has_active_subscription(self.user.pk))
+
+    def test_subscription_change_invalidates(self):
+        self.assertFalse(has_active_subscription(self.user.pk))
+        self.user.subscription.active = True
+        self.user.subscription.save()
+        self.assertTrue(has_active_subscription(self.user.pk))
+
+    def test_detail_requires_subscription(self):
+        response = self.client.get(reverse('video_detail', args=[self.video.id]))
+        self.assertEqual(response.status_code, 403)
+        self.user.subscription.active = True
+        self.user.subscription.save()
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('video_detail', args=[self.video.id]))
+        self.assertEqual(response.status_code, 200)
+
+
+class DeviceTests(APITestCase):
+    def setUp(self):
+        isolate_throttle_store(self)
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.user.subscription.active = True
+        self.user.subscription.save()
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(SlidingToken.for_user(self.user)))
+        video = Video.objects.create(title='test video', description='test description', views=0)
+        self.timestamp = TimeStamp.objects.create(video=video, aroma='C', moment='00:00:10')
+        self.online = Device.objects.create(name='living room', user=self.user, url='http://10.0.0.1:1203/{}')
+        self.offline = Device.objects.create(name='bedroom', user=self.user, url='http://10.0.0.2:1203/{}')
+        Device.objects.create(name='lobby', room='lobby', url='http://10.0.0.3:1203/{}')
+
+    @staticmethod
+    def device_get(url, timeout):
+        if url.startswith('http://10.0.0.2'):
+            raise requests.ConnectTimeout()
+        response = requests.Response()
+        response.status_code = 200
+        return response
+
+    def test_circuit_breaker(self):
+        breaker = CircuitBreaker(threshold=2, cooldown=60)
+        breaker.record(False)
+        self.assertTrue(breaker.allow())
+        breaker.record(False)
+        self.assertFalse(breaker.allow())
+        breaker.opened_at -= 60
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record(True)
+        self.assertTrue(breaker.allow())
+
+    @override_settings(DEVICE_HEALTH_WRITE_INTERVAL=0)
+    def test_trigger_fans_out(self):
+        with patch('aromastream.dispatcher.requests.Session.get', side_effect=self.device_get) as mock_get:
+            response = self.client.post(reverse('trigger'), {'timestamp': self.timestamp.id}, format='json')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([result['status'] for result in response.data['devices']], ['delivered', 'failed'])
+        self.assertEqual({call.args[0] for call in mock_get.call_args_list}, {'http://10.0.0.1:1203/C', 'http://10.0.0.2:1203/C'})
+        self.offline.refresh_from_db()
+        self.online.refresh_from_db()
+        self.assertFalse(self.offline.healthy)
+        self.assertTrue(self.online.healthy)
+        self.assertIsNotNone(self.online.last_seen)
+
+    def test_trigger_room(self):
+        with patch('aromastream.dispatcher.requests.Session.get', side_effect=self.device_get) as mock_get:
+            response = self.client.post(reverse('trigger'), {'timestamp': self.timestamp.id, 'room': 'lobby'}, format='json')
+        self.assertEqual(response.status_code, 204)
+        mock_get.assert_called_once_with('http://10.0.0.3:1203/C', timeout=get_dispatcher().timeout)
+
+        response = self.client.post(reverse('trigger'), {'timestamp': self.timestamp.id, 'room': 'attic'}, format='json')
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(DEVICE_HEALTH_WRITE_INTERVAL=60)
+    def test_failures_between_health_writes_are_counted(self):
+        targets = [Target(self.offline.url, self.offline)]
+        failed = [DeliveryResult(self.offline.url, error='ConnectTimeout')]
+        for _ in range(3):
+            record_health(targets, failed)
+        self.offline.refresh_from_db()
+        self.assertEqual(self.offline.failures, 1)
+        with override_settings(DEVICE_HEALTH_WRITE_INTERVAL=0):
+            record_health(targets, failed)
+        self.offline.refresh_from_db()
+        self.assertEqual(self.offline.failures, 4)
+
+    def test_device_without_url(self):
+        device = Device(name='unconfigured', user=self.user)
+        with self.assertRaises(ValidationError):
+            device.full_clean()
+        device.save()
+        self.assertEqual([target.device_id for target in resolve_targets(self.user.pk)], [self.online.pk, self.offline.pk])
+        Device.objects.exclude(pk=device.pk).update(active=False)
+        self.assertEqual(resolve_targets(self.user.pk), [])
+
+    def test_device_list(self):
+        response = self.client.get(reverse('devices'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([device['name'] for device in response.data], ['living room', 'bedroom'])
+
+
+@override_settings(DEVICE_PUSH_POLL_INTERVAL=0.05)
+class DevicePushTests(APITestCase):
+    def setUp(self):
+        isolate_throttle_store(self)
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.user.subscription.active = True
+        self.user.subscription.save()
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(SlidingToken.for_user(self.user)))
+        video = Video.objects.create(title='test video', description='test description', views=0)
+        self.timestamp = TimeStamp.objects.create(video=video, aroma='D', moment='00:00:10')
+        self.device = Device.objects.create(name='bridge', user=self.user, transport='push')
+
+    def connect(self, token):
+        scope = {'type': 'websocket', 'path': '/ws/devices/', 'query_string': f'token={token}'.encode(), 'headers': []}
+        return ApplicationCommunicator(DeviceGateway(), scope)
+
+    @override_settings(TRIGGER_COALESCE_WINDOW=0)
+    def test_trigger_writes_outbox(self):
+        response = self.client.post(reverse('trigger'), {'timestamp': self.timestamp.id}, format='json')
+        self.assertEqual(response.status_code, 204)
+        response = self.client.post(reverse('trigger') + '?async=1', {'timestamp': self.timestamp.id}, format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(list(DeviceMessage.objects.order_by('seq').values_list('seq', 'aroma')), [(1, 'D'), (2, 'D')])
+
+        delivery = response.data['delivery']
+        response = self.client.get(reverse('trigger_status', args=[delivery]))
+        self.assertEqual(response.data['status'], 'queued')
+
+        DeviceMessage.objects.update(created_at=timezone.now() - timedelta(seconds=settings.DEVICE_PUSH_MESSAGE_TTL + 1))
+        response = self.client.get(reverse('trigger_status', args=[delivery]))
+        self.assertEqual(response.data['status'], 'expired')
+
+        other = User.objects.create_user(username='otheruser', password='testpassword')
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(SlidingToken.for_user(other)))
+        response = self.client.get(reverse('trigger_status', args=[delivery]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_gateway_delivers_and_acknowledges(self):
+        push_cue(self.device.pk, 'A')
+        push_cue(self.device.pk, 'B')
+
+        async def converse():
+            communicator = self.connect(self.device.token)
+            await communicator.send_input({'type': 'websocket.connect'})
+            self.assertEqual((await communicator.receive_output(1))['type'], 'websocket.accept')
+            cues = [json.loads((await communicator.receive_output(1))['text']) for _ in range(2)]
+            await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps({'type': 'ack', 'seq': 2})})
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await communicator.wait(1)
+            return cues
+
+        cues = async_to_sync(converse)()
+        self.assertEqual([(cue['seq'], cue['aroma']) for cue in cues], [(1, 'A'), (2, 'B')])
+        self.assertFalse(DeviceMessage.objects.filter(acked_at__isnull=True).exists())
+        self.device.refresh_from_db()
+        self.assertIsNotNone(self.device.last_seen)
+
+    def test_gateway_rejects_unknown_token(self):
+        async def converse():
+            communicator = self.connect('wrong')
+            await communicator.send_input({'type': 'websocket.connect'})
+            return await communicator.receive_output(1)
+
+        self.assertEqual(async_to_sync(converse)(), {'type': 'websocket.close', 'code': 4401})
+
+    def test_gateway_closes_when_sender_fails(self):
+        async def converse():
+            communicator = self.connect(self.device.token)
+            await communicator.send_input({'type': 'websocket.connect'})
+            await communicator.receive_output(1)
+            return await communicator.receive_output(1)
+
+        with patch.object(DeviceGateway, 'send_pending', side_effect=OperationalError('connection lost')), \
+                self.assertLogs('aromastream.push', 'ERROR'):
+            self.assertEqual(async_to_sync(converse)(), {'type': 'websocket.close', 'code': 1011})
+
+
+class LeadTimeTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.device = Device.objects.create(name='bridge', user=self.user, transport='push')
+        self.estimator = get_estimator()
+        for command in ('http://lead.test/A', 'http://lead.test/C', lead_command(self.device.pk, 'A'), 'ewma'):
+            self.estimator.cache.delete(LeadTimeEstimator.key(command))
+
+    def test_estimate_is_weighted_average(self):
+        estimator = LeadTimeEstimator(alpha=0.5, default=1.0, maximum=5, cache_alias='default')
+        self.assertEqual(estimator.lead('ewma'), 1.0)
+        estimator.observe('ewma', 2.0)
+        self.assertEqual(estimator.lead('ewma'), 2.0)
+        estimator.observe('ewma', 1.0)
+        self.assertEqual(estimator.lead('ewma'), 1.5)
+        estimator.observe('ewma', 100)
+        self.assertEqual(estimator.lead('ewma'), 3.25)
+
+    def test_lead_covers_deviation(self):
+        estimator = LeadTimeEstimator(alpha=0.5, default=1.0, maximum=5, cache_alias='default', deviations=2)
+        estimator.observe('ewma', 1.0)
+        self.assertEqual(estimator.lead('ewma'), 2.0)
+        estimator.observe('ewma', 1.0)
+        self.assertEqual(estimator.lead('ewma'), 1.5)
+
+    @override_settings(LEAD_TIME_HTTP_ACTUATION=2.0)
+    def test_round_trip_excludes_actuation(self):
+        observe_round_trip('http://lead.test/A', 2.3)
+        self.assertAlmostEqual(self.estimator.stats('http://lead.test/A')['mean'], 0.3)
+
+    @override_settings(LEAD_TIME_DEFAULT=1.0)
+    def test_plan_fires_cues_early(self):
+        self.estimator.observe('http://lead.test/C', 0.4)
+        push_template = f'push:{self.device.pk}'
+        item = _ScheduledSession('lead', [(0, 'A'), (2, 'C')])
+        item.plan(0.5, ['lead.test/{}', push_template], horizon=10)
+
+        events = [(round(event.due, 2), round(event.fire_position, 2), event.aroma, event.template, event.predeliver)
+                  for event in item.events]
+        self.assertEqual(events, [
+            (-9.0, 1.0, 'C', push_template, True),
+            (1.4, 1.4, 'C', 'lead.test/{}', False),
+        ])
+
+    def test_predelivered_cue_and_cancel(self):
+        message = push_cue(self.device.pk, 'A', fire_at=1718000000.5)
+        cancel_cue(message)
+        self.assertFalse(DeviceMessage.objects.exists())
+
+        message = push_cue(self.device.pk, 'A', fire_at=1718000000.5)
+        DeviceMessage.objects.filter(pk=message.pk).update(sent_at=message.created_at)
+        cancel_cue(message)
+        self.assertEqual(list(DeviceMessage.objects.filter(kind='cancel').values_list('seq', 'cancels')), [(3, 2)])
+
+    def test_gateway_syncs_clock_and_learns_lead(self):
+        push_cue(self.device.pk, 'A', fire_at=1718000000.5)
+        scope = {'type': 'websocket', 'path': '/ws/devices/', 'query_string': f'token={self.device.token}'.encode(), 'headers': []}
+
+        async def converse():
+            communicator = ApplicationCommunicator(DeviceGateway(), scope)
+            await communicator.send_input({'type': 'websocket.connect'})
+            await communicator.receive_output(1)
+            cue = json.loads((await communicator.receive_output(1))['text'])
+            await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps({'type': 'sync', 't0': 12.5})})
+            sync = json.loads((await communicator.receive_output(1))['text'])
+            await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps({'type': 'fired', 'seq': 1, 'lead_ms': 1800})})
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await communicator.wait(1)
+            return cue, sync
+
+        cue, sync = async_to_sync(converse)()
+        self.assertEqual((cue['type'], cue['aroma'], cue['fire_at']), ('cue', 'A', 1718000000.5))
+        self.assertEqual((sync['type'], sync['t0']), ('sync', 12.5))
+        self.assertIn('server_time', sync)
+        self.assertEqual(self.estimator.stats(lead_command(self.device.pk, 'A'))['mean'], 1.8)
+
+
+class AsyncViewTests(APITestCase):
+    def setUp(self):
+        isolate_throttle_store(self)
+        isolate_view_counter(self)
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.user.subscription.active = True
+        self.user.subscription.save()
+        self.token = str(ClaimsSlidingToken.for_user(self.user))
+        self.factory = APIRequestFactory()
+        self.video = Video.objects.create(title='test video', description='test description', views=0)
+        self.timestamp = TimeStamp.objects.create(video=self.video, aroma='B', moment='00:00:10')
+
+    def call(self, view_class, request, **kwargs):
+        return async_to_sync(view_class.as_view())(request, **kwargs)
+
+    def test_detail(self):
+        request = self.factory.get('/', HTTP_AUTHORIZATION='Bearer ' + self.token)
+        response = self.call(AsyncVideoDetailView, request, video_id=self.video.id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['title'], 'test video')
+
+        response = self.call(AsyncVideoDetailView, self.factory.get('/', HTTP_AUTHORIZATION='Bearer ' + self.token), video_id=0)
+        self.assertEqual(response.status_code, 404)
+
+    def test_detail_requires_subscription(self):
+        self.user.subscription.active = False
+        self.user.subscription.save()
+        response = self.call(AsyncVideoDetailView, self.factory.get('/', HTTP_AUTHORIZATION='Bearer ' + self.token), video_id=self.video.id)
+        self.assertEqual(response.status_code, 403)
+        response = self.call(AsyncVideoDetailView, self.factory.get('/'), video_id=self.video.id)
+        self.assertEqual(response.status_code, 401)
+
+    def test_list_is_cached(self):
+        request = self.factory.get('/api/videos/', {'page_size': 5}, HTTP_AUTHORIZATION='Bearer ' + self.token)
+        response = self.call(AsyncVideoListView, request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 1)
+
+        request = self.factory.get('/api/videos/', {'page_size': 5}, HTTP_AUTHORIZATION='Bearer ' + self.token,
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        with self.assertNumQueries(0):
+            response = self.call(AsyncVideoListView, request)
+        self.assertEqual(response.status_code, 304)
+
+    def test_middleware_runs_async(self):
+        async def get_response(request):
+            return HttpResponse(status=204)
+
+        middleware = MetricsMiddleware(APILogMiddleware(get_response))
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = async_to_sync(middleware)(self.factory.get('/api/videos/'))
+        self.assertEqual(response.status_code, 204)
+
+    @patch('aromastream.dispatcher.AsyncTriggerDispatcher.send', new_callable=AsyncMock)
+    def test_trigger(self, mock_send):
+        mock_send.return_value = DeliveryResult('http://localhost:1203/B', status_code=200)
+        request = self.factory.post('/', {'timestamp': self.timestamp.id}, format='json', HTTP_AUTHORIZATION='Bearer ' + self.token)
+        response = self.call(AsyncTriggerListView, request)
+        self.assertEqual(response.status_code, 204)
+        mock_send.assert_awaited_once_with('http://localhost:1203/B')
+
+        request = self.factory.post('/', {'timestamp': 0}, format='json', HTTP_AUTHORIZATION='Bearer ' + self.token)
+        response = self.call(AsyncTriggerListView, request)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('timestamp', response.data)
+
+    @patch('aromastream.dispatcher.AsyncTriggerDispatcher.send', new_callable=AsyncMock)
+    def test_trigger_fans_out(self, mock_send):
+        Device.objects.create(name='one', user=self.user, url='http://one.local/{}')
+        Device.objects.create(name='two', user=self.user, url='http://two.local/{}')
+        mock_send.side_effect = lambda url: DeliveryResult(url, status_code=200 if 'one' in url else None, error='ConnectTimeout')
+        request = self.factory.post('/', {'timestamp': self.timestamp.id}, format='json', HTTP_AUTHORIZATION='Bearer ' + self.token)
+        response = self.call(AsyncTriggerListView, request)
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([device['status'] for device in response.data['devices']], ['delivered', 'failed'])
+
+
+class DatabaseRoutingTests(APITestCase):
+    def test_replica_reads(self):
+        with override_settings(DATABASE_READ_REPLICAS=['replica1']):
+            self.assertEqual(Video.objects.all().db, 'default')
+            with replica_reads():
+                self.assertEqual(Video.objects.all().db, 'replica1')
+                self.assertEqual(Video.objects.all().using('default').db, 'default')
+            self.assertEqual(Video.objects.all().db, 'default')
+        with replica_reads():
+            self.assertEqual(Video.objects.all().db, 'default')
+
+    def test_cache_fill_after_invalidation_reads_primary(self):
+        reads = []
+
+        class View:
+            @cached_response('routing')
+            @replica_reads()
+            def get(self, request):
+                reads.append(Video.objects.all().db)
+                return Response({})
+
+        version_cache().delete(invalidated_key('routing'))
+        factory = APIRequestFactory()
+        with override_settings(DATABASE_READ_REPLICAS=['replica1']):
+            View().get(factory.get('/first/'))
+            invalidate('routing')
+            View().get(factory.get('/second/'))
+        self.assertEqual(reads, ['replica1', 'default'])
+
+    def test_pool_reuses_connections(self):
+        settings_dict = dict(connections['default'].settings_dict, CONN_MAX_AGE=0, OPTIONS={'pool': {'size': 1, 'timeout': 0.1}})
+        self.addCleanup(close_pools)
+
+        first = PooledDatabaseWrapper(dict(settings_dict), alias='pool_test')
+        first.ensure_connection()
+        raw = first.connection
+        first.close()
+
+        second = PooledDatabaseWrapper(dict(settings_dict), alias='pool_test')
+        second.ensure_connection()
+        self.assertIs(second.connection, raw)
+        with second.cursor() as cursor:
+            cursor.execute('SELECT 1')
+            self.assertEqual(cursor.fetchone(), (1,))
+
+        third = PooledDatabaseWrapper(dict(settings_dict), alias='pool_test')
+        with self.assertRaises(OperationalError):
+            third.ensure_connection()
+        second.close()
+        third.ensure_connection()
+        self.assertIs(third.connection, raw)
+        third.close()
+
@@ -0,0 +1,295 @@
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from rest_framework.exceptions import Throttled
+from rest_framework.throttling import BaseThrottle
+
+
+DURATIONS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+PRUNE_EVERY = 1000
+
+
+def parse_rate(rate):
+    """
+    '30/min' -> tokens per second.
+    """
+    count, period = rate.split('/')
+    return int(count) / DURATIONS[period[0]]
+
+
+class BucketStore:
+    """
+    Token buckets and coalescing claims. ``acquire`` is atomic: either every
+    bucket it needs has a token and all of them are taken, or nothing
+    changes and the wait until they would have is returned.
+    """
+
+    def acquire(self, entries, window=0):
+        """
+        ``entries`` are (claim key or None, [(bucket key, rate, capacity)]).
+        An entry whose claim was made less than ``window`` seconds ago is
+        coalesced and costs no tokens. Returns (wait, admitted flags, the
+        delivery id stored with the claim of each coalesced entry).
+        """
+        now = time.time()
+        with self.transaction():
+            claims = [claim for claim, _ in entries if claim]
+            live = self.live_claims(claims, now)
+            admitted = [not (claim and claim in live) for claim, _ in entries]
+            deliveries = [None if ok else live[claim] for (claim, _), ok in zip(entries, admitted)]
+
+            needed = {}
+            for (_, buckets), ok in zip(entries, admitted):
+                if ok:
+                    for key, rate, capacity in buckets:
+                        needed[key] = (needed.get(key, (0,))[0] + 1, rate, capacity)
+
+            state = self.read_buckets(list(needed), now)
+            wait, updates = 0.0, []
+            for key, (count, rate, capacity) in needed.items():
+                tokens, updated = state.get(key, (capacity, now))
+                tokens = min(capacity, tokens + (now - updated) * rate)
+                if tokens < count:
+                    wait = max(wait, (count - tokens) / rate)
+                updates.append((key, tokens - count, now, now + (capacity - tokens + count) / rate))
+            if wait:
+                return wait, admitted, deliveries
+
+            self.write_buckets(updates)
+            if window:
+                self.write_claims([(claim, now + window) for (claim, _), ok in zip(entries, admitted) if claim and ok])
+        return 0.0, admitted, deliveries
+
+
+class SQLiteBucketStore(BucketStore):
+    """
+    Buckets kept in a local SQLite file, shared by every worker on the host.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._local = threading.local()
+        self._calls = 0
+
+    @property
+    def connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS buckets '
+                               '(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, full_at REAL NOT NULL)')
+            connection.execute('CREATE TABLE IF NOT EXISTS cue_claims (key TEXT PRIMARY KEY, until REAL NOT NULL, delivery TEXT)')
+            self._local.connection = connection
+        return connection
+
+    def transaction(self):
+        return _SQLiteTransaction(self)
+
+    def live_claims(self, keys, now):
+        if not keys:
+            return {}
+        rows = self.connection.execute(
+            f'SELECT key, delivery FROM cue_claims WHERE until > ? AND key IN ({", ".join("?" * len(keys))})', [now, *keys]
+        )
+        return dict(rows)
+
+    def read_buckets(self, keys, now):
+        if not keys:
+            return {}
+        rows = self.connection.execute(
+            f'SELECT key, tokens, updated FROM buckets WHERE key IN ({", ".join("?" * len(keys))})', keys
+        )
+        return {key: (tokens, updated) for key, tokens, updated in rows}
+
+    def write_buckets(self, updates):
+        self.connection.executemany(
+            'INSERT INTO buckets (key, tokens, updated, full_at) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated, full_at = excluded.full_at',
+            updates,
+        )
+
+    def write_claims(self, claims):
+        self.connection.executemany(
+            'INSERT INTO cue_claims (key, until) VALUES (?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET until = excluded.until, delivery = NULL', claims
+        )
+
+    def settle_claims(self, released, deliveries):
+        if released:
+            self.connection.execute(f'DELETE FROM cue_claims WHERE key IN ({", ".join("?" * len(released))})', released)
+        if deliveries:
+            self.connection.executemany('UPDATE cue_claims SET delivery = ? WHERE key = ?',
+                                        [(delivery, key) for key, delivery in deliveries])
+
+    def prune(self):
+        """
+        Drops full buckets and expired claims; a missing row means the same.
+        """
+        now = time.time()
+        self.connection.execute('DELETE FROM buckets WHERE full_at <= ?', (now,))
+        self.connection.execute('DELETE FROM cue_claims WHERE until <= ?', (now,))
+
+    def clear(self):
+        self.connection.execute('DELETE FROM buckets')
+        self.connection.execute('DELETE FROM cue_claims')
+
+
+class _SQLiteTransaction:
+
+    def __init__(self, store):
+        self.store = store
+
+    def __enter__(self):
+        self.store.connection.execute('BEGIN IMMEDIATE')
+
+    def __exit__(self, exc_type, exc, tb):
+        connection = self.store.connection
+        if exc_type is not None:
+            connection.execute('ROLLBACK')
+            return
+        connection.execute('COMMIT')
+        self.store._calls += 1
+        if self.store._calls % PRUNE_EVERY == 0:
+            self.store.prune()
+
+
+class MemoryBucketStore(BucketStore):
+    """
+    Per-process buckets, so every worker enforces its own budget.
+    """
+
+    def __init__(self):
+        self._buckets = {}
+        self._claims = {}
+        self._lock = threading.RLock()
+
+    def transaction(self):
+        return self._lock
+
+    def live_claims(self, keys, now):
+        return {key: self._claims[key][1] for key in keys if key in self._claims and self._claims[key][0] > now}
+
+    def read_buckets(self, keys, now):
+        return {key: self._buckets[key][:2] for key in keys if key in self._buckets}
+
+    def write_buckets(self, updates):
+        for key, tokens, updated, full_at in updates:
+            self._buckets[key] = (tokens, updated, full_at)
+
+    def write_claims(self, claims):
+        self._claims.update((key, (until, None)) for key, until in claims)
+
+    def settle_claims(self, released, deliveries):
+        with self._lock:
+            for key in released:
+                self._claims.pop(key, None)
+            for key, delivery in deliveries:
+                if key in self._claims:
+                    self._claims[key] = (self._claims[key][0], delivery)
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+            self._claims.clear()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if settings.THROTTLE_BACKEND == 'sqlite':
+                    _store = SQLiteBucketStore(settings.THROTTLE_PATH)
+                else:
+                    _store = MemoryBucketStore()
+    return _store
+
+
+def bucket(scope, kind, ident):
+    """
+    (key, rate, capacity) of a bucket of the THROTTLE_POLICIES entry of
+    ``scope``, or None when the policy does not limit ``kind``.
+    """
+    rule = settings.THROTTLE_POLICIES.get(scope, {}).get(kind)
+    if rule is None or ident is None:
+        return None
+    rate, capacity = rule
+    return f'{scope}:{kind}:{ident}', parse_rate(rate), capacity
+
+
+class BucketThrottle(BaseThrottle):
+    """
+    Token buckets per user and per client IP, configured by the
+    THROTTLE_POLICIES entry named by the view's ``throttle_scope``.
+    Anonymous requests are counted against the username they submit.
+    """
+
+    def allow_request(self, request, view):
+        scope = getattr(view, 'throttle_scope', None)
+        buckets = [
+            entry for entry in (bucket(scope, 'user', self.get_user_ident(request)), bucket(scope, 'ip', self.get_ident(request)))
+            if entry is not None
+        ]
+        if not buckets:
+            return True
+        self.wait_time = get_store().acquire([(None, buckets)])[0]
+        return not self.wait_time
+
+    def wait(self):
+        return self.wait_time
+
+    @staticmethod
+    def get_user_ident(request):
+        if request.user and request.user.is_authenticated:
+            return request.user.pk
+        if isinstance(request.data, dict):
+            return request.data.get(get_user_model().USERNAME_FIELD) or None
+        return None
+
+
+def cue_claim(user_id, target, aroma):
+    return f'cue:{user_id}:{target.device_id or target.url}:{aroma}'
+
+
+def admit_cue(user_id, targets, aroma):
+    """
+    Takes a token from the 'device' bucket of every target and drops the
+    targets that were sent the same aroma by this user within
+    TRIGGER_COALESCE_WINDOW seconds. Raises Throttled when a device is out
+    of tokens.
+
+    Returns the admitted targets and the delivery ids stored for the
+    dropped ones (None when their cue was sent synchronously). Admitted
+    targets are claimed until ``settle_cue`` reports their delivery.
+    """
+    window = settings.TRIGGER_COALESCE_WINDOW
+    entries = []
+    for target in targets:
+        device_bucket = bucket('trigger', 'device', target.device_id or target.url)
+        entries.append((cue_claim(user_id, target, aroma) if window else None, [device_bucket] if device_bucket else []))
+    wait, admitted, deliveries = get_store().acquire(entries, window)
+    if wait:
+        raise Throttled(wait=wait)
+    return [target for target, ok in zip(targets, admitted) if ok], [delivery for delivery, ok in zip(deliveries, admitted) if not ok]
+
+
+def settle_cue(user_id, targets, aroma, delivered, deliveries=None):
+    """
+    Releases the claims of the targets whose delivery failed, so retrying
+    them is not coalesced into the failure, and stores the delivery ids of
+    queued cues for requests coalesced into them.
+    """
+    if not settings.TRIGGER_COALESCE_WINDOW:
+        return
+    deliveries = deliveries or [None] * len(targets)
+    released = [cue_claim(user_id, target, aroma) for target, ok in zip(targets, delivered) if not ok]
+    queued = [(cue_claim(user_id, target, aroma), delivery) for target, ok, delivery in zip(targets, delivered, deliveries) if ok and delivery]
+    get_store().settle_claims(released, queued)
@@ -0,0 +1,140 @@
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .caching import invalidate
+from .models import TrendingState, Video, VideoViewBucket
+from .periodic import PeriodicTask
+
+
+LOCK_ID = 0x7472656e64  # 'trend'
+
+
+def hour_start(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def record_views(counts, moment=None):
+    """
+    Adds flushed view counts ({video_id: views}) to the hourly buckets.
+    """
+    if not counts:
+        return
+    hour = hour_start(moment or timezone.now())
+    table = connection.ops.quote_name(VideoViewBucket._meta.db_table)
+    videos = connection.ops.quote_name(Video._meta.db_table)
+    # Selecting from the video table skips views of videos deleted meanwhile.
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT INTO {table} (video_id, hour, views, applied) SELECT id, %s, %s, 0 FROM {videos} WHERE id = %s '
+            f'ON CONFLICT (video_id, hour) DO UPDATE SET views = {table}.views + EXCLUDED.views',
+            [(hour, count, video_id) for video_id, count in counts.items()],
+        )
+
+
+def decay(seconds):
+    return 0.5 ** (max(seconds, 0) / settings.TRENDING_HALF_LIFE)
+
+
+def acquire_lock():
+    """
+    Keeps workers from updating the scores at the same time; the lock is
+    released with the transaction.
+    """
+    if connection.vendor != 'postgresql':
+        return True
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_try_advisory_xact_lock(%s)', [LOCK_ID])
+        return cursor.fetchone()[0]
+
+
+def update_trending(rebuild=False):
+    """
+    Folds new bucket views into ``Video.trending_score`` and ranks the top
+    TRENDING_TOP_N videos into ``Video.trending_rank``.
+
+    Scores halve every TRENDING_HALF_LIFE seconds, so an update only decays
+    the existing scores by the time since the last one and adds the views
+    not applied yet. Without a previous update (or with ``rebuild``) the
+    scores are recomputed from the retained buckets. Returns the number of
+    ranked videos, or None when another worker holds the lock.
+    """
+    now = time.time()
+    with transaction.atomic():
+        if not acquire_lock():
+            return None
+        state, _ = TrendingState.objects.get_or_create(pk=1)
+        updated_at = None if rebuild else state.updated_at
+        if updated_at is None:
+            Video.objects.filter(trending_score__gt=0).update(trending_score=0)
+            buckets = VideoViewBucket.objects.all()
+        else:
+            Video.objects.filter(trending_score__gt=0).update(trending_score=F('trending_score') * decay(now - updated_at))
+            Video.objects.filter(trending_score__gt=0, trending_score__lt=settings.TRENDING_MIN_SCORE).update(trending_score=0)
+            buckets = VideoViewBucket.objects.filter(views__gt=F('applied'))
+        apply_buckets(buckets, now, rebuild=updated_at is None)
+        ranked = rank()
+        cutoff = timezone.now() - timedelta(seconds=settings.TRENDING_BUCKET_RETENTION)
+        VideoViewBucket.objects.filter(hour__lt=cutoff, views=F('applied')).delete()
+        state.updated_at = now
+        state.save(update_fields=['updated_at'])
+    invalidate('videos')
+    return ranked
+
+
+def apply_buckets(buckets, now, rebuild):
+    # Rows are locked, so a concurrent view flush waits until they are
+    # marked applied instead of being counted twice or lost.
+    rows = list(buckets.select_for_update().values_list('id', 'video_id', 'hour', 'views', 'applied'))
+    scores = defaultdict(float)
+    for _, video_id, hour, views, applied in rows:
+        if rebuild:
+            age = now - (hour + timedelta(hours=1)).timestamp()
+            scores[video_id] += views * decay(age)
+        else:
+            scores[video_id] += views - applied
+    if scores:
+        by_score = defaultdict(list)
+        for video_id, score in scores.items():
+            by_score[score].append(video_id)
+        for score, video_ids in by_score.items():
+            Video.objects.filter(id__in=video_ids).update(trending_score=F('trending_score') + score)
+        VideoViewBucket.objects.filter(id__in=[row[0] for row in rows]).update(applied=F('views'))
+
+
+def rank():
+    """
+    Materialises the top TRENDING_TOP_N videos; ties, e.g. videos without
+    recent views, fall back to lifetime views.
+    """
+    top = list(Video.objects.order_by('-trending_score', '-views', '-id').values_list('id', flat=True)[:settings.TRENDING_TOP_N])
+    Video.objects.filter(trending_rank__isnull=False).exclude(id__in=top).update(trending_rank=None)
+    Video.objects.bulk_update([Video(id=video_id, trending_rank=position) for position, video_id in enumerate(top, 1)], ['trending_rank'])
+    return len(top)
+
+
+_updater = None
+_updater_lock = threading.Lock()
+
+
+def start_trending_updater():
+    """
+    Starts the in-process trending update when TRENDING_UPDATE_INTERVAL is
+    set. Every process that loads the app gets its own, so this suits
+    single-process deployments; uWSGI runs the update_trending command from
+    its master instead.
+    """
+    global _updater
+    if settings.TRENDING_UPDATE_INTERVAL is None:
+        return
+    if _updater is None:
+        with _updater_lock:
+            if _updater is None:
+                _updater = PeriodicTask('trending-update', settings.TRENDING_UPDATE_INTERVAL, update_trending)
+    _updater.start()
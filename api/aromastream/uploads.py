@@ -0,0 +1,130 @@
+import hashlib
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Video, VideoUpload, VideoUploadChunk, upload_file_path
+
+
+BLOCK_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    pass
+
+
+def part_path(upload):
+    return default_storage.path(upload.file) + '.part'
+
+
+def create_upload(user, title, description, filename, size, chunk_size):
+    upload = VideoUpload(user_id=user.pk, title=title, description=description, file=upload_file_path(None, filename),
+                         size=size, chunk_size=chunk_size)
+    path = part_path(upload)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as part:
+        part.truncate(size)
+    upload.save()
+    return upload
+
+
+def write_chunk(upload, index, stream, checksum=None):
+    if upload.video_id is not None:
+        raise UploadError('upload is already complete')
+    if not 0 <= index < upload.chunk_count:
+        raise UploadError('chunk index out of range')
+
+    # The chunk is overwritten in place, so it only counts as received again
+    # once the new bytes are validated.
+    VideoUploadChunk.objects.filter(upload=upload, index=index).delete()
+    expected = upload.chunk_length(index)
+    digest = hashlib.sha256()
+    written = 0
+    with open(part_path(upload), 'r+b') as part:
+        part.seek(index * upload.chunk_size)
+        while stream is not None:
+            block = stream.read(BLOCK_SIZE)
+            if not block:
+                break
+            written += len(block)
+            if written > expected:
+                break
+            part.write(block)
+            digest.update(block)
+
+    if written != expected:
+        raise UploadError(f'chunk {index} must be {expected} bytes')
+    if checksum and checksum.lower() != digest.hexdigest():
+        raise UploadError(f'chunk {index} checksum mismatch')
+
+    VideoUploadChunk.objects.update_or_create(upload=upload, index=index,
+                                              defaults={'size': written, 'checksum': digest.hexdigest()})
+    return digest.hexdigest()
+
+
+def complete_upload(upload):
+    with transaction.atomic():
+        upload = VideoUpload.objects.select_for_update().get(pk=upload.pk)
+        if upload.video_id is not None:
+            return upload.video
+        received = upload.chunks.count()
+        if received != upload.chunk_count:
+            raise UploadError(f'{upload.chunk_count - received} chunks are missing')
+
+        corrupt = corrupt_chunks(upload)
+        if corrupt:
+            upload.chunks.filter(index__in=corrupt).delete()
+        else:
+            video = Video.objects.create(title=upload.title, description=upload.description, file=upload.file)
+            upload.video = video
+            upload.save(update_fields=['video'])
+            os.replace(part_path(upload), default_storage.path(upload.file))
+    if corrupt:
+        raise UploadError(f'chunks {", ".join(map(str, corrupt))} do not match their checksums')
+    return video
+
+
+def corrupt_chunks(upload):
+    """
+    Indexes of the chunks whose bytes in the ``.part`` file no longer hash
+    to the checksum recorded when they were received.
+    """
+    checksums = dict(upload.chunks.values_list('index', 'checksum'))
+    corrupt = []
+    with open(part_path(upload), 'rb') as part:
+        for index in range(upload.chunk_count):
+            digest = hashlib.sha256()
+            remaining = upload.chunk_length(index)
+            part.seek(index * upload.chunk_size)
+            while remaining:
+                block = part.read(min(BLOCK_SIZE, remaining))
+                if not block:
+                    break
+                digest.update(block)
+                remaining -= len(block)
+            if digest.hexdigest() != checksums.get(index):
+                corrupt.append(index)
+    return corrupt
+
+
+def reap_uploads(ttl=None):
+    """
+    Deletes the uploads not completed within VIDEO_UPLOAD_TTL seconds and
+    their ``.part`` files. Returns the number of uploads deleted.
+    """
+    cutoff = timezone.now() - timedelta(seconds=ttl or settings.VIDEO_UPLOAD_TTL)
+    deleted = 0
+    for upload in VideoUpload.objects.filter(video__isnull=True, created_at__lt=cutoff).iterator():
+        # Uploads completed meanwhile keep their row and their file.
+        if not VideoUpload.objects.filter(pk=upload.pk, video__isnull=True).delete()[0]:
+            continue
+        try:
+            os.remove(part_path(upload))
+        except FileNotFoundError:
+            pass
+        deleted += 1
+    return deleted
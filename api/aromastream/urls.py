@@ -1,11 +1,21 @@
+from django.conf import settings
 from django.urls import path
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView, SpectacularRedocView
-from rest_framework_simplejwt.views import TokenObtainSlidingView
 from . import views
 
+if settings.ASYNC_VIEWS:
+    from . import async_views
+    VideoListView = async_views.AsyncVideoListView
+    VideoDetailView = async_views.AsyncVideoDetailView
+    TriggerListView = async_views.AsyncTriggerListView
+else:
+    VideoListView = views.VideoListView
+    VideoDetailView = views.VideoDetailView
+    TriggerListView = views.TriggerListView
+
 
 urlpatterns = [
-    path('login/', TokenObtainSlidingView.as_view(), name='login'),
+    path('login/', views.LoginView.as_view(), name='login'),
     path('signup/', views.UserCreateView.as_view(), name='signup'),
     path('user/', views.UserGetView.as_view(), name='user'),
     path('user/update/', views.UserUpdateView.as_view(), name='user_update'),
@@ -13,11 +23,26 @@ urlpatterns = [
     path('password_reset/confirm/', views.UserPasswordUpdateConfirmView.as_view(), name='password_reset_confirm'),
     path('timestamps/', views.TimeStampCreateView.as_view(), name='timestamp_create'),
     path('timestamps/<int:video_id>/', views.TimeStampListView.as_view(), name='timestamp_list'),
-    path('videos/', views.VideoListView.as_view(), name='videos'),
-    path('videos/<int:video_id>/', views.VideoDetailView.as_view(), name='video_detail'),
+    path('timestamps/<int:video_id>/timeline/', views.TimeStampTimelineView.as_view(), name='timestamp_timeline'),
+    path('timestamps/<int:video_id>/bulk/', views.TimeStampBulkView.as_view(), name='timestamp_bulk'),
+    path('videos/', VideoListView.as_view(), name='videos'),
+    path('videos/uploads/', views.VideoUploadCreateView.as_view(), name='video_upload_create'),
+    path('videos/uploads/<uuid:upload_id>/', views.VideoUploadView.as_view(), name='video_upload'),
+    path('videos/uploads/<uuid:upload_id>/chunks/<int:index>/', views.VideoUploadChunkView.as_view(), name='video_upload_chunk'),
+    path('videos/uploads/<uuid:upload_id>/complete/', views.VideoUploadCompleteView.as_view(), name='video_upload_complete'),
+    path('videos/<int:video_id>/', VideoDetailView.as_view(), name='video_detail'),
+    path('videos/<int:video_id>/play/', views.VideoPlayView.as_view(), name='video_play'),
+    path('videos/<int:video_id>/stream/', views.VideoStreamView.as_view(), name='video_stream'),
+    path('videos/<int:video_id>/processing/', views.VideoProcessingView.as_view(), name='video_processing'),
     path('videos/popular/', views.PopularVideoListView.as_view(), name='popular_videos'),
     path('videos/search/', views.SearchVideoListView.as_view(), name='search_video'),
-    path('arduino/trigger', views.TriggerListView.as_view(), name='trigger'),
+    path('arduino/trigger', TriggerListView.as_view(), name='trigger'),
+    path('arduino/trigger/<str:delivery_id>', views.TriggerStatusView.as_view(), name='trigger_status'),
+    path('devices/', views.DeviceListView.as_view(), name='devices'),
+    path('playback/', views.PlaybackSessionCreateView.as_view(), name='playback_create'),
+    path('playback/<str:session_id>/', views.PlaybackSessionView.as_view(), name='playback_session'),
+    path('system/metrics/', views.MetricsView.as_view(), name='metrics'),
+    path('system/api-log/', views.APILogStatsView.as_view(), name='api_log_stats'),
     path('schema/', SpectacularAPIView.as_view(), name='schema'),
     path('schema/swagger-ui/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
     path('schema/redoc/', SpectacularRedocView.as_view(url_name='schema'), name='redoc'),
@@ -0,0 +1,119 @@
+import atexit
+import sqlite3
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .models import Video
+from .periodic import PeriodicTask
+from .trending import record_views
+
+
+class MemoryViewBuffer:
+    """
+    Per-process buffer. Only the owning process can flush it.
+    """
+
+    def __init__(self):
+        self._counts = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def add(self, video_id, count=1):
+        with self._lock:
+            self._counts[video_id] += count
+
+    def drain(self):
+        with self._lock:
+            counts, self._counts = dict(self._counts), defaultdict(int)
+        return counts
+
+
+class SQLiteViewBuffer:
+    """
+    Buffer kept in a local SQLite file, shared by every worker on the host
+    and by the ``flush_views`` management command.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS views (video_id INTEGER PRIMARY KEY, count INTEGER NOT NULL)')
+            self._local.connection = connection
+        return connection
+
+    def add(self, video_id, count=1):
+        self.connection.execute(
+            'INSERT INTO views (video_id, count) VALUES (?, ?) '
+            'ON CONFLICT (video_id) DO UPDATE SET count = count + excluded.count',
+            (video_id, count),
+        )
+
+    def drain(self):
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            counts = dict(connection.execute('SELECT video_id, count FROM views'))
+            connection.execute('DELETE FROM views')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        return counts
+
+
+class ViewCounter:
+
+    def __init__(self, buffer, flush_interval):
+        self.buffer = buffer
+        self.task = PeriodicTask('view-counter-flush', flush_interval, self.flush)
+
+    def record(self, video_id):
+        self.buffer.add(video_id)
+        self.task.start()
+
+    def flush(self):
+        counts = self.buffer.drain()
+        if not counts:
+            return 0
+
+        by_count = defaultdict(list)
+        for video_id, count in counts.items():
+            by_count[count].append(video_id)
+        try:
+            with transaction.atomic():
+                for count, video_ids in by_count.items():
+                    Video.objects.filter(id__in=video_ids).update(views=F('views') + count)
+                record_views(counts)
+        except Exception:
+            for video_id, count in counts.items():
+                self.buffer.add(video_id, count)
+            raise
+        return sum(counts.values())
+
+
+_view_counter = None
+_view_counter_lock = threading.Lock()
+
+
+def get_view_counter():
+    global _view_counter
+    if _view_counter is None:
+        with _view_counter_lock:
+            if _view_counter is None:
+                if settings.VIEW_COUNTER_BACKEND == 'sqlite':
+                    buffer = SQLiteViewBuffer(settings.VIEW_COUNTER_PATH)
+                else:
+                    buffer = MemoryViewBuffer()
+                _view_counter = ViewCounter(buffer, settings.VIEW_COUNTER_FLUSH_INTERVAL)
+                atexit.register(_view_counter.flush)
+    return _view_counter
@@ -1,22 +1,49 @@
+import itertools
+import json
 import random
-import requests
 from rest_framework import status, permissions
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.serializers import TokenObtainSlidingSerializer
-from rest_framework_simplejwt.tokens import SlidingToken
-from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework_simplejwt.views import TokenObtainSlidingView
+from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from rest_framework.pagination import PageNumberPagination
-from django.contrib.postgres.search import SearchVector, SearchQuery
 from django.contrib.auth.models import update_last_login
+from django.db import transaction
+from django.db.models import Prefetch
+from django.urls import reverse
+from urllib.parse import urlencode
+from django.http import HttpResponse, StreamingHttpResponse
 from django.conf import settings
 from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import extend_schema, OpenApiParameter, OpenApiExample
-from .models import TimeStamp, ChangeRequest, Video
+from .models import TimeStamp, ChangeRequest, Video, VideoUpload, MediaJob, Device
+from .streaming import sign_stream, stream_file, stream_signature_user
+from .dispatcher import get_dispatcher
+from . import playback
+from . import devices
+from . import push
+from .viewcounter import get_view_counter
+from .throttling import BucketThrottle, admit_cue, settle_cue
+from .search import search_videos
+from .pagination import KeysetPaginationMixin, KEYSET_PARAMETERS
+from .caching import cached_response, invalidate
+from .routers import replica_reads
+from . import uploads
+from .apilog import get_pipeline
+from .authentication import ClaimsSlidingToken, current_claims
+from .entitlements import ahas_active_subscription, has_active_subscription
+from . import metrics
+from .signals import bulk_timestamp_changes
+from .parsers import CSVCueParser, JSONLinesCueParser, read_csv_cues, read_jsonl_cues
 from .serializators import (
     UserSerializer, TimeStampSerializer, VideoSerializer, 
     UserUpdateSerializer, Response400Serializer, PasswordUpdateSerializer, 
-    PasswordUpdateConfirmSerializer, TimeStampPaginateSchema, VideoPaginateSchema, TriggerSerializer
+    PasswordUpdateConfirmSerializer, TimeStampPaginateSchema, VideoPaginateSchema, TriggerSerializer,
+    TriggerQueuedSerializer, TriggerStatusSerializer, PlaybackStartSerializer, PlaybackControlSerializer,
+    PlaybackSessionSerializer, CueSerializer, TimeStampBulkResultSerializer, VideoUploadCreateSerializer,
+    VideoUploadSerializer, MediaJobSerializer, APILogStatsSerializer, TriggerResultSerializer, DeviceSerializer,
+    TimelineSerializer, VideoPlaySerializer
 )
 
 class IsAdminUserOrAuthenticated(permissions.BasePermission):
@@ -24,6 +51,47 @@ class IsAdminUserOrAuthenticated(permissions.BasePermission):
     def has_permission(self, request, view):
         return request.user.is_authenticated and (request.method in permissions.SAFE_METHODS or request.user.is_staff or request.user.is_superuser)
 
+class HasActiveSubscription(permissions.BasePermission):
+    message = 'An active subscription is required.'
+
+    def has_permission(self, request, view):
+        user = request.user
+        if not user.is_authenticated:
+            return False
+        if user.is_staff or user.is_superuser:
+            return True
+        return has_active_subscription(user.pk)
+
+    async def ahas_permission(self, request, view):
+        user = request.user
+        if not user.is_authenticated:
+            return False
+        if user.is_staff or user.is_superuser:
+            return True
+        return await ahas_active_subscription(user.pk)
+
+class HasStreamSignature(permissions.BasePermission):
+    """
+    Allows streaming URLs signed by the play endpoint, which players use
+    without a bearer token, as long as the user they were issued to is
+    still entitled.
+    """
+
+    def has_permission(self, request, view):
+        signature = request.query_params.get('signature')
+        user_id = stream_signature_user(signature, view.kwargs.get('video_id')) if signature else None
+        if user_id is None:
+            return False
+        claims = current_claims(user_id)
+        return bool(claims) and (any(claims) or has_active_subscription(user_id))
+
+class CanScrapeMetrics(permissions.BasePermission):
+
+    def has_permission(self, request, view):
+        if request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS:
+            return True
+        return request.user.is_authenticated and request.user.is_staff
+
 def generate_verification_code(length=settings.VERIFICATION_CODE_LENGTH):
     digits = "0123456789"
     verification_code = "".join(random.choice(digits) for _ in range(length))
@@ -33,6 +101,12 @@ def send_confirm_code(user, code):
     # Placeholder function to send the confirmation code to the user
     pass
 
+
+class LoginView(TokenObtainSlidingView):
+    throttle_classes = [BucketThrottle]
+    throttle_scope = 'login'
+
+
 class UserCreateView(APIView):
     @extend_schema(
         request=UserSerializer,
@@ -43,7 +117,7 @@ class UserCreateView(APIView):
         serializer = UserSerializer(data=request.data)
         if serializer.is_valid():
             serializer.save()
-            token = SlidingToken.for_user(serializer.instance)
+            token = ClaimsSlidingToken.for_user(serializer.instance)
             update_last_login(None, serializer.instance)
             return Response({'token': str(token)}, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -101,6 +175,8 @@ class UserPasswordUpdateView(APIView):
 
 class UserPasswordUpdateConfirmView(APIView):
     permission_classes = [permissions.IsAuthenticated]
+    throttle_classes = [BucketThrottle]
+    throttle_scope = 'password_reset_confirm'
     @extend_schema(
         request=PasswordUpdateConfirmSerializer,
         responses={204: None, 400: Response400Serializer},
@@ -112,10 +188,10 @@ class UserPasswordUpdateConfirmView(APIView):
         if not confirm_code:
             return Response({"detail": {'confirm_code': 'field is required'}}, status=status.HTTP_400_BAD_REQUEST)
 
-        ChangeRequest.cleanup_expired_user_change_requests(user, 'password')
-        try:
-            change_request = ChangeRequest.objects.get(user=user, confirm_code=confirm_code, field='password')
-        except ChangeRequest.DoesNotExist:
+        change_request = ChangeRequest.objects.filter(
+            user_id=user.pk, confirm_code=confirm_code, field='password', created_at__gte=ChangeRequest.expiry_cutoff()
+        ).order_by('-created_at').first()
+        if change_request is None:
             return Response({"detail": {'confirm_code': 'invalid or expired'}}, status=status.HTTP_400_BAD_REQUEST)
 
         user.set_password(change_request.new_value)
@@ -125,28 +201,56 @@ class UserPasswordUpdateConfirmView(APIView):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class TimeStampListView(APIView, PageNumberPagination):
+class TimeStampListView(KeysetPaginationMixin, APIView, PageNumberPagination):
     permission_classes = [permissions.IsAuthenticated]
     page_size_query_param = 'page_size'
+    keyset_ordering = ('created_at', 'id')
 
     @extend_schema(
         request=None, 
-        parameters=[OpenApiParameter(name='video_id', type=OpenApiTypes.INT, location=OpenApiParameter.PATH)],
+        parameters=[OpenApiParameter(name='video_id', type=OpenApiTypes.INT, location=OpenApiParameter.PATH)] + KEYSET_PARAMETERS,
         responses={200: TimeStampPaginateSchema(many=True), 400: Response400Serializer},
         description='Get timestamps for a video'
     )
+    @cached_response(lambda video_id: f'timestamps:{video_id}')
+    @replica_reads()
     def get(self, request, video_id):
         try:
             video_id = int(video_id)
         except ValueError:
             return Response({"detail": "Invalid video ID."}, status=status.HTTP_400_BAD_REQUEST)
 
-        timestamps = TimeStamp.objects.filter(video_id=video_id).order_by('created_at')
+        timestamps = TimeStamp.objects.filter(video_id=video_id).order_by('created_at', 'id')
         results = self.paginate_queryset(timestamps, request, view=self)
         serializer = TimeStampSerializer(results, many=True)
         return self.get_paginated_response(serializer.data)
 
 
+class TimeStampTimelineView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    @extend_schema(
+        request=None,
+        responses={200: TimelineSerializer, 304: None, 404: Response400Serializer},
+        description='Get the whole cue track of a video ordered by moment, as parallel arrays of offsets and aromas'
+    )
+    @cached_response(lambda video_id: f'timestamps:{video_id}', max_age=settings.TIMELINE_MAX_AGE)
+    @replica_reads()
+    def get(self, request, video_id):
+        cues = playback.load_cues(video_id)
+        if not cues and not Video.objects.filter(pk=video_id).exists():
+            return Response({"detail": {'video': "not found"}}, status=status.HTTP_404_NOT_FOUND)
+        return Response(timeline_data(video_id, cues), status=status.HTTP_200_OK)
+
+
+def timeline_data(video_id, cues):
+    return {
+        'video': video_id,
+        'offsets_ms': [round(moment * 1000) for moment, _ in cues],
+        'aromas': [aroma for _, aroma in cues],
+    }
+
+
 class TimeStampCreateView(APIView):
     permission_classes = [permissions.IsAdminUser]
 
@@ -174,18 +278,103 @@ class TimeStampCreateView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class VideoListView(APIView, PageNumberPagination):
+class TimeStampBulkView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+    parser_classes = [JSONParser, CSVCueParser, JSONLinesCueParser, MultiPartParser]
+
+    @extend_schema(
+        request=None,
+        parameters=[OpenApiParameter(name='video_id', type=OpenApiTypes.INT, location=OpenApiParameter.PATH),
+                    OpenApiParameter(name='file_format', enum=['csv', 'jsonl'], type=OpenApiTypes.STR, location=OpenApiParameter.QUERY)],
+        responses={(200, 'text/csv'): OpenApiTypes.STR, (200, 'application/x-ndjson'): OpenApiTypes.STR, 404: Response400Serializer},
+        description='Export the cue track of a video as CSV or JSON lines'
+    )
+    def get(self, request, video_id):
+        if not Video.objects.filter(id=video_id).exists():
+            return Response({"detail": {'video': "not found"}}, status=status.HTTP_404_NOT_FOUND)
+
+        file_format = request.query_params.get('file_format', 'csv')
+        if file_format not in ('csv', 'jsonl'):
+            return Response({"detail": {'file_format': "must be csv or jsonl"}}, status=status.HTTP_400_BAD_REQUEST)
+
+        cues = TimeStamp.objects.filter(video_id=video_id).order_by('moment').values_list('aroma', 'moment').iterator(chunk_size=2000)
+        if file_format == 'csv':
+            header = ['aroma,moment\n']
+            rows = (f'{aroma},{moment.isoformat()}\n' for aroma, moment in cues)
+            content_type = 'text/csv'
+        else:
+            header = []
+            rows = (json.dumps({'aroma': aroma, 'moment': moment.isoformat()}) + '\n' for aroma, moment in cues)
+            content_type = 'application/x-ndjson'
+
+        response = StreamingHttpResponse(itertools.chain(header, rows), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="video-{video_id}-cues.{file_format}"'
+        return response
+
+    @extend_schema(
+        request={'application/json': CueSerializer(many=True), 'text/csv': OpenApiTypes.STR,
+                 'application/x-ndjson': OpenApiTypes.STR, 'multipart/form-data': OpenApiTypes.BINARY},
+        parameters=[OpenApiParameter(name='video_id', type=OpenApiTypes.INT, location=OpenApiParameter.PATH),
+                    OpenApiParameter(name='replace', description='Replace the existing cue track', type=OpenApiTypes.BOOL, location=OpenApiParameter.QUERY)],
+        responses={201: TimeStampBulkResultSerializer, 400: Response400Serializer, 404: Response400Serializer, 409: Response400Serializer},
+        description='Import a cue track for a video from a JSON array, CSV, JSON lines or an uploaded file'
+    )
+    def post(self, request, video_id):
+        try:
+            video = Video.objects.get(id=video_id)
+        except Video.DoesNotExist:
+            return Response({"detail": {'video': "not found"}}, status=status.HTTP_404_NOT_FOUND)
+
+        rows = request.data
+        if 'file' in request.FILES:
+            upload = request.FILES['file']
+            rows = read_jsonl_cues(upload) if upload.name.endswith(('.jsonl', '.ndjson')) else read_csv_cues(upload)
+        if not isinstance(rows, list):
+            return Response({"detail": {'cues': "expected a list of cues"}}, status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = CueSerializer(data=rows, many=True)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        replace = request.query_params.get('replace', '').lower() in ('1', 'true', 'yes')
+        cues = serializer.validated_data
+        with transaction.atomic():
+            existing = TimeStamp.objects.filter(video=video)
+            deleted = 0
+            if replace:
+                # The cache is invalidated once on commit, not per deleted row.
+                with bulk_timestamp_changes():
+                    deleted, _ = existing.delete()
+            else:
+                conflicts = existing.filter(moment__in=[cue['moment'] for cue in cues]).values_list('moment', flat=True)
+                conflicts = sorted(moment.isoformat() for moment in conflicts)
+                if conflicts:
+                    return Response({"detail": {'duplicate_moments': conflicts}}, status=status.HTTP_409_CONFLICT)
+            created = TimeStamp.objects.bulk_create([TimeStamp(video=video, **cue) for cue in cues], batch_size=1000)
+            transaction.on_commit(lambda: invalidate(f'timestamps:{video.id}'))
+
+        return Response({'created': len(created), 'deleted': deleted}, status=status.HTTP_201_CREATED)
+
+
+class VideoListView(KeysetPaginationMixin, APIView, PageNumberPagination):
     parser_classes = [FormParser, MultiPartParser]
     permission_classes = [IsAdminUserOrAuthenticated]
     page_size_query_param = 'page_size'
+    keyset_ordering = ('-views', '-id')
 
     @extend_schema(
         request=None, 
+        parameters=KEYSET_PARAMETERS,
         responses={200: VideoPaginateSchema(many=True), 400: Response400Serializer},
         description='Get all videos'
     )
+    @cached_response('videos')
     def get(self, request):
-        videos = Video.objects.order_by('-views')
+        return self.list_page(request)
+
+    @replica_reads()
+    def list_page(self, request):
+        videos = Video.objects.order_by('-views', '-id')
         results = self.paginate_queryset(videos, request, view=self)
         serializer = VideoSerializer(results, many=True)
         return self.get_paginated_response(serializer.data)
@@ -205,8 +394,81 @@ class VideoListView(APIView, PageNumberPagination):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class VideoUploadCreateView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    @extend_schema(
+        request=VideoUploadCreateSerializer,
+        responses={201: VideoUploadSerializer, 400: Response400Serializer},
+        description='Start a resumable chunked video upload'
+    )
+    def post(self, request):
+        serializer = VideoUploadCreateSerializer(data=request.data)
+        if serializer.is_valid():
+            upload = uploads.create_upload(request.user, **serializer.validated_data)
+            return Response(VideoUploadSerializer(upload).data, status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class VideoUploadView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    @extend_schema(
+        request=None,
+        responses={200: VideoUploadSerializer, 404: Response400Serializer},
+        description='Get the received chunks of a video upload to resume it'
+    )
+    def get(self, request, upload_id):
+        try:
+            upload = VideoUpload.objects.get(id=upload_id, user_id=request.user.pk)
+        except VideoUpload.DoesNotExist:
+            return Response({"detail": {'upload': "not found"}}, status=status.HTTP_404_NOT_FOUND)
+        return Response(VideoUploadSerializer(upload).data, status=status.HTTP_200_OK)
+
+
+class VideoUploadChunkView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    @extend_schema(
+        request={'application/octet-stream': OpenApiTypes.BINARY},
+        parameters=[OpenApiParameter(name='X-Chunk-SHA256', description='Hex SHA-256 of the chunk', type=OpenApiTypes.STR, location=OpenApiParameter.HEADER)],
+        responses={204: None, 400: Response400Serializer, 404: Response400Serializer},
+        description='Upload one chunk of a video; chunks may be sent in any order and re-sent'
+    )
+    def put(self, request, upload_id, index):
+        try:
+            upload = VideoUpload.objects.get(id=upload_id, user_id=request.user.pk)
+        except VideoUpload.DoesNotExist:
+            return Response({"detail": {'upload': "not found"}}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            uploads.write_chunk(upload, index, request.stream, request.headers.get('X-Chunk-SHA256'))
+        except uploads.UploadError as exc:
+            return Response({"detail": {'chunk': str(exc)}}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class VideoUploadCompleteView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    @extend_schema(
+        request=None,
+        responses={201: VideoSerializer, 400: Response400Serializer, 404: Response400Serializer},
+        description='Verify all chunks and create the video'
+    )
+    def post(self, request, upload_id):
+        try:
+            upload = VideoUpload.objects.get(id=upload_id, user_id=request.user.pk)
+        except VideoUpload.DoesNotExist:
+            return Response({"detail": {'upload': "not found"}}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            video = uploads.complete_upload(upload)
+        except uploads.UploadError as exc:
+            return Response({"detail": {'upload': str(exc)}}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(VideoSerializer(video).data, status=status.HTTP_201_CREATED)
+
+
 class VideoDetailView(APIView):
-    permission_classes = [permissions.IsAuthenticated]
+    permission_classes = [HasActiveSubscription]
 
     @extend_schema(
         request=None, 
@@ -225,66 +487,337 @@ class VideoDetailView(APIView):
         except Video.DoesNotExist:
             return Response({"detail": {'video': "not found"}}, status=status.HTTP_404_NOT_FOUND)
 
+        get_view_counter().record(video.id)
         video.views += 1
-        video.save()
         serializer = VideoSerializer(video)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
-class PopularVideoListView(APIView, PageNumberPagination):
+class VideoPlayView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    @extend_schema(
+        request=None,
+        parameters=[OpenApiParameter(name='video_id', type=OpenApiTypes.INT, location=OpenApiParameter.PATH)],
+        responses={200: VideoPlaySerializer, 404: Response400Serializer},
+        description='Get everything needed to start playback: video, cue track, signed stream URL and entitlement'
+    )
+    def get(self, request, video_id):
+        cues = Prefetch('timestamp_set', queryset=TimeStamp.objects.order_by('moment', 'id').only('id', 'video', 'moment', 'aroma'))
+        video = Video.objects.prefetch_related(cues).filter(id=video_id).first()
+        if video is None:
+            return Response({"detail": {'video': "not found"}}, status=status.HTTP_404_NOT_FOUND)
+
+        user = request.user
+        entitled = user.is_staff or user.is_superuser or has_active_subscription(user.pk)
+        stream_url = None
+        if entitled:
+            get_view_counter().record(video.id)
+            video.views += 1
+            if video.file:
+                query = urlencode({'signature': sign_stream(video.id, user.pk)})
+                stream_url = request.build_absolute_uri(f"{reverse('video_stream', args=[video.id])}?{query}")
+
+        video_data = VideoSerializer(video).data
+        if not entitled:
+            video_data.update(stream=None, rendition_stream=None)
+        cues = [(playback.moment_to_seconds(timestamp.moment), timestamp.aroma) for timestamp in video.timestamp_set.all()]
+        return Response({
+            'video': video_data,
+            'timeline': timeline_data(video.id, cues),
+            'entitled': entitled,
+            'stream_url': stream_url,
+        }, status=status.HTTP_200_OK)
+
+
+class VideoStreamView(APIView):
+    permission_classes = [HasStreamSignature | HasActiveSubscription]
+
+    @extend_schema(
+        request=None,
+        parameters=[OpenApiParameter(name='video_id', type=OpenApiTypes.INT, location=OpenApiParameter.PATH),
+                    OpenApiParameter(name='rendition', description='1 streams the lower bitrate rendition', type=OpenApiTypes.BOOL),
+                    OpenApiParameter(name='Range', description='Single byte range, e.g. bytes=1000-', type=OpenApiTypes.STR, location=OpenApiParameter.HEADER)],
+        responses={(200, 'video/mp4'): OpenApiTypes.BINARY, (206, 'video/mp4'): OpenApiTypes.BINARY, 403: Response400Serializer, 404: Response400Serializer},
+        description='Stream the video file with byte range support, authorised by a bearer token or the signature of a play response'
+    )
+    def get(self, request, video_id):
+        try:
+            video = Video.objects.only('id', 'file', 'rendition').get(id=video_id)
+        except Video.DoesNotExist:
+            return Response({"detail": {'video': "not found"}}, status=status.HTTP_404_NOT_FOUND)
+        rendition = request.query_params.get('rendition', '').lower() in ('1', 'true', 'yes')
+        file = video.rendition if rendition else video.file
+        if not file:
+            return Response({"detail": {'video': "file not found"}}, status=status.HTTP_404_NOT_FOUND)
+        return stream_file(request, file)
+
+
+class VideoProcessingView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    @extend_schema(
+        request=None,
+        parameters=[OpenApiParameter(name='video_id', type=OpenApiTypes.INT, location=OpenApiParameter.PATH)],
+        responses={200: MediaJobSerializer, 404: Response400Serializer},
+        description='Get the latest media processing job of a video'
+    )
+    def get(self, request, video_id):
+        job = MediaJob.objects.filter(video_id=video_id).order_by('-created_at').first()
+        if job is None:
+            return Response({"detail": {'video': "no processing job"}}, status=status.HTTP_404_NOT_FOUND)
+        return Response(MediaJobSerializer(job).data, status=status.HTTP_200_OK)
+
+
+class PopularVideoListView(KeysetPaginationMixin, APIView, PageNumberPagination):
     permission_classes = [permissions.IsAuthenticated]
     page_size_query_param = 'page_size'
+    keyset_ordering = ('trending_rank', 'id')
 
     @extend_schema(
         request=None, 
+        parameters=KEYSET_PARAMETERS,
         responses={200: VideoPaginateSchema(many=True), 400: Response400Serializer},
-        description='Get popular videos'
+        description='Get trending videos, ranked by recent views; by lifetime views until the first ranking'
     )
+    @cached_response('videos')
+    @replica_reads()
     def get(self, request):
-        videos = Video.objects.order_by('-views')
+        videos = Video.objects.filter(trending_rank__isnull=False).order_by('trending_rank', 'id')
+        if not videos.exists():
+            self.keyset_ordering = ('-views', '-id')
+            videos = Video.objects.order_by(*self.keyset_ordering)
         results = self.paginate_queryset(videos, request, view=self)
         serializer = VideoSerializer(results, many=True)
         return self.get_paginated_response(serializer.data)
 
 
-class SearchVideoListView(APIView, PageNumberPagination):
+class SearchVideoListView(KeysetPaginationMixin, APIView, PageNumberPagination):
     permission_classes = [permissions.IsAuthenticated]
     page_size_query_param = 'page_size'
+    keyset_ordering = ('-views', '-id')
 
     @extend_schema(
-        parameters=[OpenApiParameter(name='query', description='Search video list', type=OpenApiTypes.STR, location=OpenApiParameter.QUERY)],
+        parameters=[OpenApiParameter(name='query', description='Search video list', type=OpenApiTypes.STR, location=OpenApiParameter.QUERY),
+                    OpenApiParameter(name='rank', description='Order by relevance instead of views', type=OpenApiTypes.BOOL, location=OpenApiParameter.QUERY)] + KEYSET_PARAMETERS,
         request=None, 
         responses={200: VideoPaginateSchema(many=True), 400: Response400Serializer},
         description='Search videos'
     )
+    @replica_reads()
     def get(self, request):
         query = request.query_params.get('query', None)
         if not query:
             return Response({"detail": {'query': "field is required."}}, status=status.HTTP_400_BAD_REQUEST)
 
-        search_vector = SearchVector('title', 'description')
-        search_query = SearchQuery(query)
-        videos = Video.objects.annotate(search=search_vector).filter(search=search_query).order_by('-views')
+        rank = request.query_params.get('rank', '').lower() in ('1', 'true', 'yes')
+        videos = search_videos(query, rank=rank)
         results = self.paginate_queryset(videos, request, view=self)
         serializer = VideoSerializer(results, many=True)
         return self.get_paginated_response(serializer.data)
 
 
 class TriggerListView(APIView):
-    permission_classes = [permissions.IsAuthenticated]
+    permission_classes = [HasActiveSubscription]
+    throttle_classes = [BucketThrottle]
+    throttle_scope = 'trigger'
 
     @extend_schema(
         request=TriggerSerializer,
-        responses={204: None, 400: Response400Serializer},
-        description='Activate trigger'
+        parameters=[OpenApiParameter(name='async', description='Queue the command and return 202 immediately', type=OpenApiTypes.BOOL, location=OpenApiParameter.QUERY)],
+        responses={204: None, 202: TriggerQueuedSerializer, 207: TriggerResultSerializer, 400: Response400Serializer, 429: Response400Serializer,
+                   502: TriggerResultSerializer},
+        description='Activate trigger on every active device of the user or of a room'
     )
     def post(self, request):
         serializer = TriggerSerializer(data=request.data)
         if serializer.is_valid():
             aroma = serializer.validated_data['timestamp'].aroma
-            arduino_url = settings.ARDUINO_URL.format(aroma)
-            response = requests.get(arduino_url)
-            if response.status_code == 200:
-                return Response(status=status.HTTP_204_NO_CONTENT)
-            return Response({"error": f"Failed to trigger aroma {aroma}"}, status=response.status_code)
+            targets = devices.resolve_targets(request.user.pk, serializer.validated_data.get('room'))
+            if not targets:
+                return Response({"detail": {'room': "no active devices"}}, status=status.HTTP_404_NOT_FOUND)
+            targets, coalesced = admit_cue(request.user.pk, targets, aroma)
+            if not targets:
+                return self.coalesced_response(request, coalesced)
+            templates = [target.url for target in targets]
+            if self.is_async(request):
+                delivery_ids = devices.enqueue_cue(templates, aroma)
+                settle_cue(request.user.pk, targets, aroma, [bool(delivery) for delivery in delivery_ids], delivery_ids)
+                return self.queued_response(delivery_ids)
+
+            results = devices.send_cue(templates, aroma)
+            settle_cue(request.user.pk, targets, aroma, [result.ok for result in results])
+            devices.record_health(targets, results)
+            return self.delivery_response(aroma, targets, results)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    @classmethod
+    def coalesced_response(cls, request, delivery_ids):
+        """
+        Every target got the same aroma moments ago: an async request is
+        answered with the deliveries already queued for it.
+        """
+        if cls.is_async(request) and any(delivery_ids):
+            return cls.queued_response(delivery_ids)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @staticmethod
+    def queued_response(delivery_ids):
+        if not any(delivery_ids):
+            return Response({"error": "Device queue is full"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response({'delivery': next(filter(None, delivery_ids)), 'deliveries': delivery_ids}, status=status.HTTP_202_ACCEPTED)
+
+    @staticmethod
+    def delivery_response(aroma, targets, results):
+        if all(result.ok for result in results):
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        if len(results) > 1:
+            data = {'devices': [dict(result.as_dict(), device=target.device_id) for target, result in zip(targets, results)]}
+            if any(result.ok for result in results):
+                return Response(data, status=status.HTTP_207_MULTI_STATUS)
+            return Response(dict(data, error=f"Failed to trigger aroma {aroma}"), status=status.HTTP_502_BAD_GATEWAY)
+        result = results[0]
+        if result.status_code is None:
+            return Response({"error": f"Failed to trigger aroma {aroma}: {result.error}"}, status=status.HTTP_504_GATEWAY_TIMEOUT)
+        return Response({"error": f"Failed to trigger aroma {aroma}"}, status=result.status_code)
+
+    @staticmethod
+    def is_async(request):
+        value = request.query_params.get('async')
+        if value is None:
+            return settings.ARDUINO_ASYNC_TRIGGERS
+        return value.lower() in ('1', 'true', 'yes')
+
+
+class TriggerStatusView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    @extend_schema(
+        request=None,
+        responses={200: TriggerStatusSerializer, 404: Response400Serializer},
+        description='Get trigger delivery status'
+    )
+    def get(self, request, delivery_id):
+        if delivery_id.startswith(push.DELIVERY_PREFIX):
+            delivery = push.message_status(delivery_id, request.user.pk)
+        else:
+            delivery = get_dispatcher().status(delivery_id)
+        if delivery is None:
+            return Response({"detail": {'delivery': "not found"}}, status=status.HTTP_404_NOT_FOUND)
+        return Response(delivery, status=status.HTTP_200_OK)
+
+
+def playback_session_data(session):
+    return {
+        'id': session['id'],
+        'video': session['video'],
+        'state': session['state'],
+        'position': round(playback.position(session), 3),
+        'cues': session['cues'],
+    }
+
+
+class PlaybackSessionCreateView(APIView):
+    permission_classes = [HasActiveSubscription]
+    throttle_classes = [BucketThrottle]
+    throttle_scope = 'playback'
+
+    @extend_schema(
+        request=PlaybackStartSerializer,
+        responses={201: PlaybackSessionSerializer, 400: Response400Serializer, 429: Response400Serializer},
+        description='Start server-side aroma playback for a video'
+    )
+    def post(self, request):
+        serializer = PlaybackStartSerializer(data=request.data)
+        if serializer.is_valid():
+            session = playback.start_session(request.user, serializer.validated_data['video'], serializer.validated_data['offset'],
+                                             serializer.validated_data.get('room'))
+            return Response(playback_session_data(session), status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class PlaybackSessionView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_session(self, request, session_id):
+        session = playback.get_session(session_id)
+        if session is None or session['user'] != request.user.pk:
+            return None
+        return session
+
+    @extend_schema(
+        request=None,
+        responses={200: PlaybackSessionSerializer, 404: Response400Serializer},
+        description='Get playback session state'
+    )
+    def get(self, request, session_id):
+        session = self.get_session(request, session_id)
+        if session is None:
+            return Response({"detail": {'session': "not found"}}, status=status.HTTP_404_NOT_FOUND)
+        return Response(playback_session_data(session), status=status.HTTP_200_OK)
+
+    @extend_schema(
+        request=PlaybackControlSerializer,
+        responses={200: PlaybackSessionSerializer, 400: Response400Serializer, 404: Response400Serializer, 409: Response400Serializer},
+        description='Pause, resume, seek or stop a playback session'
+    )
+    def post(self, request, session_id):
+        session = self.get_session(request, session_id)
+        if session is None:
+            return Response({"detail": {'session': "not found"}}, status=status.HTTP_404_NOT_FOUND)
+        serializer = PlaybackControlSerializer(data=request.data)
+        if serializer.is_valid():
+            if session['state'] == playback.STATE_STOPPED and serializer.validated_data['action'] != 'stop':
+                return Response({"detail": {'session': "already stopped"}}, status=status.HTTP_409_CONFLICT)
+            session = playback.control_session(session, serializer.validated_data['action'], serializer.validated_data.get('offset'))
+            return Response(playback_session_data(session), status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    @extend_schema(
+        request=None,
+        responses={204: None, 404: Response400Serializer},
+        description='Stop a playback session'
+    )
+    def delete(self, request, session_id):
+        session = self.get_session(request, session_id)
+        if session is None:
+            return Response({"detail": {'session': "not found"}}, status=status.HTTP_404_NOT_FOUND)
+        playback.control_session(session, 'stop')
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class APILogStatsView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    @extend_schema(
+        request=None,
+        responses={200: APILogStatsSerializer},
+        description='Get API log pipeline counters of the current worker'
+    )
+    def get(self, request):
+        return Response(get_pipeline().stats(), status=status.HTTP_200_OK)
+
+
+class MetricsView(APIView):
+    permission_classes = [CanScrapeMetrics]
+
+    @extend_schema(
+        request=None,
+        responses={(200, 'text/plain'): OpenApiTypes.STR},
+        description='Get latency, query and device call metrics of all workers on the host in the Prometheus text format'
+    )
+    def get(self, request):
+        return HttpResponse(metrics.get_registry().render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class DeviceListView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    @extend_schema(
+        request=None,
+        responses={200: DeviceSerializer(many=True)},
+        description='List aroma devices of the current user with their health'
+    )
+    def get(self, request):
+        queryset = Device.objects.filter(user_id=request.user.pk).order_by('id')
+        return Response(DeviceSerializer(queryset, many=True).data, status=status.HTTP_200_OK)
\ No newline at end of file
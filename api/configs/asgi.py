@@ -2,6 +2,9 @@
 ASGI config for config project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP is served by Django; WebSocket connections on DEVICE_PUSH_PATH are
+handed to the device push gateway. With AROMASTREAM_ASYNC_VIEWS=1 the
+video list, video detail and trigger endpoints run as async views.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
@@ -11,6 +14,37 @@ import os
 
 from django.core.asgi import get_asgi_application
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'configs.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from django.conf import settings  # noqa: E402
+from aromastream.dispatcher import get_async_dispatcher  # noqa: E402
+from aromastream.push import DeviceGateway  # noqa: E402
+
+device_gateway = DeviceGateway()
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await device_gateway.startup()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await device_gateway.shutdown()
+            await get_async_dispatcher().aclose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+    elif scope['type'] == 'websocket':
+        if scope['path'] == settings.DEVICE_PUSH_PATH:
+            await device_gateway(scope, receive, send)
+        else:
+            await send({'type': 'websocket.close', 'code': 4404})
+    else:
+        await django_application(scope, receive, send)
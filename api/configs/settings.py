@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 from datetime import timedelta
 
@@ -18,11 +19,12 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'django.contrib.sessions',
-    'drf_api_logger',
     "corsheaders",
 ]
 
 MIDDLEWARE = [
+    'aromastream.metrics.MetricsMiddleware',
+    'aromastream.apilog.APILogMiddleware',
     "corsheaders.middleware.CorsMiddleware",
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -31,14 +33,28 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'drf_api_logger.middleware.api_logger_middleware.APILoggerMiddleware',
 ]
 
 ROOT_URLCONF = 'configs.urls'
 
-DRF_API_LOGGER_DATABASE = True
-DRF_LOGGER_QUEUE_MAX_SIZE = 50
-DRF_API_LOGGER_EXCLUDE_KEYS = ['password', 'token']
+API_LOG_ENABLED = True
+API_LOG_PATH_PREFIX = '/api/'
+API_LOG_SINK = 'jsonl'
+API_LOG_PATH = BASE_DIR / 'logs' / 'api.jsonl'
+API_LOG_DATABASE = 'default'
+API_LOG_BUFFER_SIZE = 10000
+API_LOG_BATCH_SIZE = 1000
+API_LOG_FLUSH_INTERVAL = 5
+API_LOG_SKIP = ['trigger_status']
+API_LOG_SAMPLE_RATES = {'trigger': 0.1}
+
+METRICS_ENABLED = True
+METRICS_ALLOWED_IPS = ['127.0.0.1']
+METRICS_SLOW_REQUEST_THRESHOLD = None
+METRICS_SLOW_REQUEST_MAX_QUERIES = 50
+METRICS_BACKEND = 'sqlite'
+METRICS_PATH = BASE_DIR / 'metrics.sqlite3'
+METRICS_FLUSH_INTERVAL = 5
 
 
 """
@@ -67,10 +83,15 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'configs.wsgi.application'
+ASGI_APPLICATION = 'configs.asgi.application'
+
+# Serve the video list, video detail and trigger endpoints with async views;
+# set by the ASGI deployment profile.
+ASYNC_VIEWS = os.environ.get('AROMASTREAM_ASYNC_VIEWS') == '1'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'aromastream.authentication.ClaimsJWTAuthentication',
     ),
     'DEFAULT_RENDERER_CLASSES': [
         'rest_framework.renderers.JSONRenderer',
@@ -81,6 +102,7 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 15,
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    'NUM_PROXIES': 0,
 }
 
 SPECTACULAR_SETTINGS = {
@@ -93,6 +115,16 @@ SPECTACULAR_SETTINGS = {
                              'rest_framework.authentication.BasicAuthentication']
 }
 
+DATABASE_CONN_MAX_AGE = 60
+DATABASE_CONN_HEALTH_CHECKS = True
+DATABASE_POOL = ASYNC_VIEWS
+# Connections all uvicorn workers of the ASGI profile may hold together;
+# uvicorn reads its worker count from WEB_CONCURRENCY as well.
+DATABASE_POOL_CONNECTIONS = 20
+DATABASE_POOL_SIZE = max(DATABASE_POOL_CONNECTIONS // int(os.environ.get('WEB_CONCURRENCY', 1)), 1)
+DATABASE_POOL_TIMEOUT = 10
+DATABASE_REPLICAS = []
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -101,20 +133,147 @@ DATABASES = {
         'PASSWORD': '8995',
         'HOST': 'localhost',
         'PORT': 5432,
+        'CONN_MAX_AGE': DATABASE_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': DATABASE_CONN_HEALTH_CHECKS,
     }
 }
+if DATABASE_POOL:
+    DATABASES['default'].update({
+        'ENGINE': 'aromastream.backends.pooled_postgresql',
+        'CONN_MAX_AGE': 0,
+        'OPTIONS': {'pool': {'size': DATABASE_POOL_SIZE, 'timeout': DATABASE_POOL_TIMEOUT}},
+    })
+for index, replica in enumerate(DATABASE_REPLICAS, 1):
+    DATABASES[f'replica{index}'] = {**DATABASES['default'], **replica, 'TEST': {'MIRROR': 'default'}}
+DATABASE_READ_REPLICAS = [f'replica{index}' for index in range(1, len(DATABASE_REPLICAS) + 1)]
+DATABASE_REPLICA_MAX_LAG = 10
+
+CACHE_MAX_ENTRIES = 100000
+ARDUINO_STATUS_MAX_ENTRIES = 10000
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
+        'OPTIONS': {'MAX_ENTRIES': CACHE_MAX_ENTRIES},
+    },
+    'deliveries': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'deliveries',
+        'OPTIONS': {'MAX_ENTRIES': ARDUINO_STATUS_MAX_ENTRIES},
+    },
+    'catalogue': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'catalogue',
+    },
+}
+
+CATALOGUE_CACHE = 'catalogue'
+CATALOGUE_VERSION_CACHE = 'default'
+CATALOGUE_CACHE_TIMEOUT = 60
+
+TIMELINE_MAX_AGE = 60
+
+ENTITLEMENT_CACHE = 'default'
+ENTITLEMENT_CACHE_TIMEOUT = 300
+ENTITLEMENT_LOCAL_TTL = 5
+
+DATABASE_ROUTERS = ['aromastream.routers.APILogRouter', 'aromastream.routers.ReplicaRouter']
 
 ARDUINO_URL = 'localhost:1203/{}'
+ARDUINO_CONNECT_TIMEOUT = 1.5
+ARDUINO_READ_TIMEOUT = 5
+ARDUINO_POOL_SIZE = 4
+ARDUINO_QUEUE_SIZE = 32
+ARDUINO_STATUS_TTL = 300
+ARDUINO_STATUS_CACHE = 'deliveries'
+ARDUINO_ASYNC_TRIGGERS = False
+
+DEVICE_BREAKER_THRESHOLD = 3
+DEVICE_BREAKER_COOLDOWN = 30
+DEVICE_FANOUT_WORKERS = 8
+DEVICE_HEALTH_WRITE_INTERVAL = 60
+
+DEVICE_PUSH_PATH = '/ws/devices/'
+DEVICE_PUSH_LISTEN = True
+DEVICE_PUSH_POLL_INTERVAL = 5
+DEVICE_PUSH_MESSAGE_TTL = 30
+DEVICE_PUSH_BATCH_SIZE = 100
+
+THROTTLE_BACKEND = 'sqlite'
+THROTTLE_PATH = BASE_DIR / 'throttle.sqlite3'
+THROTTLE_POLICIES = {
+    'login': {'user': ('10/min', 5), 'ip': ('30/min', 10)},
+    'password_reset_confirm': {'user': ('5/min', 5), 'ip': ('30/min', 10)},
+    'trigger': {'user': ('120/min', 10), 'ip': ('600/min', 60), 'device': ('60/min', 10)},
+    'playback': {'user': ('10/min', 5), 'ip': ('60/min', 20)},
+}
+TRIGGER_COALESCE_WINDOW = 1.0
+
+SEARCH_CONFIG = None
+SEARCH_VECTOR_WEIGHTS = {'title': 'A', 'description': 'B'}
+
+VIEW_COUNTER_BACKEND = 'sqlite'
+VIEW_COUNTER_PATH = BASE_DIR / 'views.sqlite3'
+VIEW_COUNTER_FLUSH_INTERVAL = 30
+
+TRENDING_HALF_LIFE = 24 * 60 * 60
+TRENDING_UPDATE_INTERVAL = None
+TRENDING_TOP_N = 100
+TRENDING_MIN_SCORE = 0.01
+TRENDING_BUCKET_RETENTION = 7 * 24 * 60 * 60
+
+PLAYBACK_SESSION_TTL = 6 * 60 * 60
+PLAYBACK_POLL_INTERVAL = 0.25
+PLAYBACK_LATE_TOLERANCE = 2
+PLAYBACK_PREDELIVERY_HORIZON = 10
+
+LEAD_TIME_CACHE = 'default'
+LEAD_TIME_DEFAULT = 1.0
+LEAD_TIME_ALPHA = 0.2
+LEAD_TIME_MAX = 5
+LEAD_TIME_DEVIATIONS = 1
+LEAD_TIME_HTTP_ACTUATION = 2.0
 
 SIMPLE_JWT = {
     "SLIDING_TOKEN_LIFETIME": timedelta(days=30),
     "SLIDING_TOKEN_REFRESH_LIFETIME": timedelta(seconds=1),
     'UPDATE_LAST_LOGIN': True,
     'AUTH_TOKEN_CLASSES': ('rest_framework_simplejwt.tokens.SlidingToken',),
-    'TOKEN_TYPE_CLAIM': 'sliding'
+    'TOKEN_TYPE_CLAIM': 'sliding',
+    'SLIDING_TOKEN_OBTAIN_SERIALIZER': 'aromastream.authentication.ClaimsTokenObtainSlidingSerializer',
 }
 
+JWT_VERIFIED_TOKEN_CACHE_TTL = 30
+JWT_VERIFIED_TOKEN_CACHE_SIZE = 10000
+JWT_CLAIMS_CACHE = 'default'
+JWT_CLAIMS_CACHE_TIMEOUT = 300
+JWT_CLAIMS_LOCAL_TTL = 5
+
 VERIFICATION_CODE_LENGTH = 6
+CHANGE_REQUEST_TTL = 60 * 60
+CHANGE_REQUEST_REAP_INTERVAL = None
+CHANGE_REQUEST_REAP_BATCH_SIZE = 1000
+
+TIMESTAMP_BULK_MAX = 10000
+
+VIDEO_STREAM_ACCEL_PREFIX = None
+VIDEO_STREAM_BLOCK_SIZE = 64 * 1024
+VIDEO_STREAM_URL_TTL = 6 * 60 * 60
+
+FFMPEG_BINARY = 'ffmpeg'
+FFPROBE_BINARY = 'ffprobe'
+MEDIA_JOB_MAX_ATTEMPTS = 3
+MEDIA_JOB_TIMEOUT = 2 * 60 * 60
+MEDIA_JOB_RETRY_DELAY = 60
+MEDIA_POSTER_OFFSET = 1
+MEDIA_RENDITION_HEIGHT = 480
+MEDIA_RENDITION_CRF = 28
+
+VIDEO_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+VIDEO_UPLOAD_MAX_CHUNK_SIZE = 64 * 1024 * 1024
+VIDEO_UPLOAD_MAX_SIZE = 50 * 1024 * 1024 * 1024
+VIDEO_UPLOAD_TTL = 7 * 24 * 60 * 60
 
 AUTH_PASSWORD_VALIDATORS = [
     {